@@ -8,26 +8,48 @@ const HeatmapLayer = () => {
   const map = useMap();
 
   useEffect(() => {
+    // The heatmap layer is created once and its points are replaced on every map move
+    const heatLayer = L.heatLayer([], { radius: 25, blur: 15, maxZoom: 17 }).addTo(map);
+    let controller = null;
+
     const fetchData = async () => {
+      // Cancel the request for the previous viewport if it is still running
+      if (controller) controller.abort();
+      controller = new AbortController();
+
+      const bounds = map.getBounds();
+      const params = new URLSearchParams({
+        zoom: map.getZoom(),
+        south: bounds.getSouth(),
+        west: bounds.getWest(),
+        north: bounds.getNorth(),
+        east: bounds.getEast(),
+      });
+
       try {
-        const response = await fetch('http://localhost:8000/data');
+        // The server returns pre-binned [latitude, longitude, count] points for the viewport
+        const response = await fetch(`http://localhost:8000/heatmap?${params}`, { signal: controller.signal });
         const data = await response.json();
-        const points = data.map(item => [item.latitude, item.longitude, 8]); // Assuming intensity is 1 for all points
-        // Log points to the console (can be removed after verification)
-        console.log(points);
-        // Add a heatmap layer to the map with the fetched points
-        L.heatLayer(points, { radius: 25, blur: 15, maxZoom: 17 }).addTo(map);
-
-        // Optional: if you want to remove the heatmap layer later, you can store it in a state and use map.removeLayer(heatLayer)
+        const maxCount = data.max || 1;
+        heatLayer.setLatLngs(data.points.map(([lat, lng, count]) => [lat, lng, count / maxCount]));
       } catch (error) {
-        console.error('Failed to load data:', error);
+        if (error.name !== 'AbortError') {
+          console.error('Failed to load data:', error);
+        }
       }
     };
 
     fetchData();
+    map.on('moveend', fetchData);
+
+    return () => {
+      map.off('moveend', fetchData);
+      if (controller) controller.abort();
+      map.removeLayer(heatLayer);
+    };
   }, [map]);
 
   return null;
 };
 
-export default HeatmapLayer;
\ No newline at end of file
+export default HeatmapLayer;
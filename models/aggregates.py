@@ -0,0 +1,275 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Administrative hierarchy the cube is indexed by, from the widest to the narrowest level
+LEVELS = ("district_name", "unitname", "beat_name")
+
+# Fields whose most frequent values are fed to the analysis prompts
+FREQUENCY_FIELDS = (
+    "Crime_Type",
+    "crime_group_name",
+    "month",
+    "accused_age",
+    "victim_age",
+    "accused_caste",
+    "victim_caste",
+    "accused_profession",
+    "victim_profession",
+)
+
+# Columns the temporal histograms are derived from
+TIME_COLUMN = "Offence_From_Time_only"
+DATE_COLUMN = "Offence_From_Date_only"
+
+# Number of bins of each temporal histogram; bin i holds hour i, week i + 1 or month i + 1
+HISTOGRAM_BINS = {"hour": 24, "week": 53, "month": 12}
+
+# Default number of top values returned for a field
+TOP_N = 10
+
+# Values that carry no information, as filtered by the Node backend's getTopOccurrences
+_BLANK_VALUE = r'^[-,\s]*$'
+
+# Constant column grouped on for the whole-state level, so it shares the code path of the others
+_ALL = "_all"
+
+
+def _plain(value):
+    # Convert NumPy scalars to Python ones and drop the .0 from whole floats such as ages
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return value
+
+
+def temporal_bins(frame):
+    """
+    Derives the hour, week and month bin of every row, -1 where it is unknown.
+
+    Weeks are numbered like the Node backend's getWeekNumber: days 1-7 of the year are
+    week 1, days 8-14 week 2 and so on.
+
+    Returns:
+        A dict mapping histogram name to an integer array with one bin per row.
+    """
+    bins = {}
+    if TIME_COLUMN in frame.columns:
+        # expand=True also works when every time is missing, where .str[0] would fail
+        hours = pd.to_numeric(frame[TIME_COLUMN].astype(str).str.split(':', n=1, expand=True)[0], errors='coerce')
+        bins["hour"] = hours.where((hours >= 0) & (hours < 24)).fillna(-1).to_numpy(dtype=np.int64)
+    if DATE_COLUMN in frame.columns:
+        dates = pd.to_datetime(frame[DATE_COLUMN], errors='coerce')
+        bins["week"] = ((dates.dt.dayofyear - 1) // 7).fillna(-1).to_numpy(dtype=np.int64)
+        bins["month"] = (dates.dt.month - 1).fillna(-1).to_numpy(dtype=np.int64)
+    return bins
+
+
+class AggregationCube:
+    """
+    Frequency counts and temporal histograms of the crime data for every district, unit and beat.
+
+    Everything is computed with a handful of vectorised group-bys when the cube is built.
+    Counts are kept sorted by frequency within each group, so the top values of a group are
+    a slice of an array found with one dict lookup. New rows are folded in with apply_rows,
+    which only touches the groups those rows belong to.
+
+    Groups are addressed by key tuples: () for the whole state, (district,),
+    (district, unitname) and (district, unitname, beat_name).
+
+    Args:
+        frame: The cleaned crime DataFrame.
+        fields: The fields to count values of; those missing from frame are skipped.
+    """
+
+    def __init__(self, frame, fields=FREQUENCY_FIELDS):
+        self.levels = [level for level in LEVELS if level in frame.columns]
+        self.fields = [field for field in fields if field in frame.columns]
+        # key -> number of rows
+        self.totals = {}
+        # field -> (values, counts, {key: (start, stop)}), values sorted by count within each key
+        self.counts = {}
+        # histogram name -> (counts matrix, {key: row})
+        self.histograms = {}
+        # Groups changed by apply_rows since the cube was built, as plain dicts
+        self._count_overrides = {}
+        self._histogram_overrides = {}
+        self._lock = threading.Lock()
+        self._build(frame)
+
+    def _group_levels(self):
+        # Key columns of the whole state, district, unit and beat levels
+        for depth in range(len(self.levels) + 1):
+            yield [_ALL] + self.levels[:depth]
+
+    def _build(self, frame):
+        frame = frame.assign(**{_ALL: 0})
+        bins = temporal_bins(frame)
+        ranked = {field: ([], [], {}) for field in self.fields}
+        histograms = {name: ([], {}) for name in bins}
+
+        for key_columns in self._group_levels():
+            sizes = frame.groupby(key_columns, observed=True, sort=False).size()
+            for key, count in sizes.items():
+                self.totals[_group_key(key)] = int(count)
+
+            for field in self.fields:
+                values, counts, spans = ranked[field]
+                offset = sum(len(part) for part in counts)
+                field_values, field_counts, field_spans = _ranked_counts(frame, key_columns, field)
+                values.append(field_values)
+                counts.append(field_counts)
+                for key, (start, stop) in field_spans.items():
+                    spans[key] = (offset + start, offset + stop)
+
+            for name, values in bins.items():
+                matrices, rows = histograms[name]
+                offset = sum(len(part) for part in matrices)
+                matrix, matrix_rows = _histogram_matrix(frame, key_columns, name, values)
+                matrices.append(matrix)
+                for key, row in matrix_rows.items():
+                    rows[key] = offset + row
+
+        for field, (values, counts, spans) in ranked.items():
+            self.counts[field] = (np.concatenate(values), np.concatenate(counts), spans)
+        for name, (matrices, rows) in histograms.items():
+            self.histograms[name] = (np.vstack(matrices), rows)
+
+    def _group_counts(self, field, key):
+        # All value counts of a group as a dict, from the overrides or the built arrays
+        override = self._count_overrides.get((field, key))
+        if override is not None:
+            return override
+        values, counts, spans = self.counts[field]
+        start, stop = spans.get(key, (0, 0))
+        return {_plain(value): int(count) for value, count in zip(values[start:stop], counts[start:stop])}
+
+    def _group_histogram(self, name, key):
+        override = self._histogram_overrides.get((name, key))
+        if override is not None:
+            return override
+        if name not in self.histograms:
+            return np.zeros(HISTOGRAM_BINS[name], dtype=np.int64)
+        matrix, rows = self.histograms[name]
+        row = rows.get(key)
+        return np.zeros(HISTOGRAM_BINS[name], dtype=np.int64) if row is None else matrix[row]
+
+    def apply_rows(self, frame):
+        """
+        Folds newly ingested rows into the cube.
+
+        The rows are aggregated on their own and the result is merged into only the
+        groups they belong to; nothing else is recomputed.
+        """
+        if frame.empty:
+            return
+        delta = AggregationCube(frame[[column for column in frame.columns if column != _ALL]], self.fields)
+        with self._lock:
+            for key, count in delta.totals.items():
+                self.totals[key] = self.totals.get(key, 0) + count
+                for field in self.fields:
+                    merged = dict(self._group_counts(field, key))
+                    for value, added in delta._group_counts(field, key).items():
+                        merged[value] = merged.get(value, 0) + added
+                    self._count_overrides[(field, key)] = merged
+                for name in delta.histograms:
+                    merged = self._group_histogram(name, key) + delta._group_histogram(name, key)
+                    self._histogram_overrides[(name, key)] = merged
+
+    @staticmethod
+    def key(district=None, unitname=None, beat_name=None):
+        """
+        Builds the group key for a district, unit and beat, stopping at the first one missing.
+        """
+        key = []
+        for part in (district, unitname, beat_name):
+            if not part:
+                break
+            key.append(part)
+        return tuple(key)
+
+    def __contains__(self, key):
+        return key in self.totals
+
+    def top(self, key, field, n=TOP_N):
+        """
+        Returns the most frequent values of a field in a group as [{"value": ..., "freq": ...}].
+        """
+        override = self._count_overrides.get((field, key))
+        if override is not None:
+            ranked = sorted(override.items(), key=lambda item: (-item[1], str(item[0])))[:n]
+            return [{"value": value, "freq": count} for value, count in ranked]
+
+        values, counts, spans = self.counts[field]
+        start, stop = spans.get(key, (0, 0))
+        stop = min(stop, start + n)
+        return [
+            {"value": _plain(value), "freq": int(count)}
+            for value, count in zip(values[start:stop], counts[start:stop])
+        ]
+
+    def summary(self, key, n=TOP_N):
+        """
+        Returns the total and the top values of every field for a group.
+        """
+        return {
+            "total": self.totals.get(key, 0),
+            "top": {field: self.top(key, field, n) for field in self.fields},
+        }
+
+    def histogram(self, key, name):
+        """
+        Returns a temporal histogram of a group as a list of counts, one per bin.
+        """
+        return self._group_histogram(name, key).tolist()
+
+
+def _group_key(key):
+    # Group-by keys start with the constant _ALL column, which is not part of the public key
+    key = key if isinstance(key, tuple) else (key,)
+    return tuple(key[1:])
+
+
+def _ranked_counts(frame, key_columns, field):
+    """
+    Counts the values of field in every group, sorted by descending count within each group.
+
+    Returns:
+        The values, their counts and a dict mapping each group key to its (start, stop) span.
+    """
+    sizes = frame.groupby(key_columns + [field], observed=True, sort=False).size().reset_index(name='_count')
+    text = sizes[field].astype(str)
+    sizes = sizes[~text.str.match(_BLANK_VALUE).to_numpy(dtype=bool)].assign(_text=text)
+    sizes = sizes.sort_values(
+        key_columns + ['_count', '_text'],
+        ascending=[True] * len(key_columns) + [False, True],
+        kind='stable',
+    ).reset_index(drop=True)
+
+    # Rows are sorted by group, so each group is the run between two changes of group number
+    groups = sizes.groupby(key_columns, observed=True, sort=False).ngroup().to_numpy()
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]]) if len(groups) else groups
+    stops = np.r_[starts[1:], len(groups)]
+    keys = zip(*(sizes[column].iloc[starts].tolist() for column in key_columns))
+    spans = {_group_key(key): (int(start), int(stop)) for key, start, stop in zip(keys, starts, stops)}
+    return sizes[field].to_numpy(dtype=object), sizes['_count'].to_numpy(dtype=np.int64), spans
+
+
+def _histogram_matrix(frame, key_columns, name, values):
+    """
+    Counts the rows of every group in each bin of a temporal histogram.
+
+    Returns:
+        A (groups x bins) count matrix and a dict mapping each group key to its row.
+    """
+    size = HISTOGRAM_BINS[name]
+    known = values >= 0
+    groups = frame.loc[known, key_columns].assign(_bin=values[known])
+    sizes = groups.groupby(key_columns + ['_bin'], observed=True, sort=False).size()
+    if sizes.empty:
+        return np.zeros((0, size), dtype=np.int64), {}
+    matrix = sizes.unstack('_bin', fill_value=0).reindex(columns=range(size), fill_value=0)
+    rows = {_group_key(key): row for row, key in enumerate(matrix.index)}
+    return matrix.to_numpy(dtype=np.int64), rows
@@ -0,0 +1,208 @@
+import numpy as np
+
+from aggregates import LEVELS, temporal_bins
+
+# Shifts officers are allocated to, as [start, end) hours
+SHIFTS = ((0, 8), (8, 16), (16, 24))
+# Share of a beat's expected crimes one officer prevents or responds to in a shift;
+# each further officer covers the same share of what is still uncovered
+EFFECTIVENESS = 0.3
+# Most officers a single beat can usefully take in one shift
+MAX_PER_BEAT = 10
+# Largest min_per_beat and max_per_beat a scenario may ask for; the marginal gains are
+# held as a (beats x max_per_beat) array, so this bounds its size
+MAX_PER_BEAT_LIMIT = 100
+# Pseudo-count spread over every beat and hour so that quiet beats are not treated as crime free
+INTENSITY_PRIOR = 0.5
+
+# Beats listed in the prompt table, the busiest first
+PROMPT_BEATS = 25
+
+
+def shift_label(shift):
+    return f"{shift[0]:02d}-{shift[1]:02d}"
+
+
+class BeatIntensity:
+    """
+    Expected crimes in every beat and hour of day over the next month.
+
+    Each unit's next-month forecast is split between its beats and the hours of the day in
+    proportion to their historical counts, smoothed by INTENSITY_PRIOR. Everything is
+    computed once, so an area's beats are an array slice at query time.
+
+    Args:
+        frame: The cleaned crime DataFrame.
+        forecasts: The ForecastModel fitted on frame.
+    """
+
+    def __init__(self, frame, forecasts):
+        grouped = frame.groupby(list(LEVELS), observed=True, sort=True)
+        # Rows with a missing level are in no group and get -1
+        ids = grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+        # (district, unitname, beat_name) of every row of hourly
+        self.beats = list(grouped.size().index)
+
+        hours = temporal_bins(frame).get("hour", np.full(len(frame), -1, dtype=np.int64))
+        counted = (ids >= 0) & (hours >= 0)
+        counts = np.bincount(ids[counted] * 24 + hours[counted], minlength=len(self.beats) * 24)
+        counts = counts.reshape(len(self.beats), 24) + INTENSITY_PRIOR
+
+        # area key -> rows of the beats in the district or unit
+        self.areas = {}
+        for row, (district, unitname, _) in enumerate(self.beats):
+            self.areas.setdefault((district,), []).append(row)
+            self.areas.setdefault((district, unitname), []).append(row)
+        self.areas = {key: np.array(rows, dtype=np.int64) for key, rows in self.areas.items()}
+
+        # Scale every beat's counts so that its unit's beats add up to the unit forecast
+        unit_totals = np.zeros(len(self.beats))
+        unit_expected = np.zeros(len(self.beats))
+        for key, rows in self.areas.items():
+            if len(key) == 2:
+                unit_totals[rows] = counts[rows].sum()
+                series = forecasts.series.get((key, None))
+                expected = forecasts.expected[series, 0] if series is not None and forecasts.horizon else 0.0
+                unit_expected[rows] = expected
+        self.hourly = counts / unit_totals[:, None] * unit_expected[:, None]
+        self.month = forecasts.last_month + 1
+
+    def __contains__(self, key):
+        return key in self.areas
+
+    def intensity(self, key, shifts=SHIFTS):
+        """
+        Returns the beats of a district or unit and their expected crimes in every shift.
+
+        Returns:
+            The (district, unitname, beat_name) of every beat and a (beats x shifts) array.
+        """
+        rows = self.areas[key]
+        hourly = self.hourly[rows]
+        intensity = np.column_stack([hourly[:, start:end].sum(axis=1) for start, end in shifts])
+        return [self.beats[row] for row in rows], intensity
+
+
+def allocate(intensity, officers, effectiveness=EFFECTIVENESS, min_per_beat=0, max_per_beat=MAX_PER_BEAT):
+    """
+    Allocates officers to beats in every shift to cover as many expected crimes as possible.
+
+    With n officers a beat with expected crimes c covers c * (1 - (1 - effectiveness) ** n).
+    The marginal gain of every further officer is smaller than that of the one before, so
+    the greedy choice is optimal: every beat first gets min_per_beat officers (when there
+    are enough for all beats), then the rest of the shift's officers go to the largest
+    marginal gains, picked all at once with a partial sort instead of one at a time.
+
+    Args:
+        intensity: A (beats x shifts) array of expected crimes.
+        officers: Officers available in every shift, a number or one per shift.
+        effectiveness: Share of the uncovered crimes of a beat each officer covers.
+        min_per_beat: Officers every beat gets before the rest are allocated by gain.
+        max_per_beat: Most officers a beat can get in one shift.
+
+    Returns:
+        A (beats x shifts) integer array of officers.
+
+    Raises:
+        ValueError: If min_per_beat or max_per_beat is negative or above MAX_PER_BEAT_LIMIT.
+    """
+    for name, value in (("min_per_beat", min_per_beat), ("max_per_beat", max_per_beat)):
+        if not 0 <= value <= MAX_PER_BEAT_LIMIT:
+            raise ValueError(f"{name} must be between 0 and {MAX_PER_BEAT_LIMIT}")
+    beats, shifts = intensity.shape
+    officers = np.broadcast_to(np.asarray(officers, dtype=np.int64), (shifts,))
+    max_per_beat = max(max_per_beat, min_per_beat)
+    allocation = np.zeros((beats, shifts), dtype=np.int64)
+    if not beats:
+        return allocation
+
+    for shift in range(shifts):
+        budget = int(officers[shift])
+        floor = min(min_per_beat, budget // beats)
+        allocation[:, shift] = floor
+        budget -= floor * beats
+
+        # gains[b, i] is the gain of beat b's (floor + i + 1)th officer; no beat can get
+        # more extra officers than the shift has left
+        extra = min(max_per_beat - floor, budget)
+        budget = min(budget, beats * extra)
+        if budget <= 0:
+            continue
+        gains = intensity[:, shift, None] * effectiveness * (1 - effectiveness) ** (floor + np.arange(extra))
+        chosen = np.argpartition(-gains.ravel(), budget - 1)[:budget]
+        allocation[:, shift] += np.bincount(chosen // extra, minlength=beats)
+    return allocation
+
+
+def covered(intensity, allocation, effectiveness=EFFECTIVENESS):
+    """
+    Returns the expected crimes covered by an allocation, per beat and shift.
+    """
+    return intensity * (1 - (1 - effectiveness) ** allocation)
+
+
+def deployment_plan(beats, intensity, officers, shifts=SHIFTS, effectiveness=EFFECTIVENESS,
+                    min_per_beat=0, max_per_beat=MAX_PER_BEAT):
+    """
+    Allocates officers to the beats of an area and summarises the result.
+
+    Returns:
+        A dict with the shifts, one entry per beat (busiest first) with its officers and
+        expected crimes per shift, and per-shift totals compared with an even split.
+    """
+    officers = np.broadcast_to(np.asarray(officers, dtype=np.int64), (len(shifts),))
+    allocation = allocate(intensity, officers, effectiveness, min_per_beat, max_per_beat)
+    coverage = covered(intensity, allocation, effectiveness)
+    # The same officers spread evenly over the beats, as a baseline
+    even = covered(intensity, officers / max(len(beats), 1), effectiveness)
+
+    order = np.argsort(-intensity.sum(axis=1), kind='stable')
+    return {
+        "shifts": [shift_label(shift) for shift in shifts],
+        "effectiveness": effectiveness,
+        "beats": [
+            {
+                "district": beats[row][0],
+                "unitname": beats[row][1],
+                "beat_name": beats[row][2],
+                "officers": allocation[row].tolist(),
+                "expected_crimes": np.round(intensity[row], 2).tolist(),
+            }
+            for row in order
+        ],
+        "totals": [
+            {
+                "shift": shift_label(shift),
+                "officers": int(officers[index]),
+                "assigned": int(allocation[:, index].sum()),
+                "expected_crimes": round(float(intensity[:, index].sum()), 2),
+                "covered": round(float(coverage[:, index].sum()), 2),
+                "covered_even_split": round(float(even[:, index].sum()), 2),
+            }
+            for index, shift in enumerate(shifts)
+        ],
+    }
+
+
+def plan_table(plan, month_label=None):
+    """
+    Formats a deployment plan as a compact plain-text table for the deployment prompt.
+    """
+    lines = [
+        "Officer allocation per shift, officers (expected crimes)"
+        + (f" for {month_label}" if month_label else ""),
+        " | ".join(["Beat"] + plan["shifts"]),
+    ]
+    for beat in plan["beats"][:PROMPT_BEATS]:
+        cells = [f"{officers} ({crimes:.1f})" for officers, crimes in zip(beat["officers"], beat["expected_crimes"])]
+        lines.append(" | ".join([beat["beat_name"]] + cells))
+    hidden = len(plan["beats"]) - PROMPT_BEATS
+    if hidden > 0:
+        lines.append(f"... {hidden} quieter beats not listed")
+    for total in plan["totals"]:
+        lines.append(
+            f"Shift {total['shift']}: {total['assigned']} of {total['officers']} officers assigned, "
+            f"covering {total['covered']:.1f} of {total['expected_crimes']:.1f} expected crimes "
+            f"(even split: {total['covered_even_split']:.1f})"
+        )
+    return "\n".join(lines)
@@ -1,13 +1,36 @@
+import asyncio
+import json
 import os
+import numpy as np
 import pandas as pd
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import List, Union
 from pydantic import BaseModel
-from spatial import generate_spatial_analysis
-from beatwise import generate_beatwise_analysis
-from prediction import generate_crime_prediction
-from deployment import generate_deployment_plan
+from spatial import generate_spatial_analysis, stream_spatial_analysis
+from beatwise import generate_beatwise_analysis, stream_beatwise_analysis
+from prediction import generate_crime_prediction, stream_crime_prediction
+from deployment import generate_deployment_plan, stream_deployment_plan
+from aggregates import HISTOGRAM_BINS, AggregationCube
+from dataset_loader import load_dataset
+from serialization import ARROW_STREAM_MEDIA_TYPE, dumps, frame_to_arrow, frame_to_columns_json, frame_to_records_json, keyset_slice
+from llm_cache import cache_stats
+from snapshot import FileSnapshot, snapshot_response
+from tiles import PyramidCache
+from spatial_index import SpatialIndex
+from forecasting import ForecastModel, month_label
+from llm_gateway import BackendBusyError, open_stream, run_generation
+from allocation import EFFECTIVENESS, MAX_PER_BEAT, MAX_PER_BEAT_LIMIT, SHIFTS, BeatIntensity, deployment_plan as allocate_officers, plan_table
+from batch import ANALYSES, BATCH_ANALYSES, BATCH_RESULTS_PATH, BATCH_SCHEDULE, ResultStore, enumerate_jobs, run_schedule
+from jobs import JobManager, JobStore
+from ingest import EntryIngestor, EntryTail, append_rows, coerce_entries, load_snapshot, save_snapshot, snapshot_path
+from process_lock import ProcessLock
+from metrics import METRICS_PROFILING, Counter, Gauge, MetricsMiddleware, profile_path, render_metrics, stage
+import threading
 import traceback
+import weakref
 
 # Create FastAPI app instance
 app = FastAPI()
@@ -19,25 +42,151 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count", "ETag", "Content-Range", "Location", "X-Profile-Id"],
 )
 
+# Time every request by route for /metrics, and profile those sent with X-Profile
+app.add_middleware(MetricsMiddleware)
+
+# Shed load with 503 when an analysis backend's wait queue is full
+@app.exception_handler(BackendBusyError)
+async def backend_busy_handler(request: Request, exc: BackendBusyError):
+    return JSONResponse(
+        status_code=503,
+        content={"error": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 # Get the project directory
 project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # Get the parent directory
 
-# Construct the file path for the CSV file
-csv_file_path = os.path.join(project_dir, 'models', 'dataset', 'updated_ml_model_ready_dataset.csv')
+# Construct the file path for the CSV file; DATASET_PATH serves another one, e.g. a benchmark dataset
+csv_file_path = os.getenv('DATASET_PATH') or os.path.join(project_dir, 'models', 'dataset', 'updated_ml_model_ready_dataset.csv')
+
+# Load crime data, from its columnar copy when one is up to date
+df = load_dataset(csv_file_path)
+
+# Continue from the last snapshot of the incidents ingested from the entries file, if any
+entry_tail = EntryTail()
+df = load_snapshot(df, csv_file_path, entry_tail)
+# Bytes of the entries file whose rows df holds
+ingested_offset = entry_tail.offset
+
+# Precompute frequency counts and temporal histograms per district, unit and beat
+cube = AggregationCube(df)
+
+# Pre-bin the incident coordinates on every zoom level for the heatmap
+pyramids = PyramidCache(df)
+
+# Index the incident coordinates for viewport, radius and nearest-neighbour queries
+incident_index = SpatialIndex(df)
+
+# Fit monthly and hourly count forecasts for every district and unit in one batch
+forecasts = ForecastModel(df)
+
+# Split the unit forecasts into expected crimes per beat and hour for officer allocation
+beat_intensity = BeatIntensity(df, forecasts)
+
+# Serialises updates of the dataset and everything derived from it
+dataset_lock = threading.Lock()
+
+def ingest_rows(entries, offset):
+    """
+    Appends new entries to the dataset and folds them into the aggregates and indexes.
+
+    The cube and heatmap pyramids are updated in place and the spatial index gets the new
+    points merged in. The forecasts, which are fitted on whole months, are refitted when
+    the ingested rows are compacted.
+
+    Args:
+        entries: A DataFrame of entry fields.
+        offset: The offset of the entries file the entries end at.
+
+    Returns:
+        The numbers of rows ingested and of entries dropped.
+    """
+    global df, incident_index, ingested_offset
+    with dataset_lock:
+        rows, dropped = coerce_entries(entries, df)
+        if len(rows):
+            combined, rows = append_rows(df, rows)
+            df = combined
+            cube.apply_rows(rows)
+            pyramids.apply_rows(rows, combined)
+            incident_index = incident_index.with_rows(rows, combined)
+        ingested_offset = offset
+        return len(rows), dropped
+
+# Every worker compacts its own copy of the dataset, but only the one holding the lock saves the snapshot
+snapshot_lock = ProcessLock(snapshot_path(csv_file_path) + '.lock')
+
+def compact_dataset():
+    """
+    Rebuilds the aggregates, forecasts and indexes from the dataset with its ingested rows and saves a snapshot of it.
+
+    The heatmap pyramids and the spatial index are rebuilt as well, since merging ingested
+    points into them copies their arrays every time. The new structures are built while
+    entries keep being ingested; the rows ingested meanwhile are folded into them when
+    they replace the old ones.
+    """
+    global cube, forecasts, beat_intensity, pyramids, incident_index
+    with dataset_lock:
+        frame, offset = df, ingested_offset
+    compacted_cube = AggregationCube(frame)
+    compacted_forecasts = ForecastModel(frame)
+    compacted_intensity = BeatIntensity(frame, compacted_forecasts)
+    compacted_pyramids = PyramidCache(frame)
+    compacted_index = SpatialIndex(frame)
+    with dataset_lock:
+        rows = df.iloc[len(frame):]
+        if len(rows):
+            compacted_cube.apply_rows(rows)
+            compacted_pyramids.apply_rows(rows, df)
+            compacted_index = compacted_index.with_rows(rows, df)
+        cube, forecasts, beat_intensity = compacted_cube, compacted_forecasts, compacted_intensity
+        pyramids, incident_index = compacted_pyramids, compacted_index
+    if snapshot_lock.acquire():
+        save_snapshot(frame, csv_file_path, entry_tail.path, offset)
+
+# New incidents from the entries file, or posted to /entries, without restarting the API
+ingestor = EntryIngestor(entry_tail, ingest_rows, compact_dataset)
+
+# Background tasks of this worker, cancelled at shutdown
+background_tasks = set()
+
+def start_background_task(coroutine):
+    # Keep a reference so the task is not garbage collected while it runs
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    tasks = list(background_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+@app.on_event("startup")
+async def ingest_entries():
+    start_background_task(ingestor.run())
+
+# Analyses precomputed by batch.py, served with ?precomputed=true or from /precomputed
+batch_results = ResultStore()
 
-# Load crime data from CSV
-df = pd.read_csv(csv_file_path, low_memory=False)
+# Analyses submitted with ?job=true, generated in the background and polled through /jobs
+jobs = JobManager(JobStore())
 
-# Print column names for debugging
-# print("Column names:", df.columns)
+# Precompute analyses at the times in BATCH_SCHEDULE, e.g. before shift briefings; with
+# several workers only the one holding the lock runs the schedule
+batch_lock = ProcessLock(BATCH_RESULTS_PATH + '.lock')
 
-# Filter rows with zero latitude or longitude (optional, adjust for your data)
-if 'latitude' in df.columns and 'longitude' in df.columns:
-    df = df[(df['latitude'] != 0) & (df['longitude'] != 0)]
-else:
-    raise KeyError("The required columns 'latitude' and 'longitude' are not present in the CSV file")
+@app.on_event("startup")
+async def schedule_batches():
+    if BATCH_SCHEDULE:
+        analyses = [analysis for analysis in BATCH_ANALYSES.split(',') if analysis in ANALYSES]
+        start_background_task(run_schedule(lambda: enumerate_jobs(cube, forecasts, analyses), batch_results, lock=batch_lock))
 
 class AnalysisRequest(BaseModel):
     analysis_text: str
@@ -45,28 +194,184 @@ class AnalysisRequest(BaseModel):
     police_station: str = None
     unitname: str = None
     beat_name: str = None
+    # Build the prompt data from the server's aggregates instead of the posted fields
+    server_data: bool = False
+
+class DeploymentScenario(BaseModel):
+    district: str
+    unitname: str = None
+    # Officers available in every shift, one number for all shifts or one per shift
+    officers: Union[int, List[int]]
+    effectiveness: float = EFFECTIVENESS
+    min_per_beat: int = 0
+    max_per_beat: int = MAX_PER_BEAT
+
+class DeploymentRequest(AnalysisRequest):
+    # Scenario to allocate and narrate; without officers the plan is left to the model
+    officers: Union[int, List[int]] = None
+    effectiveness: float = EFFECTIVENESS
+    min_per_beat: int = 0
+    max_per_beat: int = MAX_PER_BEAT
+
+def compute_deployment(district, unitname, officers, effectiveness, min_per_beat, max_per_beat):
+    """
+    Allocates the officers of a scenario to the beats of a district or unit.
+
+    Returns:
+        The structured plan, see allocation.deployment_plan.
+    """
+    key = AggregationCube.key(district, unitname)
+    if not key or key not in beat_intensity:
+        raise HTTPException(status_code=404, detail="No beats for the requested area")
+    counts = officers if isinstance(officers, list) else [officers] * len(SHIFTS)
+    if len(counts) != len(SHIFTS) or min(counts) < 0:
+        raise HTTPException(status_code=400, detail=f"officers must be a non-negative number or {len(SHIFTS)} of them, one per shift")
+    if not 0 < effectiveness <= 1:
+        raise HTTPException(status_code=400, detail="effectiveness must be in (0, 1]")
+    if not (0 <= min_per_beat <= MAX_PER_BEAT_LIMIT and 0 <= max_per_beat <= MAX_PER_BEAT_LIMIT):
+        raise HTTPException(status_code=400, detail=f"min_per_beat and max_per_beat must be between 0 and {MAX_PER_BEAT_LIMIT}")
+    beats, intensity = beat_intensity.intensity(key)
+    plan = allocate_officers(beats, intensity, counts, SHIFTS, effectiveness, min_per_beat, max_per_beat)
+    return {"month": month_label(beat_intensity.month), **plan}
+
+def analysis_data(request: AnalysisRequest, unitname=None, beat_name=None):
+    """
+    Returns the data an analysis prompt is built from.
+
+    By default this is the posted request itself. With server_data set, it is the
+    precomputed top frequencies of the requested district, unit and beat instead.
+    """
+    if not request.server_data:
+        return request.dict()
+    key = AggregationCube.key(request.district, unitname, beat_name)
+    if key not in cube:
+        raise HTTPException(status_code=404, detail="No crime data for the requested area")
+    with stage("slice"):
+        return {"analysis_text": request.analysis_text, **cube.summary(key)}
+
+def prediction_data(request: AnalysisRequest):
+    """
+    Returns the data the crime prediction prompt is built from.
+
+    When the requested district or unit has forecasts, this is their compact forecast
+    table, so the model narrates computed numbers instead of estimating them itself.
+    Otherwise it falls back to analysis_data.
+    """
+    key = AggregationCube.key(request.district, request.unitname)
+    if key and key in forecasts:
+        with stage("slice"):
+            return forecasts.prompt_table(key)
+    return analysis_data(request, request.unitname)
+
+async def precomputed_response(analysis, key, stream):
+    """
+    Returns the stored batch result of an analysis as the endpoint's response, or None if there is none.
+    """
+    result = await run_in_threadpool(batch_results.get, analysis, key)
+    if result is None:
+        return None
+    if stream:
+        async def chunks():
+            yield result["analysis"]
+        return sse_response(chunks())
+    return result
+
+def job_response(job):
+    """
+    Returns a submitted job as a 202 response pointing at its status and event stream.
+    """
+    return JSONResponse(
+        status_code=202,
+        content={**job, "status_url": f"/jobs/{job['job_id']}", "events_url": f"/jobs/{job['job_id']}/events"},
+        headers={"Location": f"/jobs/{job['job_id']}"},
+    )
+
+def sse_response(chunks):
+    """
+    Wraps an async iterator of generated text chunks in a Server-Sent Events response.
+
+    Every chunk is sent as a `data: {"token": ...}` event as soon as it arrives. The stream
+    ends with a `done` event, or with an `error` event if generation fails midway.
+    """
+    async def events():
+        try:
+            async for chunk in chunks:
+                yield f"data: {json.dumps({'token': chunk})}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+            return
+        finally:
+            await chunks.aclose()
+        yield "event: done\ndata: {}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def select_fields(frame, fields):
+    """
+    Projects frame to a comma separated list of columns, or returns it unchanged when fields is empty.
+    """
+    if not fields:
+        return frame
+    columns = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [column for column in columns if column not in frame.columns]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return frame[columns]
 
 # API endpoint for retrieving crime data (GET request)
 @app.get("/data")
-async def get_data(page: int = 1, per_page: int = 100):
-    # Calculate start and end index for data slice based on pagination
-    start = (page - 1) * per_page
-    end = start + per_page
+async def get_data(
+    page: int = 1,
+    per_page: int = 100,
+    cursor: int = None,
+    fields: str = None,
+    format: str = "records",
+):
+    """
+    Returns a page of crime records.
+
+    Pages are selected either by page number or, more efficiently, with `cursor` set to the
+    value of the X-Next-Cursor header of the previous page. `fields` is a comma separated
+    list of columns to return (e.g. `latitude,longitude`). `format` is `records` (a list of
+    row objects), `columns` (one array per column) or `arrow` (an Arrow IPC stream).
+    """
+    if format not in ("records", "columns", "arrow"):
+        raise HTTPException(status_code=400, detail="format must be one of records, columns or arrow")
 
-    # Get the data slice as dictionary records
-    data = df[start:end].to_dict(orient='records')
+    with stage("slice"):
+        # Project to the requested columns before slicing so that only they are serialised
+        frame = select_fields(df, fields)
 
-    # Handle missing values by converting them to None
-    for record in data:
-        for key, value in record.items():
-            if pd.isnull(value):
-                record[key] = None
+        if cursor is not None:
+            data, next_cursor = keyset_slice(frame, cursor, per_page)
+        else:
+            # Calculate start and end index for data slice based on pagination
+            start = (page - 1) * per_page
+            end = start + per_page
+            data = frame[start:end]
+            next_cursor = data.index[-1].item() if end < len(frame) and len(data) else None
 
-    return data
+    headers = {} if next_cursor is None else {"X-Next-Cursor": str(next_cursor)}
+    with stage("serialize"):
+        if format == "arrow":
+            try:
+                content = frame_to_arrow(data)
+            except RuntimeError as e:
+                raise HTTPException(status_code=406, detail=str(e))
+            return Response(content=content, media_type=ARROW_STREAM_MEDIA_TYPE, headers=headers)
+        if format == "columns":
+            content = frame_to_columns_json(data, next_cursor=next_cursor)
+        else:
+            content = frame_to_records_json(data)
+    return Response(content=content, media_type="application/json", headers=headers)
 
 # API endpoint for generating spatial analysis (POST request)
 @app.post("/spatial_analysis")
-async def spatial_analysis(request: AnalysisRequest):
+async def spatial_analysis(request: AnalysisRequest, stream: bool = False, precomputed: bool = False, job: bool = False):
     try:
         analysis_text = request.analysis_text
         district = request.district
@@ -74,16 +379,28 @@ async def spatial_analysis(request: AnalysisRequest):
 
         if not analysis_text:
             raise HTTPException(status_code=400, detail="Analysis text is required")
+
+        response = precomputed and await precomputed_response("spatial", (district, police_station), stream)
+        if response:
+            return response
         
-        spatial_analysis_result = generate_spatial_analysis(analysis_text, district, police_station, request.dict())
+        if job:
+            return job_response(await jobs.submit("spatial", stream_spatial_analysis, analysis_text, district, police_station, analysis_data(request, police_station)))
+
+        if stream:
+            return sse_response(await open_stream("spatial", stream_spatial_analysis, analysis_text, district, police_station, analysis_data(request, police_station)))
+
+        spatial_analysis_result = await run_generation("spatial", generate_spatial_analysis, analysis_text, district, police_station, analysis_data(request, police_station))
         return {"analysis": spatial_analysis_result}
+    except (HTTPException, BackendBusyError):
+        raise
     except Exception as e:
         traceback_str = traceback.format_exc()
         return {"error": str(e), "traceback": traceback_str}
 
 # API endpoint for generating beatwise analysis (POST request)
 @app.post("/beatwise_analysis")
-async def beatwise_analysis(request: AnalysisRequest):
+async def beatwise_analysis(request: AnalysisRequest, stream: bool = False, precomputed: bool = False, job: bool = False):
     try:
         analysis_text = request.analysis_text
         district = request.district
@@ -92,16 +409,28 @@ async def beatwise_analysis(request: AnalysisRequest):
 
         if not analysis_text:
             raise HTTPException(status_code=400, detail="Analysis text is required")
+
+        response = precomputed and await precomputed_response("beatwise", (district, unitname, beat_name), stream)
+        if response:
+            return response
         
-        beatwise_analysis_result = generate_beatwise_analysis(analysis_text, district, unitname, beat_name, request.dict())
+        if job:
+            return job_response(await jobs.submit("beatwise", stream_beatwise_analysis, analysis_text, district, unitname, beat_name, analysis_data(request, unitname, beat_name)))
+
+        if stream:
+            return sse_response(await open_stream("beatwise", stream_beatwise_analysis, analysis_text, district, unitname, beat_name, analysis_data(request, unitname, beat_name)))
+
+        beatwise_analysis_result = await run_generation("beatwise", generate_beatwise_analysis, analysis_text, district, unitname, beat_name, analysis_data(request, unitname, beat_name))
         return {"analysis": beatwise_analysis_result}
+    except (HTTPException, BackendBusyError):
+        raise
     except Exception as e:
         traceback_str = traceback.format_exc()
         return {"error": str(e), "traceback": traceback_str}
     
 # API endpoint for generating crime prediction (POST request)
 @app.post("/crime_prediction")
-async def crime_prediction(request: AnalysisRequest):
+async def crime_prediction(request: AnalysisRequest, stream: bool = False, precomputed: bool = False, job: bool = False):
     try:
         analysis_text = request.analysis_text
         district = request.district
@@ -109,16 +438,36 @@ async def crime_prediction(request: AnalysisRequest):
         
         if not analysis_text:
             raise HTTPException(status_code=400, detail="Analysis text is required")
+
+        response = precomputed and await precomputed_response("prediction", (district, unitname), stream)
+        if response:
+            return response
         
-        crime_prediction_result = generate_crime_prediction(analysis_text, district, unitname, request.dict())
+        if job:
+            return job_response(await jobs.submit("prediction", stream_crime_prediction, analysis_text, district, unitname, prediction_data(request)))
+
+        if stream:
+            return sse_response(await open_stream("prediction", stream_crime_prediction, analysis_text, district, unitname, prediction_data(request)))
+
+        crime_prediction_result = await run_generation("prediction", generate_crime_prediction, analysis_text, district, unitname, prediction_data(request))
         return {"analysis": crime_prediction_result}
+    except (HTTPException, BackendBusyError):
+        raise
     except Exception as e:
         traceback_str = traceback.format_exc()
         return {"error": str(e), "traceback": traceback_str}
     
+# API endpoint for allocating officers to beats and shifts, without narration (POST request)
+@app.post("/deployment/allocate")
+async def deployment_allocate(scenario: DeploymentScenario):
+    return compute_deployment(
+        scenario.district, scenario.unitname, scenario.officers,
+        scenario.effectiveness, scenario.min_per_beat, scenario.max_per_beat,
+    )
+
 #API endpoint for generating deployment plan (POST Request)
-@app.post("deployment_plan")
-async def deployment_plan(request: AnalysisRequest):
+@app.post("/deployment_plan")
+async def deployment_plan(request: DeploymentRequest, stream: bool = False, job: bool = False):
     try:
         analysis_text = request.analysis_text
         district = request.district
@@ -126,24 +475,322 @@ async def deployment_plan(request: AnalysisRequest):
         
         if not analysis_text:
             raise HTTPException(status_code=400, detail = "Analysis text is required")
+
+        # With a scenario, the model narrates the computed allocation instead of inventing one
+        plan = None
+        data = analysis_data(request, unitname)
+        if request.officers is not None:
+            plan = compute_deployment(
+                district, unitname, request.officers,
+                request.effectiveness, request.min_per_beat, request.max_per_beat,
+            )
+            data = plan_table(plan, plan["month"])
         
-        deployment_plan_result = generate_deployment_plan(analysis_text, district, unitname, request.dict())
-        return {"analysis": deployment_plan_result}
+        if job:
+            return job_response(await jobs.submit("deployment", stream_deployment_plan, analysis_text, district, unitname, data))
+
+        if stream:
+            return sse_response(await open_stream("deployment", stream_deployment_plan, analysis_text, district, unitname, data))
+
+        deployment_plan_result = await run_generation("deployment", generate_deployment_plan, analysis_text, district, unitname, data)
+        return {"analysis": deployment_plan_result, "plan": plan}
+    except (HTTPException, BackendBusyError):
+        raise
     except Exception as e:
         traceback_str = traceback.format_exc()
-        return {"error": str[e], "traceback": traceback_str}
+        return {"error": str(e), "traceback": traceback_str}
+
+def cube_key(district, unitname, beat_name):
+    key = AggregationCube.key(district, unitname, beat_name)
+    if key not in cube:
+        raise HTTPException(status_code=404, detail="No crime data for the requested area")
+    return key
+
+# API endpoint for the top values of a field in a district, unit or beat (GET request)
+@app.get("/aggregates/top")
+async def aggregates_top(field: str, district: str = None, unitname: str = None, beat_name: str = None, n: int = 10):
+    if field not in cube.fields:
+        raise HTTPException(status_code=400, detail=f"field must be one of {', '.join(cube.fields)}")
+    return cube.top(cube_key(district, unitname, beat_name), field, n)
+
+# API endpoint for the total and top values of every field in a district, unit or beat (GET request)
+@app.get("/aggregates/summary")
+async def aggregates_summary(district: str = None, unitname: str = None, beat_name: str = None, n: int = 10):
+    return cube.summary(cube_key(district, unitname, beat_name), n)
+
+# API endpoint for crime counts by hour, week or month in a district, unit or beat (GET request)
+@app.get("/aggregates/temporal")
+async def aggregates_temporal(by: str = "hour", district: str = None, unitname: str = None, beat_name: str = None):
+    if by not in HISTOGRAM_BINS:
+        raise HTTPException(status_code=400, detail=f"by must be one of {', '.join(HISTOGRAM_BINS)}")
+    counts = cube.histogram(cube_key(district, unitname, beat_name), by)
+    # Hours start at 0, weeks and months at 1
+    first = 0 if by == "hour" else 1
+    return [{by: first + index, "count": count} for index, count in enumerate(counts)]
+
+# API endpoint for the monthly and hourly crime count forecast of a district or unit (GET request)
+@app.get("/forecast")
+async def forecast(district: str = None, unitname: str = None, Crime_Type: str = None, history_months: int = 12):
+    """
+    Returns the recent monthly counts, the forecast for the next months with 90% intervals
+    and the expected counts by hour for the next month.
+    """
+    key = AggregationCube.key(district, unitname)
+    result = forecasts.forecast(key, Crime_Type or None, max(history_months, 0))
+    if result is None:
+        raise HTTPException(status_code=404, detail="No crime data for the requested area and crime type")
+    return {"district": district, "unitname": unitname, "Crime_Type": Crime_Type, **result}
+
+# API endpoint for the heatmap intensity inside a map viewport (GET request)
+@app.get("/heatmap")
+async def heatmap(
+    zoom: int,
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    district: str = None,
+    Crime_Type: str = None,
+):
+    """
+    Returns the binned incident counts inside a viewport as [latitude, longitude, count] points.
+
+    The number of points is bounded by the viewport size in bins rather than by the number
+    of incidents, so the payload stays the same size as the dataset grows.
+    """
+    pyramid = await run_in_threadpool(pyramids.get, district_name=district, Crime_Type=Crime_Type)
+    with stage("slice"):
+        latitude, longitude, counts = pyramid.viewport(zoom, south, west, north, east)
+    with stage("serialize"):
+        points = np.column_stack([latitude, longitude, counts]).tolist()
+        content = dumps({"zoom": min(zoom, pyramid.max_zoom), "max": int(counts.max(initial=0)), "points": points})
+    return Response(content=content, media_type="application/json")
+
+# API endpoint for the heatmap intensity of one slippy-map tile (GET request)
+@app.get("/tiles/{zoom}/{x}/{y}")
+async def heatmap_tile(zoom: int, x: int, y: int, district: str = None, Crime_Type: str = None):
+    if not 0 <= zoom <= pyramids.full.max_zoom or not (0 <= x < 2 ** zoom and 0 <= y < 2 ** zoom):
+        raise HTTPException(status_code=404, detail=f"Tiles exist for zoom levels 0 to {pyramids.full.max_zoom}")
+    pyramid = await run_in_threadpool(pyramids.get, district_name=district, Crime_Type=Crime_Type)
+    with stage("slice"):
+        intensity = pyramid.tile(zoom, x, y)
+    with stage("serialize"):
+        content = dumps({"zoom": zoom, "x": x, "y": y, "bins": pyramid.bins, "intensity": intensity.tolist()})
+    return Response(content=content, media_type="application/json")
+
+def incident_response(positions, fields, limit, distances=None):
+    """
+    Serialises the incidents at the given row positions as a JSON array of records.
+
+    At most limit records are returned; the number of matches is sent in X-Total-Count.
+    """
+    total = len(positions)
+    if limit is not None:
+        positions = positions[:max(limit, 0)]
+    with stage("slice"):
+        frame = select_fields(df, fields).iloc[positions]
+        if distances is not None:
+            frame = frame.assign(distance_km=np.round(distances[:len(positions)], 4))
+    with stage("serialize"):
+        content = frame_to_records_json(frame)
+    return Response(content=content, media_type="application/json", headers={"X-Total-Count": str(total)})
+
+def incident_filters(district, unitname, beat_name, Crime_Type, crime_group_name):
+    filters = {
+        "district_name": district,
+        "unitname": unitname,
+        "beat_name": beat_name,
+        "Crime_Type": Crime_Type,
+        "crime_group_name": crime_group_name,
+    }
+    filters = {column: value for column, value in filters.items() if value}
+    unknown = [column for column in filters if column not in incident_index.attributes]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot filter on {', '.join(unknown)}")
+    return filters
+
+# API endpoint for the incidents inside a map viewport (GET request)
+@app.get("/incidents/viewport")
+async def incidents_viewport(
+    south: float,
+    west: float,
+    north: float,
+    east: float,
+    limit: int = 1000,
+    fields: str = None,
+    district: str = None,
+    unitname: str = None,
+    beat_name: str = None,
+    Crime_Type: str = None,
+    crime_group_name: str = None,
+):
+    filters = incident_filters(district, unitname, beat_name, Crime_Type, crime_group_name)
+    with stage("query"):
+        positions = incident_index.viewport(south, west, north, east, **filters)
+    return incident_response(positions, fields, limit)
+
+# API endpoint for the incidents within a distance of a location, nearest first (GET request)
+@app.get("/incidents/nearby")
+async def incidents_nearby(
+    latitude: float,
+    longitude: float,
+    radius_km: float = 2.0,
+    limit: int = 1000,
+    fields: str = None,
+    district: str = None,
+    unitname: str = None,
+    beat_name: str = None,
+    Crime_Type: str = None,
+    crime_group_name: str = None,
+):
+    if radius_km <= 0:
+        raise HTTPException(status_code=400, detail="radius_km must be positive")
+    filters = incident_filters(district, unitname, beat_name, Crime_Type, crime_group_name)
+    with stage("query"):
+        positions, distances = incident_index.radius(latitude, longitude, radius_km, **filters)
+    return incident_response(positions, fields, limit, distances)
+
+# API endpoint for the k incidents nearest to a location (GET request)
+@app.get("/incidents/nearest")
+async def incidents_nearest(
+    latitude: float,
+    longitude: float,
+    k: int = 10,
+    fields: str = None,
+    district: str = None,
+    unitname: str = None,
+    beat_name: str = None,
+    Crime_Type: str = None,
+    crime_group_name: str = None,
+):
+    if not 0 < k <= 10000:
+        raise HTTPException(status_code=400, detail="k must be between 1 and 10000")
+    filters = incident_filters(district, unitname, beat_name, Crime_Type, crime_group_name)
+    with stage("query"):
+        positions, distances = incident_index.nearest(latitude, longitude, k, **filters)
+    return incident_response(positions, fields, None, distances)
+
+# API endpoint for a precomputed analysis of a district, unit or beat (GET request)
+@app.get("/precomputed/{analysis}")
+async def precomputed_analysis(analysis: str, district: str, unitname: str = None, beat_name: str = None):
+    if analysis not in ANALYSES:
+        raise HTTPException(status_code=404, detail=f"analysis must be one of {', '.join(ANALYSES)}")
+    result = await run_in_threadpool(batch_results.get, analysis, AggregationCube.key(district, unitname, beat_name))
+    if result is None:
+        raise HTTPException(status_code=404, detail="No precomputed analysis for the requested area")
+    return result
+
+# API endpoint for the progress of recent batch runs (GET request)
+@app.get("/batch/runs")
+async def batch_runs(limit: int = 20):
+    return await run_in_threadpool(batch_results.runs, limit)
+
+# API endpoint for the status, partial output and result of an analysis job (GET request)
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await jobs.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No such job")
+    return job
+
+# API endpoint streaming an analysis job's output as Server-Sent Events (GET request)
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    if await jobs.status(job_id) is None:
+        raise HTTPException(status_code=404, detail="No such job")
+    return sse_response(jobs.follow(job_id))
+
+# API endpoint for cancelling a queued or running analysis job (DELETE request)
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    job = await jobs.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No such job")
+    return job
+
+# API endpoint for adding incidents, one entry or a list of them (POST request)
+@app.post("/entries", status_code=201)
+async def add_entries(entries: Union[dict, List[dict]]):
+    entries = entries if isinstance(entries, list) else [entries]
+    ingested, rejected = await run_in_threadpool(ingestor.submit, entries)
+    return {"ingested": ingested, "rejected": rejected, "rows": len(df)}
+
+# API endpoint for the progress of incremental ingestion (GET request)
+@app.get("/ingest/stats")
+async def ingest_stats():
+    return {**ingestor.stats, "rows": len(df)}
+
+# API endpoint for inspecting the LLM response cache (GET request)
+@app.get("/llm_cache/stats")
+async def llm_cache_stats():
+    return cache_stats()
+
+# Deep memory usage of the dataset, measured once per version of it since it scans every
+# string; the version is held weakly so a replaced dataset can be freed
+_dataset_memory = (lambda: None, 0)
+
+def dataset_memory_bytes():
+    global _dataset_memory
+    frame = df
+    if _dataset_memory[0]() is not frame:
+        _dataset_memory = (weakref.ref(frame), int(frame.memory_usage(index=True, deep=True).sum()))
+    return _dataset_memory[1]
+
+# Every worker holds its own copy of the dataset, so the largest one is reported
+DATASET_ROWS = Gauge("shadow_dataset_rows", "Rows in the served dataset", collect=lambda: {(): len(df)}, multiprocess_mode="max")
+DATASET_BYTES = Gauge(
+    "shadow_dataset_memory_bytes", "Memory held by the served dataset", collect=lambda: {(): dataset_memory_bytes()},
+    multiprocess_mode="max",
+)
+JOBS_ACTIVE = Gauge("shadow_jobs_active", "Analysis jobs queued or running", collect=lambda: {(): jobs.active_count()})
+INGESTED = Counter(
+    "shadow_ingest_entries_total", "Entries ingested or rejected since startup", ("outcome",),
+    collect=lambda: {("ingested",): ingestor.stats["ingested"], ("rejected",): ingestor.stats["rejected"]},
+)
+
+# API endpoint for Prometheus: request and stage latencies, LLM timings, cache and dataset gauges (GET request)
+@app.get("/metrics")
+async def metrics():
+    content = await run_in_threadpool(render_metrics)
+    return Response(content=content, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+# API endpoint for a request profile named by the X-Profile-Id header, in collapsed stack format (GET request)
+@app.get("/profiles/{profile_id}")
+async def profile(profile_id: str):
+    path = profile_path(profile_id) if METRICS_PROFILING else None
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="No such profile")
+    return FileResponse(path, media_type="text/plain")
+
+def build_read_csv_payload(path):
+    """
+    Serialises the rows of the source CSV that contain no '0' cell.
+
+    Args:
+        path: The CSV file to read.
+
+    Returns:
+        The filtered rows as JSON bytes.
+    """
+    data = pd.read_csv(path)
+
+    # Drop rows in which any cell is the string '0', checking a column at a time
+    has_zero = np.zeros(len(data), dtype=bool)
+    for column in data.columns:
+        if pd.api.types.is_object_dtype(data[column]) or pd.api.types.is_string_dtype(data[column]):
+            has_zero |= (data[column] == '0').to_numpy()
+
+    return frame_to_records_json(data[~has_zero])
+
+# The /read_csv payload is built once and rebuilt only when the CSV changes
+read_csv_snapshot = FileSnapshot(csv_file_path, build_read_csv_payload)
 
 # API endpoint for reading CSV (GET request)
 @app.get("/read_csv")
-async def read_csv():
+async def read_csv(request: Request):
     try:
-        # Read the CSV data
-        with open(csv_file_path, 'r') as csv_file:
-            reader = pd.read_csv(csv_file)
-            data = reader.to_dict(orient='records')
-        data = [row for row in data if not '0' in row.values()]
-
-        return data
+        snapshot = await run_in_threadpool(read_csv_snapshot.current)
+        return snapshot_response(request, snapshot)
     except Exception as e:
         traceback_str = traceback.format_exc()
         return {"error": str(e), "traceback": traceback_str}
@@ -0,0 +1,402 @@
+"""
+Precomputes analyses for every district, unit and beat and stores them for the endpoints to serve.
+
+Jobs are enumerated from the dataset, their prompts are built with the analysis modules'
+format_prompt_for_model functions, and the generations run on a bounded thread pool behind
+a rate limit of their own, so a batch leaves upstream capacity for interactive requests.
+Every finished job is saved at once; a run that is interrupted is resumed by running it
+again, which skips the jobs already stored with an unchanged prompt.
+
+Run it from the models directory:
+
+    python batch.py --analyses beatwise prediction --concurrency 4 --rate-limit 60
+
+or let app.py run it at the times in BATCH_SCHEDULE.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv  # type: ignore
+
+import beatwise
+import prediction
+import spatial
+from llm_gateway import RateLimiter
+
+load_dotenv()
+
+# SQLite file the precomputed analyses are stored in
+BATCH_RESULTS_PATH = os.getenv(
+    'BATCH_RESULTS_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'batch_results.sqlite3'),
+)
+# Generations a batch runs at once
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+# Generations a batch may start per minute (0 means unlimited)
+BATCH_RATE_LIMIT = float(os.getenv('BATCH_RATE_LIMIT', '60'))
+# Comma separated local times (HH:MM) at which app.py starts a batch, e.g. before shift briefings
+BATCH_SCHEDULE = os.getenv('BATCH_SCHEDULE', '')
+# Comma separated analyses a scheduled batch precomputes
+BATCH_ANALYSES = os.getenv('BATCH_ANALYSES', 'beatwise,prediction')
+
+# Analysis text of the precomputed prompts
+BATCH_ANALYSIS_TEXT = "Briefing analysis of the recorded crimes"
+
+# Analyses that can be precomputed, and the area level each is made for
+ANALYSES = {"spatial": 2, "beatwise": 3, "prediction": 2}
+# Module and generate function of every analysis
+ANALYSIS_FUNCTIONS = {
+    "spatial": (spatial, "generate_spatial_analysis"),
+    "beatwise": (beatwise, "generate_beatwise_analysis"),
+    "prediction": (prediction, "generate_crime_prediction"),
+}
+
+
+class BatchJob:
+    """
+    One analysis of one area.
+
+    Args:
+        analysis: The analysis type.
+        key: The (district, unitname[, beat_name]) area key.
+        generate: The analysis module's generate_* function.
+        arguments: Its arguments, also passed to format_prompt_for_model.
+        prompt: The formatted prompt, used to tell whether a stored result is still current.
+    """
+
+    def __init__(self, analysis, key, generate, arguments, prompt):
+        self.analysis = analysis
+        self.key = key
+        self.generate = generate
+        self.arguments = arguments
+        self.prompt_key = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+    def run(self):
+        return self.generate(*self.arguments)
+
+
+def _area_columns(key):
+    # Results are keyed on all three levels; missing ones are stored as ''
+    district, unitname, beat_name = (tuple(str(part) for part in key) + ('', '', ''))[:3]
+    return district, unitname, beat_name
+
+
+class ResultStore:
+    """
+    SQLite store of precomputed analyses and of the batch runs that produced them.
+
+    Args:
+        path: The SQLite file.
+    """
+
+    def __init__(self, path=BATCH_RESULTS_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "analysis TEXT NOT NULL, district TEXT NOT NULL, unitname TEXT NOT NULL, beat_name TEXT NOT NULL, "
+                "prompt_key TEXT NOT NULL, status TEXT NOT NULL, text TEXT, error TEXT, run_id TEXT, updated REAL NOT NULL, "
+                "PRIMARY KEY (analysis, district, unitname, beat_name))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "run_id TEXT PRIMARY KEY, started REAL NOT NULL, finished REAL, "
+                "total INTEGER NOT NULL, done INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, "
+                "skipped INTEGER NOT NULL DEFAULT 0)"
+            )
+        # The store is created at import, which under gunicorn's preload_app is the master;
+        # close the connection so no worker inherits it through fork
+        self.close()
+
+    def _connection(self):
+        # sqlite3 connections may not be shared between threads or across fork, so keep
+        # one per thread of each process
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def close(self):
+        """
+        Closes the calling thread's connection; the next call opens a new one.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            connection.close()
+        self._local.connection = None
+
+    def get(self, analysis, key):
+        """
+        Returns the stored analysis of an area as {"analysis", "generated_at", "run_id"}, or None.
+        """
+        row = self._connection().execute(
+            "SELECT text, updated, run_id FROM results "
+            "WHERE analysis = ? AND district = ? AND unitname = ? AND beat_name = ? AND status = 'done'",
+            (analysis, *_area_columns(key)),
+        ).fetchone()
+        if row is None:
+            return None
+        text, updated, run_id = row
+        return {"analysis": text, "generated_at": updated, "run_id": run_id}
+
+    def current(self, job):
+        """
+        Returns whether the job's result is stored and was generated from the same prompt.
+        """
+        row = self._connection().execute(
+            "SELECT prompt_key FROM results "
+            "WHERE analysis = ? AND district = ? AND unitname = ? AND beat_name = ? AND status = 'done'",
+            (job.analysis, *_area_columns(job.key)),
+        ).fetchone()
+        return row is not None and row[0] == job.prompt_key
+
+    def save(self, job, run_id, text=None, error=None):
+        """
+        Stores the outcome of a job; a failure does not replace an earlier successful result.
+        """
+        with self._connection() as connection:
+            if error is None:
+                connection.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, 'done', ?, NULL, ?, ?)",
+                    (job.analysis, *_area_columns(job.key), job.prompt_key, text, run_id, time.time()),
+                )
+                connection.execute("UPDATE runs SET done = done + 1 WHERE run_id = ?", (run_id,))
+            else:
+                connection.execute(
+                    "INSERT INTO results VALUES (?, ?, ?, ?, ?, 'failed', NULL, ?, ?, ?) "
+                    "ON CONFLICT (analysis, district, unitname, beat_name) DO UPDATE SET error = excluded.error, run_id = excluded.run_id, "
+                    "updated = excluded.updated WHERE status = 'failed'",
+                    (job.analysis, *_area_columns(job.key), job.prompt_key, error, run_id, time.time()),
+                )
+                connection.execute("UPDATE runs SET failed = failed + 1 WHERE run_id = ?", (run_id,))
+
+    def start_run(self, run_id, total, skipped):
+        """
+        Records the start of a run, returning False if a run with this id already exists.
+        """
+        try:
+            with self._connection() as connection:
+                connection.execute(
+                    "INSERT INTO runs (run_id, started, total, skipped) VALUES (?, ?, ?, ?)",
+                    (run_id, time.time(), total, skipped),
+                )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def finish_run(self, run_id):
+        with self._connection() as connection:
+            connection.execute("UPDATE runs SET finished = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def run(self, run_id):
+        """
+        Returns the record of one run, or None.
+        """
+        runs = self.runs(run_id=run_id)
+        return runs[0] if runs else None
+
+    def runs(self, limit=20, run_id=None):
+        """
+        Returns the most recent runs with their progress, newest first.
+        """
+        query = "SELECT run_id, started, finished, total, done, failed, skipped FROM runs"
+        parameters = ()
+        if run_id is not None:
+            query += " WHERE run_id = ?"
+            parameters = (run_id,)
+        cursor = self._connection().execute(query + " ORDER BY started DESC LIMIT ?", parameters + (limit,))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def analysis_job(analysis, key, cube, forecasts):
+    """
+    Builds the job of one analysis of one area, with the data the endpoint uses for server_data requests.
+    """
+    if analysis == "prediction":
+        data = forecasts.prompt_table(key)
+    else:
+        data = {"analysis_text": BATCH_ANALYSIS_TEXT, **cube.summary(key)}
+
+    module, generate = ANALYSIS_FUNCTIONS[analysis]
+    arguments = (BATCH_ANALYSIS_TEXT, *key, data)
+    return BatchJob(analysis, key, getattr(module, generate), arguments, module.format_prompt_for_model(*arguments))
+
+
+def enumerate_jobs(cube, forecasts, analyses, districts=None):
+    """
+    Lists the jobs of the given analyses for every area in the data.
+
+    Args:
+        cube: The AggregationCube of the dataset.
+        forecasts: The ForecastModel of the dataset.
+        analyses: Analysis types to precompute, keys of ANALYSES.
+        districts: Districts to limit the batch to, or None for all of them.
+
+    Returns:
+        The jobs, ordered by analysis and area.
+    """
+    jobs = []
+    for analysis in analyses:
+        depth = ANALYSES[analysis]
+        keys = sorted(key for key in cube.totals if len(key) == depth)
+        for key in keys:
+            if districts and key[0] not in districts:
+                continue
+            if analysis == "prediction" and key not in forecasts:
+                continue
+            jobs.append(analysis_job(analysis, key, cube, forecasts))
+    return jobs
+
+
+def run_batch(jobs, store, run_id=None, concurrency=BATCH_CONCURRENCY, rate_limit=BATCH_RATE_LIMIT,
+              resume=True, stop=None, progress=None):
+    """
+    Runs jobs on a bounded thread pool and stores each result as soon as it is ready.
+
+    Args:
+        jobs: The jobs to run.
+        store: The ResultStore to save results to.
+        run_id: Identifier of the run; a run id that was already used is not run again.
+        concurrency: Generations in flight at once.
+        rate_limit: Generations started per minute, 0 for unlimited.
+        resume: Skip jobs whose stored result was generated from the same prompt.
+        stop: A threading.Event that stops the run before its next job starts.
+        progress: A function called with (job, error) after every job.
+
+    Returns:
+        The run's record from the store, or None if run_id was already used.
+    """
+    run_id = run_id or datetime.now().strftime("batch-%Y%m%dT%H%M%S")
+    pending = [job for job in jobs if not (resume and store.current(job))]
+    if not store.start_run(run_id, len(pending), len(jobs) - len(pending)):
+        return None
+
+    limiter = RateLimiter(rate_limit)
+
+    def execute(job):
+        if stop is not None and stop.is_set():
+            return job, None, False
+        limiter.wait(float('inf'))
+        try:
+            store.save(job, run_id, text=job.run())
+            return job, None, True
+        except Exception as e:
+            store.save(job, run_id, error=str(e))
+            return job, e, True
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1), thread_name_prefix="batch") as executor:
+        futures = [executor.submit(execute, job) for job in pending]
+        for future in as_completed(futures):
+            job, error, ran = future.result()
+            if ran and progress is not None:
+                progress(job, error)
+
+    store.finish_run(run_id)
+    return store.run(run_id)
+
+
+def next_scheduled_time(schedule, now=None):
+    """
+    Returns the next datetime matching one of the HH:MM times of a schedule, or None if it is empty.
+    """
+    now = now or datetime.now()
+    upcoming = []
+    for entry in schedule.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        hour, minute = (int(part) for part in entry.split(':'))
+        candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if candidate <= now:
+            candidate += timedelta(days=1)
+        upcoming.append(candidate)
+    return min(upcoming) if upcoming else None
+
+
+async def run_schedule(build_jobs, store, schedule=BATCH_SCHEDULE, lock=None):
+    """
+    Runs a batch at every time of the schedule, until the task is cancelled.
+
+    With several gunicorn workers, pass a ProcessLock shared by them: only the worker
+    holding it runs the schedule, and another takes over if that worker exits. The run id
+    is derived from the scheduled time as well, so a run is never started twice.
+    Cancelling the task stops the current batch before its next job starts.
+
+    Args:
+        build_jobs: A function returning the jobs to run, called at every scheduled time.
+        store: The ResultStore to save results to.
+        schedule: Comma separated HH:MM times.
+        lock: A ProcessLock to hold while running the schedule, or None.
+    """
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+    try:
+        if lock is not None:
+            await lock.wait()
+        while True:
+            scheduled = next_scheduled_time(schedule)
+            if scheduled is None:
+                return
+            await asyncio.sleep((scheduled - datetime.now()).total_seconds())
+            run_id = scheduled.strftime("scheduled-%Y%m%dT%H%M")
+            jobs = await loop.run_in_executor(None, build_jobs)
+            await loop.run_in_executor(None, lambda: run_batch(jobs, store, run_id=run_id, stop=stop))
+    finally:
+        stop.set()
+        if lock is not None:
+            lock.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dataset', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dataset', 'updated_ml_model_ready_dataset.csv'))
+    parser.add_argument('--analyses', nargs='+', choices=sorted(ANALYSES), default=BATCH_ANALYSES.split(','))
+    parser.add_argument('--district', action='append', help="Only precompute this district (repeatable)")
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument('--rate-limit', type=float, default=BATCH_RATE_LIMIT, help="Generations started per minute, 0 for unlimited")
+    parser.add_argument('--no-resume', action='store_true', help="Regenerate results that are already stored")
+    parser.add_argument('--dry-run', action='store_true', help="Only list how many jobs would run")
+    args = parser.parse_args()
+
+    # Imported here so that app.py can use this module without loading a second copy of the data
+    from aggregates import AggregationCube
+    from dataset_loader import load_dataset
+    from forecasting import ForecastModel
+
+    df = load_dataset(args.dataset)
+    jobs = enumerate_jobs(AggregationCube(df), ForecastModel(df), args.analyses, args.district)
+    store = ResultStore()
+    if args.dry_run:
+        pending = sum(1 for job in jobs if args.no_resume or not store.current(job))
+        print(f"{len(jobs)} jobs, {pending} to run")
+        return
+
+    started = time.monotonic()
+    finished = [0]
+
+    def progress(job, error):
+        finished[0] += 1
+        status = f"failed: {error}" if error else "done"
+        print(f"[{finished[0]}] {job.analysis} {' / '.join(map(str, job.key))}: {status}", flush=True)
+
+    run = run_batch(jobs, store, concurrency=args.concurrency, rate_limit=args.rate_limit,
+                    resume=not args.no_resume, progress=progress)
+    print(f"{run['done']} done, {run['failed']} failed, {run['skipped']} already stored "
+          f"in {time.monotonic() - started:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
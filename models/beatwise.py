@@ -1,17 +1,7 @@
-import os
 import re
 
-from huggingface_hub import InferenceClient  # type: ignore
-from dotenv import load_dotenv  # type: ignore
-
-load_dotenv()
-print("Environment Keys Loaded:", os.getenv('HUGGINGFACE_API_BEATWISE'))  # This should print your API key if loaded correctly
-
-# Load the text generation model from Hugging Face Hub
-hf_api_key = os.getenv('HUGGINGFACE_API_BEATWISE')
-if not hf_api_key:
-    raise ValueError("Hugging Face API Key not set in environment variable")
-text_generation_client = InferenceClient(token=hf_api_key, model="mistralai/Mixtral-8x7B-Instruct-v0.1")
+from llm_cache import cached_generation
+from prompt_builder import build_prompt
 
 # Define a function to format prompts for the model
 def format_prompt_for_model(user_prompt, district, unitname, beat_name, data):
@@ -42,15 +32,14 @@ def format_prompt_for_model(user_prompt, district, unitname, beat_name, data):
 
     user_context_prompt = (
         f"I am providing you with the top frequencies of certain crime-related fields in the {district} district, {unitname} unit name and {beat_name} beat name. Please provide an analysis on this data and identify any potential connections or correlations between these fields. Propose explanations or reasons for the identified links based on your knowledge and experience as a crime detective.\n\n"
-        f"The data is as follows:\n\n{data}"
     )
 
-    # Combine all prompt sections into a single formatted prompt
-    combined_prompt = f"<s>[SYS] {system_context_prompt} [/SYS]\n[INST] {user_context_prompt} [/INST]"
+    # Combine all prompt sections into a single formatted prompt, with the data compacted to fit the token budget
+    combined_prompt = build_prompt("beatwise", system_context_prompt, user_context_prompt, data)
     return combined_prompt
 
 
-def generate_beatwise_analysis(analysis_text, district, unitname, beat_name, data):
+def stream_beatwise_analysis(analysis_text, district, unitname, beat_name, data):
     """
     Generates text using the loaded model, with options for controlling the output.
 
@@ -58,7 +47,7 @@ def generate_beatwise_analysis(analysis_text, district, unitname, beat_name, dat
         analysis_text: The specific text prompt to be processed by the model.
 
     Returns:
-        The generated text as a string.
+        A generator of text chunks, yielded as the model produces them.
     """
 
     # Set model parameters for text generation
@@ -74,18 +63,23 @@ def generate_beatwise_analysis(analysis_text, district, unitname, beat_name, dat
     # Format the prompt for the model
     model_ready_prompt = format_prompt_for_model(analysis_text, district, unitname, beat_name, data)
 
-    # Generate text using the model
-    generated_text_stream = text_generation_client.text_generation(
-        model_ready_prompt,
-        **generation_parameters,
-        stream=True,
-        details=True,
-        return_full_text=True,
-    )
+    # Generate text using the model, reusing an earlier identical generation if there is one
+    text_segments = cached_generation("beatwise", model_ready_prompt, generation_parameters)
+
+    # Forward generated text segments as they arrive
+    yield from text_segments
 
-    # Combine generated text segments into a final output string
-    final_output_text = ""
-    for text_segment in generated_text_stream:
-        final_output_text += text_segment.token.text
 
-    return final_output_text
+def generate_beatwise_analysis(analysis_text, district, unitname, beat_name, data):
+    """
+    Generates text using the loaded model, with options for controlling the output.
+
+    Args:
+        analysis_text: The specific text prompt to be processed by the model.
+
+    Returns:
+        The generated text as a string.
+    """
+
+    # Combine generated text segments into a final output string
+    return "".join(stream_beatwise_analysis(analysis_text, district, unitname, beat_name, data))
@@ -0,0 +1,420 @@
+"""
+Load-tests the API against synthetic datasets and a local stand-in inference server.
+
+For every dataset size a synthetic crime dataset is written (and kept for later runs),
+the API is started on it with uvicorn, and every scenario is driven by closed-loop
+clients at each concurrency level for a fixed duration. The analyses are answered by
+benchmarks/mock_tgi.py, so their numbers are the API's own overhead plus the mock's
+configured time to first token and decoding speed, not the hosted model's:
+
+    python benchmarks/load_test.py --rows 10000 100000 1000000 10000000 --concurrency 1 4 16 64
+
+Every step reports p50/p95/p99 latency, time to first byte, throughput, errors and the
+server's RSS. The results are saved as JSON under --output-dir; pass an earlier file as
+--baseline to compare p95 latency and throughput, with a non-zero exit status when a
+step regressed by more than --threshold. Linux only (RSS is read from /proc).
+
+Scenarios:
+    data                     GET /data, a random page of 100 rows
+    read_csv                 GET /read_csv, the whole filtered CSV (skipped above --read-csv-max-rows)
+    spatial_analysis         POST /spatial_analysis with server_data for a random unit
+    spatial_analysis_stream  the same with ?stream=true
+    beatwise_analysis        POST /beatwise_analysis for a random beat
+    crime_prediction         POST /crime_prediction for a random unit
+    deployment_plan          POST /deployment_plan with an officer scenario for a random unit
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+import pandas as pd
+
+MODELS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Names of the synthetic areas: units belong to districts and beats to units
+DISTRICTS = 30
+UNITS_PER_DISTRICT = 10
+BEATS_PER_UNIT = 10
+CRIME_TYPES = ["Theft", "Assault", "Burglary", "Fraud", "Robbery", "Murder"]
+CRIME_GROUPS = ["Property", "Body", "Economic"]
+CASTES = ["A", "B", "C"]
+PROFESSIONS = ["Labour", "Student", "Farmer", "Driver", "0"]
+
+ANALYSIS_TEXT = "1) Most of the Crime_Type in this unit belongs to 1. Theft: 40 (40% of total); 2. Assault: 20 (20% of total)."
+
+
+def synthetic_dataset(rows, path, seed=0, chunk_rows=1_000_000):
+    """
+    Writes a synthetic crime dataset in the model-ready CSV layout, a chunk at a time.
+
+    Incidents are spread over DISTRICTS districts and four years, inside Karnataka's
+    bounding box; about 5% have a zero latitude, which the loader drops.
+    """
+    rng = np.random.default_rng(seed)
+    temporary = path + '.tmp'
+    for start in range(0, rows, chunk_rows):
+        count = min(chunk_rows, rows - start)
+        beat = rng.integers(0, DISTRICTS * UNITS_PER_DISTRICT * BEATS_PER_UNIT, count)
+        unit = beat // BEATS_PER_UNIT
+        dates = pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 4 * 365, count), unit="D")
+        latitude = rng.uniform(11.6, 18.4, count)
+        latitude[rng.random(count) < 0.05] = 0
+        frame = pd.DataFrame({
+            "crime_no": np.arange(start, start + count),
+            "district_name": np.char.add("District", (unit // UNITS_PER_DISTRICT).astype(str)),
+            "unitname": np.char.add("PS", unit.astype(str)),
+            "beat_name": np.char.add("Beat", beat.astype(str)),
+            "Crime_Type": np.array(CRIME_TYPES)[rng.integers(0, len(CRIME_TYPES), count)],
+            "crime_group_name": np.array(CRIME_GROUPS)[rng.integers(0, len(CRIME_GROUPS), count)],
+            "Offence_From_Date_only": dates.strftime("%Y-%m-%d"),
+            "Offence_From_Time_only": pd.to_datetime(rng.integers(0, 86400, count), unit="s").strftime("%H:%M:%S"),
+            "month": dates.month,
+            "year": dates.year,
+            "accused_age": np.where(rng.random(count) < 0.1, np.nan, rng.integers(16, 70, count)),
+            "victim_age": rng.integers(5, 80, count).astype(float),
+            "accused_caste": np.array(CASTES)[rng.integers(0, len(CASTES), count)],
+            "victim_caste": np.array(CASTES)[rng.integers(0, len(CASTES), count)],
+            "accused_profession": np.array(PROFESSIONS)[rng.integers(0, len(PROFESSIONS), count)],
+            "victim_profession": np.array(PROFESSIONS)[rng.integers(0, len(PROFESSIONS), count)],
+            "latitude": latitude,
+            "longitude": rng.uniform(74.0, 78.6, count),
+        })
+        frame.to_csv(temporary, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    os.replace(temporary, path)
+
+
+def random_area(rng):
+    # A district, unit and beat that exist in every synthetic dataset
+    beat = rng.randrange(DISTRICTS * UNITS_PER_DISTRICT * BEATS_PER_UNIT)
+    unit = beat // BEATS_PER_UNIT
+    return f"District{unit // UNITS_PER_DISTRICT}", f"PS{unit}", f"Beat{beat}"
+
+
+def analysis_request(rng, beat=False, **fields):
+    district, unit, beat_name = random_area(rng)
+    request = {"analysis_text": ANALYSIS_TEXT, "district": district, "server_data": True, **fields}
+    if beat:
+        request.update(unitname=unit, beat_name=beat_name)
+    else:
+        request.update(unitname=unit, police_station=unit)
+    return request
+
+
+# Scenario name -> function of a random.Random and the row count returning (method, path, JSON body)
+SCENARIOS = {
+    "data": lambda rng, rows: ("GET", f"/data?page={rng.randint(1, max(rows // 100, 1))}&per_page=100", None),
+    "read_csv": lambda rng, rows: ("GET", "/read_csv", None),
+    "spatial_analysis": lambda rng, rows: ("POST", "/spatial_analysis", analysis_request(rng)),
+    "spatial_analysis_stream": lambda rng, rows: ("POST", "/spatial_analysis?stream=true", analysis_request(rng)),
+    "beatwise_analysis": lambda rng, rows: ("POST", "/beatwise_analysis", analysis_request(rng, beat=True)),
+    "crime_prediction": lambda rng, rows: ("POST", "/crime_prediction", analysis_request(rng)),
+    "deployment_plan": lambda rng, rows: ("POST", "/deployment_plan", analysis_request(rng, officers=30)),
+}
+
+
+def read_rss(pid):
+    """
+    Returns the current and peak RSS of a process in MB.
+    """
+    values = {}
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            name, _, rest = line.partition(':')
+            if name in ('VmRSS', 'VmHWM'):
+                values[name] = int(rest.split()[0]) / 1024
+    return values.get('VmRSS', 0.0), values.get('VmHWM', 0.0)
+
+
+def start_process(command, environment, ready_url, timeout, log_path):
+    """
+    Starts a server, logging to log_path, and waits until ready_url answers.
+
+    Returns:
+        The process and the seconds it took to become ready.
+    """
+    start = time.perf_counter()
+    with open(log_path, 'w') as log_file:
+        process = subprocess.Popen(command, cwd=MODELS_DIR, env=environment, stdout=log_file, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            with open(log_path) as log_file:
+                raise RuntimeError(f"{' '.join(command)} exited:\n{log_file.read()[-2000:]}")
+        try:
+            httpx.get(ready_url, timeout=5).raise_for_status()
+            return process, time.perf_counter() - start
+        except httpx.HTTPError:
+            time.sleep(0.5)
+    stop_process(process)
+    raise TimeoutError(f"{ready_url} did not come up in time")
+
+
+def stop_process(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def failed(response, tail):
+    # Analysis endpoints answer 200 with an "error" field, or an error event when streaming
+    if response.status_code >= 400:
+        return True
+    if response.headers.get('content-type', '').startswith('text/event-stream'):
+        return b"event: error" in tail
+    if response.headers.get('content-type', '').startswith('application/json') and len(tail) < 65536:
+        try:
+            body = json.loads(tail)
+        except ValueError:
+            return False
+        return isinstance(body, dict) and "error" in body
+    return False
+
+
+async def run_step(client, scenario, rows, concurrency, duration, pid, seed):
+    """
+    Drives one scenario with concurrency closed-loop clients for duration seconds.
+
+    Returns:
+        The step's latency percentiles in ms, throughput, error count and server RSS.
+    """
+    latencies, first_bytes = [], []
+    errors = 0
+    peak_rss = 0.0
+    deadline = time.perf_counter() + duration
+
+    async def worker(index):
+        nonlocal errors
+        rng = random.Random(seed * 1000 + index)
+        while time.perf_counter() < deadline:
+            method, path, body = SCENARIOS[scenario](rng, rows)
+            start = time.perf_counter()
+            first_byte = None
+            tail = b""
+            try:
+                async with client.stream(method, path, json=body) as response:
+                    async for chunk in response.aiter_bytes():
+                        if first_byte is None:
+                            first_byte = time.perf_counter()
+                        # Keep only the end of large bodies; it is all the error check needs
+                        tail = (tail + chunk)[-65536:]
+                error = failed(response, tail)
+            except httpx.HTTPError:
+                error = True
+            end = time.perf_counter()
+            if error:
+                errors += 1
+                continue
+            latencies.append(end - start)
+            first_bytes.append((first_byte or end) - start)
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while True:
+            peak_rss = max(peak_rss, read_rss(pid)[0])
+            await asyncio.sleep(0.2)
+
+    sampler = asyncio.create_task(sample_rss())
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(worker(index) for index in range(concurrency)))
+    finally:
+        sampler.cancel()
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "rows": rows, "scenario": scenario, "concurrency": concurrency,
+        "requests": len(latencies), "errors": errors, "seconds": elapsed,
+        "throughput": len(latencies) / elapsed, "rss_mb": max(peak_rss, read_rss(pid)[0]),
+    }
+    if latencies:
+        milliseconds = np.array(latencies) * 1000
+        p50, p95, p99 = np.percentile(milliseconds, [50, 95, 99])
+        result.update(
+            p50_ms=p50, p95_ms=p95, p99_ms=p99, mean_ms=milliseconds.mean(), max_ms=milliseconds.max(),
+            ttfb_p50_ms=np.percentile(first_bytes, 50) * 1000, ttfb_p95_ms=np.percentile(first_bytes, 95) * 1000,
+        )
+    return {key: float(value) if isinstance(value, np.floating) else value for key, value in result.items()}
+
+
+def print_step(result):
+    latency = (f"{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}"
+               if result['requests'] else f"{'-':>9}{'-':>9}{'-':>9}")
+    print(f"{result['rows']:>10}  {result['scenario']:<25}{result['concurrency']:>5}{result['requests']:>8}"
+          f"{result['errors']:>7}{result['throughput']:>9.1f}{latency}{result['rss_mb']:>9.0f}", flush=True)
+
+
+async def run_dataset(args, rows, mock_url, port):
+    """
+    Starts the API on a synthetic dataset of rows rows and runs every scenario against it.
+
+    Returns:
+        The server's startup time and RSS, and the results of every step.
+    """
+    work_dir = os.path.abspath(args.work_dir)
+    csv_path = os.path.join(work_dir, f"synthetic_{rows}.csv")
+    if not os.path.exists(csv_path):
+        print(f"Writing {csv_path}", flush=True)
+        synthetic_dataset(rows, csv_path, args.seed)
+
+    state_dir = os.path.join(work_dir, f"state_{rows}")
+    os.makedirs(state_dir, exist_ok=True)
+    environment = dict(
+        os.environ,
+        DATASET_PATH=csv_path,
+        DATASET_CACHE_DIR=state_dir,
+        LLM_ENDPOINT_URL=mock_url,
+        LLM_CACHE='0',
+        JOBS_PATH=os.path.join(state_dir, 'jobs.sqlite3'),
+        BATCH_RESULTS_PATH=os.path.join(state_dir, 'batch_results.sqlite3'),
+        BATCH_SCHEDULE='',
+        INGEST_ENTRIES_PATH=os.path.join(state_dir, 'entries.csv'),
+        INGEST_POLL_INTERVAL='0',
+        METRICS_PROFILING='false',
+    )
+    for name in ('HUGGINGFACE_API_SPATIAL', 'HUGGINGFACE_API_BEATWISE', 'HUGGINGFACE_API_PREDICTION', 'HUGGINGFACE_API_DEPLOYMENT'):
+        environment[name] = 'benchmark'
+
+    base_url = f"http://127.0.0.1:{port}"
+    server, startup = start_process(
+        [sys.executable, '-m', 'uvicorn', 'app:app', '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        environment, f"{base_url}/data?per_page=1", args.startup_timeout, os.path.join(state_dir, 'server.log'),
+    )
+    steps = []
+    try:
+        idle_rss = read_rss(server.pid)[0]
+        print(f"{rows} rows: API ready in {startup:.1f} s, {idle_rss:.0f} MB RSS", flush=True)
+        limits = httpx.Limits(max_connections=max(args.concurrency) + 8)
+        async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout, limits=limits) as client:
+            for scenario in args.scenarios:
+                if scenario == "read_csv" and rows > args.read_csv_max_rows:
+                    print(f"{rows:>10}  {scenario:<25}skipped above {args.read_csv_max_rows} rows", flush=True)
+                    continue
+                # Warm up lazily built state (snapshots, pyramids, connections) outside the measurement
+                await run_step(client, scenario, rows, 1, args.warmup, server.pid, args.seed)
+                for concurrency in args.concurrency:
+                    result = await run_step(client, scenario, rows, concurrency, args.duration, server.pid, args.seed)
+                    print_step(result)
+                    steps.append(result)
+        peak_rss = read_rss(server.pid)[1]
+    finally:
+        stop_process(server)
+    return {"rows": rows, "startup_seconds": startup, "idle_rss_mb": idle_rss, "peak_rss_mb": peak_rss}, steps
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=MODELS_DIR, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints the change of p95 latency and throughput of every step also in baseline.
+
+    Returns:
+        The number of steps that regressed by more than threshold.
+    """
+    previous = {(step['rows'], step['scenario'], step['concurrency']): step for step in baseline['steps']}
+    regressions = 0
+    print(f"\nCompared with {baseline.get('started')} ({(baseline.get('git_commit') or 'unknown')[:10]}):")
+    print(f"{'rows':>10}  {'scenario':<25}{'conc':>5}{'p95 ms':>10}{'change':>9}{'req/s':>9}{'change':>9}")
+    for step in results['steps']:
+        before = previous.get((step['rows'], step['scenario'], step['concurrency']))
+        if before is None or not step['requests'] or not before['requests']:
+            continue
+        latency_change = step['p95_ms'] / before['p95_ms'] - 1
+        throughput_change = step['throughput'] / before['throughput'] - 1
+        regressed = latency_change > threshold or throughput_change < -threshold
+        regressions += regressed
+        print(f"{step['rows']:>10}  {step['scenario']:<25}{step['concurrency']:>5}{step['p95_ms']:>10.1f}"
+              f"{latency_change:>+9.0%}{step['throughput']:>9.1f}{throughput_change:>+9.0%}"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+async def run(args):
+    os.makedirs(args.work_dir, exist_ok=True)
+    mock_port = args.port + 1
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    mock, _ = start_process(
+        [sys.executable, os.path.join('benchmarks', 'mock_tgi.py'), '--port', str(mock_port),
+         '--ttft', str(args.ttft), '--tokens-per-second', str(args.tokens_per_second),
+         '--error-rate', str(args.error_rate), '--max-tokens', str(args.max_tokens), '--seed', str(args.seed)],
+        dict(os.environ), f"{mock_url}/health", 30, os.path.join(args.work_dir, 'mock_tgi.log'),
+    )
+    results = {
+        "started": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "settings": {key: value for key, value in vars(args).items() if key != 'baseline'},
+        "servers": [],
+        "steps": [],
+    }
+    try:
+        print(f"{'rows':>10}  {'scenario':<25}{'conc':>5}{'req':>8}{'err':>7}{'req/s':>9}"
+              f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'RSS MB':>9}", flush=True)
+        for rows in args.rows:
+            server, steps = await run_dataset(args, rows, mock_url, args.port)
+            results["servers"].append(server)
+            results["steps"].extend(steps)
+    finally:
+        stop_process(mock)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--duration', type=float, default=10, help="Seconds each step runs")
+    parser.add_argument('--warmup', type=float, default=2, help="Seconds of single-client warm-up per scenario")
+    parser.add_argument('--read-csv-max-rows', type=int, default=1_000_000,
+                        help="Largest dataset /read_csv is driven on; it returns the whole file")
+    parser.add_argument('--ttft', type=float, default=0.3, help="Mock time to first token in seconds")
+    parser.add_argument('--tokens-per-second', type=float, default=40.0, help="Mock decoding speed")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of mock generations failing with 503")
+    parser.add_argument('--max-tokens', type=int, default=200, help="Most tokens the mock generates")
+    parser.add_argument('--port', type=int, default=8130, help="API port; the mock listens on the next one")
+    parser.add_argument('--work-dir', default=os.path.join(MODELS_DIR, 'cache', 'benchmarks'),
+                        help="Where the synthetic datasets and server state are kept")
+    parser.add_argument('--output-dir', default=os.path.join(MODELS_DIR, 'cache', 'benchmarks'))
+    parser.add_argument('--baseline', help="Results file of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.1, help="Relative change counted as a regression")
+    parser.add_argument('--startup-timeout', type=float, default=1800)
+    parser.add_argument('--request-timeout', type=float, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    output = os.path.join(args.output_dir, f"load_test-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        if regressions:
+            print(f"{regressions} step(s) regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+A stand-in for a text-generation-inference server, for benchmarks without the hosted model.
+
+It speaks the protocol InferenceClient.text_generation uses against an endpoint URL: a
+POST of {"inputs", "parameters", "stream"} answered with Server-Sent Events carrying one
+token per event, or with a JSON body when stream is false. Tokens are paced to a
+configurable time to first token and decoding speed, and a share of the requests fail
+like an overloaded server does:
+
+    python benchmarks/mock_tgi.py --port 8081 --ttft 0.3 --tokens-per-second 40 --error-rate 0.02
+
+Point the API at it with LLM_ENDPOINT_URL=http://127.0.0.1:8081 (any non-empty
+HUGGINGFACE_API_* key will do). GET /stats returns the request and token counts.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Words the generated text is made of
+VOCABULARY = (
+    "The", " incidents", " in", " this", " beat", " are", " concentrated", " around", " evening",
+    " hours", ",", " with", " theft", " and", " burglary", " most", " frequent", ".", " Patrols",
+    " should", " focus", " on", " the", " market", " area", " between", " 18:00", " 22:00", "\n",
+)
+
+
+def create_app(ttft=0.3, tokens_per_second=40.0, error_rate=0.0, max_tokens=200, jitter=0.1, seed=None):
+    """
+    Builds the mock server.
+
+    Args:
+        ttft: Seconds from the request to the first token.
+        tokens_per_second: Decoding speed after the first token.
+        error_rate: Share of requests answered with a 503 overloaded error instead.
+        max_tokens: Most tokens generated, whatever max_new_tokens asks for.
+        jitter: Relative random variation of ttft and of the decoding speed per request.
+        seed: Seed of the random choices, for repeatable runs.
+
+    Returns:
+        The FastAPI app.
+    """
+    app = FastAPI()
+    rng = random.Random(seed)
+    stats = {"requests": 0, "errors": 0, "active": 0, "tokens": 0}
+
+    def plan(parameters):
+        # Token count, time to first token and seconds per token of one generation
+        tokens = max(1, min(int(parameters.get("max_new_tokens") or max_tokens), max_tokens))
+        vary = lambda value: value * (1 + rng.uniform(-jitter, jitter))
+        return tokens, vary(ttft), 1.0 / vary(tokens_per_second)
+
+    def token_event(index, text, generated_text=None):
+        payload = {
+            "index": index,
+            "token": {"id": index, "text": text, "logprob": -0.5, "special": False},
+            "generated_text": generated_text,
+            "details": None if generated_text is None else {
+                "finish_reason": "length", "generated_tokens": index, "seed": None,
+            },
+        }
+        return f"data:{json.dumps(payload)}\n\n"
+
+    async def generate(request: Request):
+        body = await request.json()
+        parameters = body.get("parameters") or {}
+        stats["requests"] += 1
+        if rng.random() < error_rate:
+            stats["errors"] += 1
+            return JSONResponse(
+                status_code=503, content={"error": "Model is overloaded", "error_type": "overloaded"},
+            )
+
+        tokens, first_token, per_token = plan(parameters)
+        texts = [VOCABULARY[index % len(VOCABULARY)] for index in range(tokens)]
+        start = time.monotonic()
+
+        async def pace(index):
+            # Sleep to an absolute schedule so that slow event loop turns do not add up
+            delay = start + first_token + index * per_token - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        stream = body.get("stream") or request.url.path.endswith("generate_stream")
+        if not stream:
+            stats["active"] += 1
+            try:
+                await pace(tokens - 1)
+            finally:
+                stats["active"] -= 1
+            stats["tokens"] += tokens
+            text = "".join(texts)
+            if parameters.get("return_full_text"):
+                text = body.get("inputs", "") + text
+            return JSONResponse([{"generated_text": text}])
+
+        async def events():
+            stats["active"] += 1
+            try:
+                for index, text in enumerate(texts, start=1):
+                    await pace(index - 1)
+                    stats["tokens"] += 1
+                    yield token_event(index, text, "".join(texts) if index == tokens else None)
+            finally:
+                stats["active"] -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    for path in ("/", "/generate", "/generate_stream"):
+        app.add_api_route(path, generate, methods=["POST"])
+
+    @app.get("/info")
+    async def info():
+        return {"model_id": "mock-tgi", "ttft": ttft, "tokens_per_second": tokens_per_second, "error_rate": error_rate}
+
+    @app.get("/health")
+    async def health():
+        return {}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--ttft', type=float, default=0.3, help="Seconds to the first token")
+    parser.add_argument('--tokens-per-second', type=float, default=40.0, help="Decoding speed after the first token")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests failing with 503")
+    parser.add_argument('--max-tokens', type=int, default=200, help="Most tokens generated per request")
+    parser.add_argument('--jitter', type=float, default=0.1, help="Relative variation of ttft and speed")
+    parser.add_argument('--seed', type=int, help="Seed of the random choices")
+    args = parser.parse_args()
+
+    app = create_app(args.ttft, args.tokens_per_second, args.error_rate, args.max_tokens, args.jitter, args.seed)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Measures the input tokens, and optionally the upstream latency, of the analysis prompts
+before and after compaction on the fixed requests in prompt_samples.json:
+
+    python benchmarks/prompt_tokens.py
+    PROMPT_TOKENIZER=mistralai/Mixtral-8x7B-Instruct-v0.1 python benchmarks/prompt_tokens.py --live 5
+
+Tokens are counted with PROMPT_TOKENIZER when it is set and the tokenizers package is
+installed, and estimated as characters / 4 otherwise.
+
+With --live N, every prompt is also sent N times to the configured inference backend
+(LLM_ENDPOINT_URL or the hosted model) with max_new_tokens=1. That bypasses the response
+cache and times the prompt processing alone; the median is reported.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import beatwise  # noqa: E402
+import deployment  # noqa: E402
+import prediction  # noqa: E402
+import prompt_builder  # noqa: E402
+import spatial  # noqa: E402
+from llm_gateway import get_client  # noqa: E402
+
+SAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompt_samples.json')
+
+MODULES = {"spatial": spatial, "beatwise": beatwise, "prediction": prediction, "deployment": deployment}
+
+
+def prompt_arguments(backend, request):
+    # The arguments app.py passes to format_prompt_for_model, apart from the data
+    if backend == "spatial":
+        return request["analysis_text"], request["district"], request.get("police_station")
+    if backend == "beatwise":
+        return request["analysis_text"], request["district"], request.get("unitname"), request.get("beat_name")
+    return request["analysis_text"], request["district"], request.get("unitname")
+
+
+def build_prompts(backend, request, data):
+    """
+    Returns the prompt as it was built before compaction and as it is built now.
+    """
+    module = MODULES[backend]
+    captured = {}
+
+    def capture(backend, system_context_prompt, user_context_prompt, data):
+        captured.update(system=system_context_prompt, user=user_context_prompt)
+        return compact_builder(backend, system_context_prompt, user_context_prompt, data)
+
+    compact_builder = prompt_builder.build_prompt
+    module.build_prompt = capture
+    try:
+        compact = module.format_prompt_for_model(*prompt_arguments(backend, request), data)
+    finally:
+        module.build_prompt = compact_builder
+    raw = f"<s>[SYS] {captured['system']} [/SYS]\n[INST] {captured['user']}The data is as follows:\n\n{data} [/INST]"
+    return raw, compact
+
+
+def prompt_seconds(backend, prompt, repeats):
+    client = get_client(backend)
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        client.text_generation(prompt, max_new_tokens=1, do_sample=False)
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', default=SAMPLES_PATH, help="JSON file of sample requests")
+    parser.add_argument('--live', type=int, default=0, metavar='N', help="Time every prompt N times upstream")
+    args = parser.parse_args()
+
+    with open(args.samples) as samples_file:
+        samples = json.load(samples_file)
+
+    counter = "tokenizer" if prompt_builder.get_tokenizer() is not None else "characters / 4"
+    print(f"Token counts from {counter}")
+    header = f"{'sample':<26}{'before':>8}{'after':>8}{'saved':>8}"
+    if args.live:
+        header += f"{'before s':>10}{'after s':>10}"
+    print(header)
+
+    totals = [0, 0]
+    for sample in samples:
+        data = sample.get("data", sample["request"])
+        raw, compact = build_prompts(sample["backend"], sample["request"], data)
+        before, after = prompt_builder.count_tokens(raw), prompt_builder.count_tokens(compact)
+        totals[0] += before
+        totals[1] += after
+        line = f"{sample['name']:<26}{before:>8}{after:>8}{1 - after / before:>8.0%}"
+        if args.live:
+            line += f"{prompt_seconds(sample['backend'], raw, args.live):>10.2f}"
+            line += f"{prompt_seconds(sample['backend'], compact, args.live):>10.2f}"
+        print(line)
+    print(f"{'total':<26}{totals[0]:>8}{totals[1]:>8}{1 - totals[1] / totals[0]:>8.0%}")
+
+
+if __name__ == '__main__':
+    main()
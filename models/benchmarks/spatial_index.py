@@ -0,0 +1,122 @@
+"""
+Compares the SpatialIndex queries with a pandas boolean-mask scan of the whole DataFrame.
+
+Synthetic incidents are drawn around a few hundred hotspots inside Karnataka, so the point
+density is uneven like the real data. For every dataset size the index is built once, then
+the same random queries are answered both ways and the results are checked to match:
+
+    python benchmarks/spatial_index.py --rows 100000 1000000 10000000
+
+Queries:
+    viewport  a 0.2 x 0.2 degree bounding box (a city-sized map view)
+    radius    incidents within 2 km of a point
+    nearest   the 10 incidents nearest to a point
+Each is also run with a Crime_Type filter.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spatial_index import SpatialIndex, haversine_km  # noqa: E402
+
+CRIME_TYPES = ["Theft", "Assault", "Burglary", "Fraud", "Robbery", "Murder"]
+
+
+def synthetic_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    hotspots = np.column_stack([rng.uniform(12.0, 18.0, 300), rng.uniform(74.0, 78.0, 300)])
+    centre = hotspots[rng.integers(0, len(hotspots), rows)]
+    return pd.DataFrame({
+        "latitude": centre[:, 0] + rng.normal(0, 0.05, rows),
+        "longitude": centre[:, 1] + rng.normal(0, 0.05, rows),
+        "Crime_Type": pd.Categorical.from_codes(rng.integers(0, len(CRIME_TYPES), rows), CRIME_TYPES),
+    })
+
+
+def scan_viewport(frame, south, west, north, east, crime_type):
+    mask = frame['latitude'].between(south, north) & frame['longitude'].between(west, east)
+    if crime_type:
+        mask &= frame['Crime_Type'] == crime_type
+    return np.flatnonzero(mask.to_numpy())
+
+
+def scan_radius(frame, latitude, longitude, radius_km, crime_type):
+    distances = haversine_km(latitude, longitude, frame['latitude'].to_numpy(), frame['longitude'].to_numpy())
+    mask = distances <= radius_km
+    if crime_type:
+        mask &= (frame['Crime_Type'] == crime_type).to_numpy()
+    return np.flatnonzero(mask)
+
+
+def scan_nearest(frame, latitude, longitude, k, crime_type):
+    distances = haversine_km(latitude, longitude, frame['latitude'].to_numpy(), frame['longitude'].to_numpy())
+    if crime_type:
+        distances = np.where((frame['Crime_Type'] == crime_type).to_numpy(), distances, np.inf)
+    nearest = np.argpartition(distances, k)[:k]
+    return nearest[np.argsort(distances[nearest])]
+
+
+def timed(function, queries):
+    # Median milliseconds per query, and the results for checking
+    durations, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(function(*query))
+        durations.append(time.perf_counter() - start)
+    return 1000 * float(np.median(durations)), results
+
+
+def run(rows, queries, seed):
+    frame = synthetic_frame(rows, seed)
+    start = time.perf_counter()
+    index = SpatialIndex(frame)
+    build_seconds = time.perf_counter() - start
+
+    rng = np.random.default_rng(seed + 1)
+    points = frame[['latitude', 'longitude']].to_numpy()[rng.integers(0, rows, queries)]
+    measurements = []
+    for crime_type in (None, "Theft"):
+        filters = {"Crime_Type": crime_type} if crime_type else {}
+        boxes = [(lat - 0.1, lon - 0.1, lat + 0.1, lon + 0.1) for lat, lon in points]
+
+        index_ms, found = timed(lambda *box: index.viewport(*box, **filters), boxes)
+        scan_ms, expected = timed(lambda *box: scan_viewport(frame, *box, crime_type), boxes)
+        assert all(np.array_equal(a, b) for a, b in zip(found, expected))
+        measurements.append(("viewport", crime_type, index_ms, scan_ms))
+
+        centres = [(lat, lon) for lat, lon in points]
+        index_ms, found = timed(lambda lat, lon: index.radius(lat, lon, 2.0, **filters)[0], centres)
+        scan_ms, expected = timed(lambda lat, lon: scan_radius(frame, lat, lon, 2.0, crime_type), centres)
+        assert all(np.array_equal(np.sort(a), b) for a, b in zip(found, expected))
+        measurements.append(("radius", crime_type, index_ms, scan_ms))
+
+        index_ms, found = timed(lambda lat, lon: index.nearest(lat, lon, 10, **filters)[0], centres)
+        scan_ms, expected = timed(lambda lat, lon: scan_nearest(frame, lat, lon, 10, crime_type), centres)
+        assert all(len(a) == len(b) for a, b in zip(found, expected))
+        measurements.append(("nearest", crime_type, index_ms, scan_ms))
+    return build_seconds, measurements
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument('--queries', type=int, default=50, help="Queries of each kind per dataset size")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'rows':>10}  {'query':<10}{'filter':<8}{'index ms':>10}{'scan ms':>10}{'speedup':>9}")
+    for rows in args.rows:
+        build_seconds, measurements = run(rows, args.queries, args.seed)
+        print(f"{rows:>10}  {'build':<10}{'':<8}{build_seconds * 1000:>10.1f}")
+        for query, crime_type, index_ms, scan_ms in measurements:
+            print(f"{rows:>10}  {query:<10}{crime_type or '-':<8}{index_ms:>10.3f}{scan_ms:>10.3f}{scan_ms / index_ms:>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
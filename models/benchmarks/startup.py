@@ -0,0 +1,71 @@
+"""
+Measures how long loading the crime dataset takes and how much memory it uses.
+
+Each mode runs in a fresh interpreter so that timings and peak RSS are not skewed by
+earlier runs:
+
+    python benchmarks/startup.py dataset/updated_ml_model_ready_dataset.csv
+
+Modes:
+    csv       parse the CSV and clean it, as app.py did before the columnar cache
+    build     parse the CSV and write the columnar artifact (first start)
+    artifact  memory map the columnar artifact (every later start)
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODELS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MEASURE = '''
+import json, resource, sys, time
+sys.path.insert(0, {models_dir!r})
+import pandas as pd
+import dataset_loader
+
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+if {mode!r} == "csv":
+    df = dataset_loader.clean_dataset(pd.read_csv({csv_path!r}, low_memory=False))
+elif {mode!r} == "build":
+    df = dataset_loader.build_artifact({csv_path!r})
+else:
+    df = dataset_loader.load_dataset({csv_path!r}, columns={columns!r})
+    # Touch every loaded column so lazily paged data is counted
+    for column in df.columns:
+        df[column].to_numpy()
+elapsed = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"seconds": elapsed, "rows": len(df), "peak_rss_mb": peak / 1024, "load_rss_mb": (peak - baseline) / 1024}}))
+'''
+
+
+def measure(mode, csv_path, columns=None):
+    code = MEASURE.format(models_dir=MODELS_DIR, mode=mode, csv_path=os.path.abspath(csv_path), columns=columns)
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('csv_path', help="The dataset CSV to load")
+    parser.add_argument('--columns', help="Comma separated columns for an extra lazy-load measurement")
+    args = parser.parse_args()
+
+    results = {
+        "csv": measure("csv", args.csv_path),
+        "build": measure("build", args.csv_path),
+        "artifact": measure("artifact", args.csv_path),
+    }
+    if args.columns:
+        results["artifact_columns"] = measure("artifact", args.csv_path, args.columns.split(','))
+
+    print(f"{'mode':<18}{'rows':>10}{'seconds':>10}{'peak RSS MB':>14}{'load RSS MB':>14}")
+    for mode, result in results.items():
+        print(f"{mode:<18}{result['rows']:>10}{result['seconds']:>10.2f}{result['peak_rss_mb']:>14.1f}{result['load_rss_mb']:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
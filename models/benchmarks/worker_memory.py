@@ -0,0 +1,103 @@
+"""
+Measures per-worker memory of the API under gunicorn with different worker counts.
+
+For every worker count the server is started, warmed up with a /data request to each
+worker, and the RSS, PSS (RSS with shared pages divided between the processes sharing
+them) and USS (pages private to the process) of every worker are read from /proc:
+
+    python benchmarks/worker_memory.py --workers 4 8 16
+
+Runs with --preload (the default gunicorn.conf.py setting) and without it, so both the
+copy-on-write and the memory mapped sharing modes are measured. Linux only.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+MODELS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def read_memory(pid):
+    """
+    Returns the RSS, PSS and USS of a process in MB.
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as smaps:
+        for line in smaps:
+            name, _, rest = line.partition(':')
+            parts = rest.split()
+            if len(parts) == 2 and parts[1] == 'kB':
+                values[name] = int(parts[0]) / 1024
+    uss = values.get('Private_Clean', 0) + values.get('Private_Dirty', 0)
+    return values.get('Rss', 0), values.get('Pss', 0), uss
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as listing:
+        return [int(child) for child in listing.read().split()]
+
+
+def wait_until_ready(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/data?per_page=1", timeout=5).read()
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise TimeoutError("The server did not come up in time")
+
+
+def run(workers, preload, port, timeout):
+    environment = dict(os.environ, SHADOW_PRELOAD='1' if preload else '0', WEB_CONCURRENCY=str(workers))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b', f"127.0.0.1:{port}", 'app:app'],
+        cwd=MODELS_DIR,
+        env=environment,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(port, timeout)
+        # Touch every worker a few times so lazily initialised state is counted
+        for _ in range(workers * 4):
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/data?per_page=1000", timeout=30).read()
+        time.sleep(1)
+        worker_memory = [read_memory(pid) for pid in children(server.pid)]
+        master_memory = read_memory(server.pid)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+    count = len(worker_memory)
+    return {
+        "workers": count,
+        "rss": sum(memory[0] for memory in worker_memory) / count,
+        "pss": sum(memory[1] for memory in worker_memory) / count,
+        "uss": sum(memory[2] for memory in worker_memory) / count,
+        "total_pss": master_memory[1] + sum(memory[1] for memory in worker_memory),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[4, 8, 16])
+    parser.add_argument('--port', type=int, default=8123)
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    print(f"{'mode':<10}{'workers':>8}{'RSS MB':>10}{'PSS MB':>10}{'USS MB':>10}{'total PSS MB':>14}")
+    for preload in (False, True):
+        for workers in args.workers:
+            result = run(workers, preload, args.port, args.timeout)
+            mode = "preload" if preload else "per-worker"
+            print(f"{mode:<10}{result['workers']:>8}{result['rss']:>10.1f}{result['pss']:>10.1f}"
+                  f"{result['uss']:>10.1f}{result['total_pss']:>14.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+import json
+import os
+import time
+
+import pandas as pd
+from dotenv import load_dotenv  # type: ignore
+
+from snapshot import file_digest
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.feather as feather  # type: ignore
+except ImportError:
+    pa = None
+    feather = None
+
+load_dotenv()
+
+# Directory the columnar copies of the dataset are written to
+DATASET_CACHE_DIR = os.getenv(
+    'DATASET_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'),
+)
+# Comma separated list of columns to load; empty loads all of them
+DATASET_COLUMNS = os.getenv('DATASET_COLUMNS', '')
+
+# Bump when the artifact layout or cleaning rules change so old artifacts are rebuilt
+ARTIFACT_VERSION = 1
+
+# Repeated string columns stored as categoricals
+CATEGORICAL_COLUMNS = ("district_name", "unitname", "beat_name", "Crime_Type", "crime_group_name")
+# Any column whose name contains one of these is stored as a categorical as well
+CATEGORICAL_COLUMN_PARTS = ("caste", "profession")
+
+
+def valid_coordinates(df):
+    """
+    Returns a mask of the rows whose latitude and longitude are both non-zero.
+
+    Raises:
+        KeyError: If the latitude or longitude column is missing.
+    """
+    # Filter rows with zero latitude or longitude (optional, adjust for your data)
+    if 'latitude' in df.columns and 'longitude' in df.columns:
+        return (df['latitude'] != 0) & (df['longitude'] != 0)
+    raise KeyError("The required columns 'latitude' and 'longitude' are not present in the CSV file")
+
+
+def clean_dataset(df):
+    """
+    Applies the load-time cleaning rules to a freshly parsed dataset.
+
+    Rows with a zero latitude or longitude are dropped and repeated string columns
+    are converted to categoricals.
+
+    Raises:
+        KeyError: If the latitude or longitude column is missing.
+    """
+    df = df[valid_coordinates(df)].copy()
+    for column in df.columns:
+        if column in CATEGORICAL_COLUMNS or any(part in column for part in CATEGORICAL_COLUMN_PARTS):
+            if not pd.api.types.is_numeric_dtype(df[column]):
+                df[column] = df[column].astype('category')
+    return df
+
+
+def artifact_paths(csv_path):
+    """
+    Returns the paths of the columnar artifact and its metadata for a CSV file.
+    """
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    base = os.path.join(DATASET_CACHE_DIR, stem)
+    return base + '.feather', base + '.meta.json'
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as meta_file:
+            return json.load(meta_file)
+    except (OSError, ValueError):
+        return None
+
+
+def _artifact_is_current(csv_path, artifact_path, meta):
+    if meta is None or meta.get('version') != ARTIFACT_VERSION or not os.path.exists(artifact_path):
+        return False
+    stat = os.stat(csv_path)
+    if meta.get('source_mtime_ns') == stat.st_mtime_ns and meta.get('source_size') == stat.st_size:
+        return True
+    # The file was touched; only its contents decide whether the artifact is stale
+    return meta.get('source_digest') == file_digest(csv_path)
+
+
+def build_artifact(csv_path):
+    """
+    Parses the CSV, cleans it and writes it as an uncompressed Feather (Arrow IPC) file.
+
+    The artifact is uncompressed so that it can be memory mapped, and it is written to a
+    temporary file first so that concurrent readers never see a partial file.
+
+    Returns:
+        The cleaned DataFrame.
+    """
+    artifact_path, meta_path = artifact_paths(csv_path)
+    os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+
+    stat = os.stat(csv_path)
+    digest = file_digest(csv_path)
+    df = clean_dataset(pd.read_csv(csv_path, low_memory=False))
+
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    temporary_path = f"{artifact_path}.{os.getpid()}.tmp"
+    feather.write_feather(table, temporary_path, compression='uncompressed')
+    os.replace(temporary_path, artifact_path)
+
+    meta = {
+        'version': ARTIFACT_VERSION,
+        'source': os.path.abspath(csv_path),
+        'source_digest': digest,
+        'source_mtime_ns': stat.st_mtime_ns,
+        'source_size': stat.st_size,
+        'rows': len(df),
+        'built_at': time.time(),
+    }
+    temporary_meta_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(temporary_meta_path, 'w') as meta_file:
+        json.dump(meta, meta_file, indent=2)
+    os.replace(temporary_meta_path, meta_path)
+    return df
+
+
+def open_table(csv_path, columns=None):
+    """
+    Memory maps the columnar artifact of a CSV file as an Arrow table.
+
+    Columns are only paged in from disk when they are read, so this is the cheapest way
+    to get at a few columns of a large dataset.
+
+    Returns:
+        The Arrow table, or None if pyarrow is missing or the artifact is out of date.
+    """
+    if feather is None:
+        return None
+    artifact_path, meta_path = artifact_paths(csv_path)
+    if not _artifact_is_current(csv_path, artifact_path, _read_meta(meta_path)):
+        return None
+    table = feather.read_table(artifact_path, memory_map=True)
+    if columns:
+        # Keep the stored index so rows stay addressable by their source row number
+        index_columns = [
+            name for name in (table.schema.pandas_metadata or {}).get('index_columns', [])
+            if isinstance(name, str)
+        ]
+        table = table.select(list(columns) + index_columns)
+    return table
+
+
+def load_dataset(csv_path, columns=None):
+    """
+    Loads the crime dataset, converting the CSV to a columnar artifact on first use.
+
+    Later loads memory map the artifact instead of parsing the CSV again. Without pyarrow
+    the CSV is parsed and cleaned on every load, as before.
+
+    Args:
+        csv_path: The source CSV file.
+        columns: Columns to load, or None for DATASET_COLUMNS (all columns when unset).
+
+    Returns:
+        The cleaned DataFrame, indexed by the row number in the source CSV.
+    """
+    if columns is None and DATASET_COLUMNS:
+        columns = [column.strip() for column in DATASET_COLUMNS.split(',') if column.strip()]
+
+    if feather is None:
+        df = clean_dataset(pd.read_csv(csv_path, low_memory=False))
+        return df[columns] if columns else df
+
+    table = open_table(csv_path, columns=columns)
+    if table is None:
+        df = build_artifact(csv_path)
+        return df[columns] if columns else df
+
+    # split_blocks keeps each column in its own block so numeric columns stay zero-copy
+    return table.to_pandas(split_blocks=True)
@@ -1,17 +1,7 @@
-import os
 import re
 
-from huggingface_hub import InferenceClient  # type: ignore
-from dotenv import load_dotenv  # type: ignore
-
-load_dotenv()
-print("Environment Keys Loaded:", os.getenv('HUGGINGFACE_API_PREDICTION'))  # This should print your API key if loaded correctly
-
-# Load the text generation model from Hugging Face Hub
-hf_api_key = os.getenv('HUGGINGFACE_API_PREDICTION')
-if not hf_api_key:
-    raise ValueError("Hugging Face API Key not set in environment variable")
-text_generation_client = InferenceClient(token=hf_api_key, model="mistralai/Mixtral-8x7B-Instruct-v0.1")
+from llm_cache import cached_generation
+from prompt_builder import build_prompt
 
 # Define a function to format prompts for the model
 def format_prompt_for_model(user_prompt, district, unitname, data):
@@ -39,15 +29,15 @@ def format_prompt_for_model(user_prompt, district, unitname, data):
     )
     user_context_prompt = (
         f"I am providing you with data on various crime-related fields in the {district} district and {unitname} unit name, along with either a month range or a time range. Please provide an analysis on this data and identify any potential connections or correlations between these fields, as per the guidelines provided in the system context prompt. Based on your analysis, make deployment plans for specific areas considering the given month range or time range and the crime frequency."
-        f"The data is as follows:\n\n{data}"
+        "If the data is an officer allocation table, it is the computed deployment plan: keep its officer numbers, explain the plan shift by shift and add the tactics that go with it."
     )
 
-    # Combine all prompt sections into a single formatted prompt
-    combined_prompt = f"<s>[SYS] {system_context_prompt} [/SYS]\n[INST] {user_context_prompt} [/INST]"
+    # Combine all prompt sections into a single formatted prompt, with the data compacted to fit the token budget
+    combined_prompt = build_prompt("deployment", system_context_prompt, user_context_prompt, data)
     return combined_prompt
 
 
-def generate_deployment_plan(analysis_text, district, unitname, data):
+def stream_deployment_plan(analysis_text, district, unitname, data):
     """
     Generates text using the loaded model, with options for controlling the output.
 
@@ -55,7 +45,7 @@ def generate_deployment_plan(analysis_text, district, unitname, data):
         analysis_text: The specific text prompt to be processed by the model.
 
     Returns:
-        The generated text as a string.
+        A generator of text chunks, yielded as the model produces them.
     """
     # Set model parameters for text generation
     generation_parameters = dict(
@@ -70,18 +60,23 @@ def generate_deployment_plan(analysis_text, district, unitname, data):
     # Format the prompt for the model
     model_ready_prompt = format_prompt_for_model(analysis_text, district, unitname, data)
 
-    # Generate text using the model
-    generated_text_stream = text_generation_client.text_generation(
-        model_ready_prompt,
-        **generation_parameters,
-        stream=True,
-        details=True,
-        return_full_text=True,
-    )
+    # Generate text using the model, reusing an earlier identical generation if there is one
+    text_segments = cached_generation("deployment", model_ready_prompt, generation_parameters)
+
+    # Forward generated text segments as they arrive
+    yield from text_segments
 
-    # Combine generated text segments into a final output string
-    final_output_text = ""
-    for text_segment in generated_text_stream:
-        final_output_text += text_segment.token.text
 
-    return final_output_text
+def generate_deployment_plan(analysis_text, district, unitname, data):
+    """
+    Generates text using the loaded model, with options for controlling the output.
+
+    Args:
+        analysis_text: The specific text prompt to be processed by the model.
+
+    Returns:
+        The generated text as a string.
+    """
+
+    # Combine generated text segments into a final output string
+    return "".join(stream_deployment_plan(analysis_text, district, unitname, data))
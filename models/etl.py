@@ -0,0 +1,374 @@
+"""
+Cleans a crime CSV of any size into a deduplicated, partitioned columnar dataset.
+
+The CSV is streamed in chunks in two passes, so memory stays bounded however large it is:
+
+1. The file is split into byte ranges that worker processes parse in chunks. Every row is
+   hash-partitioned on crime_no into spill files, so all rows of a crime number end up in
+   the same partition, and per-column type statistics are collected along the way.
+2. Worker processes then clean one partition at a time. Rows whose crime_no occurs more
+   than once are dropped (duplicated(keep=False)), columns get the types read_csv would
+   infer from the whole file, rows with a zero latitude or longitude are dropped as at
+   load time, and the rest is written as Parquet partitioned by district and year.
+
+Pass 1 holds about one chunk per worker in memory; pass 2 about one partition (the file
+divided by --partitions) per worker. Rows per second and peak memory are reported at the
+end. Run it from the models directory:
+
+    python etl.py ../heatmap-backend/dataset/final.csv dataset/clean --workers 8
+    python etl.py final.csv dataset/clean --csv dataset/updated_ml_model_ready_dataset.csv
+
+The output can be read with pyarrow.dataset.dataset(path, partitioning='hive'); --csv
+also writes the cleaned rows as one CSV that app.py can load. Byte ranges are split at
+line breaks, so use --workers 1 for files with line breaks inside quoted fields.
+"""
+import argparse
+import csv
+import io
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv  # type: ignore
+
+from dataset_loader import valid_coordinates
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.dataset as pa_dataset  # type: ignore
+except ImportError:
+    pa = None
+    pa_dataset = None
+
+load_dotenv()
+
+# Rows parsed at a time by each worker in the first pass
+ETL_CHUNK_ROWS = int(os.getenv('ETL_CHUNK_ROWS', '200000'))
+# Hash partitions of crime_no; each is cleaned in memory on its own in the second pass
+ETL_PARTITIONS = int(os.getenv('ETL_PARTITIONS', '32'))
+# Worker processes of both passes
+ETL_WORKERS = int(os.getenv('ETL_WORKERS', str(os.cpu_count() or 1)))
+
+# Column duplicates are eliminated on
+KEY_COLUMN = "crime_no"
+# Directory levels of the output, where the columns exist
+PARTITION_COLUMNS = ("district_name", "year")
+
+# Source order of the rows, carried through the spill files: worker << ROW_BITS | row
+ROW_COLUMN = "_row"
+ROW_BITS = 40
+
+# Values read_csv parses as integers and as floats
+_INTEGER = r'\s*[+-]?\d+\s*'
+_NUMBER = r'\s*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?\s*'
+
+
+class _RangeFile(io.RawIOBase):
+    # The bytes [start, stop) of a file, as a file object read_csv can parse
+
+    def __init__(self, path, start, stop):
+        self._file = open(path, 'rb')
+        self._file.seek(start)
+        self._remaining = stop - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._remaining)
+        if size <= 0:
+            return 0
+        read = self._file.readinto(memoryview(buffer)[:size])
+        self._remaining -= read
+        return read
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def read_header(path):
+    """
+    Returns the column names of a CSV file and the byte offset of its first row.
+    """
+    with open(path, 'rb') as source:
+        header = source.readline()
+        return next(csv.reader([header.decode('utf-8-sig')])), source.tell()
+
+
+def byte_ranges(path, parts):
+    """
+    Splits the rows of a CSV file into about equal byte ranges that start and end at line breaks.
+
+    Returns:
+        A list of (start, stop) byte offsets covering every row once.
+    """
+    _, start = read_header(path)
+    size = os.path.getsize(path)
+    bounds = [start]
+    with open(path, 'rb') as source:
+        for part in range(1, parts):
+            source.seek(start + (size - start) * part // parts)
+            # Move on to the start of the next line
+            source.readline()
+            if bounds[-1] < source.tell() < size:
+                bounds.append(source.tell())
+    bounds.append(size)
+    return [(first, last) for first, last in zip(bounds[:-1], bounds[1:]) if last > first]
+
+
+def partition_range(path, columns, start, stop, worker, spill_dir, partitions, chunk_rows=ETL_CHUNK_ROWS):
+    """
+    First pass over one byte range: spills its rows into hash partitions of crime_no.
+
+    Values are kept as strings, so every chunk has the same schema whatever it holds.
+
+    Returns:
+        The number of rows and, per column, the counts of values present, numeric and integer.
+    """
+    schema = pa.schema([(column, pa.string()) for column in columns] + [(ROW_COLUMN, pa.int64())])
+    stats = {column: np.zeros(3, dtype=np.int64) for column in columns}
+    writers = {}
+    rows = 0
+    try:
+        with io.BufferedReader(_RangeFile(path, start, stop), 1 << 20) as source:
+            chunks = pd.read_csv(source, header=None, names=columns, dtype=str, chunksize=chunk_rows)
+            for chunk in chunks:
+                chunk[ROW_COLUMN] = (worker << ROW_BITS) + rows + np.arange(len(chunk), dtype=np.int64)
+                rows += len(chunk)
+                for column in columns:
+                    values = chunk[column]
+                    counts = stats[column]
+                    # Once a column has held text it stays a string, so stop matching numbers
+                    if counts[1] == counts[0]:
+                        counts[1] += int(_matches(values, _NUMBER))
+                        counts[2] += int(_matches(values, _INTEGER))
+                    counts[0] += int(values.notna().sum())
+
+                hashes = pd.util.hash_pandas_object(chunk[KEY_COLUMN], index=False).to_numpy()
+                partition = (hashes % np.uint64(partitions)).astype(np.int64)
+                order = np.argsort(partition, kind='stable')
+                bounds = np.searchsorted(partition[order], np.arange(partitions + 1))
+                table = pa.Table.from_pandas(chunk.iloc[order], schema=schema, preserve_index=False)
+                for part in range(partitions):
+                    if bounds[part] == bounds[part + 1]:
+                        continue
+                    writer = writers.get(part)
+                    if writer is None:
+                        spill_path = os.path.join(spill_dir, f"part-{part:05d}-{worker:05d}.arrow")
+                        writer = writers[part] = pa.ipc.new_stream(spill_path, schema)
+                    writer.write_table(table.slice(bounds[part], bounds[part + 1] - bounds[part]))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return {"rows": rows, "stats": {column: counts.tolist() for column, counts in stats.items()}}
+
+
+def _matches(values, pattern):
+    # Number of values matching a pattern in full; missing values do not match
+    return values.str.fullmatch(pattern).fillna(False).astype(bool).sum()
+
+
+def column_types(stats, rows):
+    """
+    Infers the type of every column from the first pass's statistics, as read_csv would.
+
+    Columns whose present values are all numeric are int when they are all integers and
+    none is missing, and float otherwise; everything else stays a string.
+    """
+    types = {}
+    for column, (present, numeric, integer) in stats.items():
+        if numeric == present:
+            types[column] = "int" if rows and present == rows and integer == present else "float"
+        else:
+            types[column] = "str"
+    return types
+
+
+def clean_partition(part, spill_dir, output, types, csv_dir=None):
+    """
+    Second pass over one partition: deduplicates, types, filters and writes its rows.
+
+    Returns:
+        The numbers of rows read, dropped as duplicates, dropped for zero coordinates and written.
+    """
+    spills = sorted(
+        os.path.join(spill_dir, name) for name in os.listdir(spill_dir)
+        if name.startswith(f"part-{part:05d}-")
+    )
+    report = {"rows": 0, "duplicates": 0, "zero_coordinates": 0, "written": 0}
+    if not spills:
+        return report
+    tables = []
+    for spill in spills:
+        with pa.ipc.open_stream(spill) as reader:
+            tables.append(reader.read_all())
+    df = pa.concat_tables(tables).to_pandas()
+    report["rows"] = len(df)
+
+    # Every row of a crime number is in this partition, so this matches deduplicating the whole file
+    df = df[~df[KEY_COLUMN].duplicated(keep=False)]
+    report["duplicates"] = report["rows"] - len(df)
+    df = df.sort_values(ROW_COLUMN, kind='stable').drop(columns=ROW_COLUMN)
+
+    for column, kind in types.items():
+        if kind == "int":
+            df[column] = pd.to_numeric(df[column]).astype(np.int64)
+        elif kind == "float":
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype(np.float64)
+    valid = valid_coordinates(df)
+    report["zero_coordinates"] = int((~valid).sum())
+    df = df[valid]
+    report["written"] = len(df)
+
+    partitioning = [column for column in PARTITION_COLUMNS if column in df.columns]
+    pa_dataset.write_dataset(
+        pa.Table.from_pandas(df, preserve_index=False),
+        output,
+        format='parquet',
+        partitioning=partitioning or None,
+        partitioning_flavor='hive' if partitioning else None,
+        basename_template=f"part-{part:05d}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore',
+    )
+    if csv_dir is not None:
+        df.to_csv(os.path.join(csv_dir, f"part-{part:05d}.csv"), header=False, index=False)
+    return report
+
+
+def _run(function, jobs, workers):
+    # Runs function(*job) for every job, in worker processes unless there is only one worker
+    if workers <= 1:
+        return [function(*job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(function, *job) for job in jobs]
+        return [future.result() for future in futures]
+
+
+def peak_memory_mb():
+    """
+    Returns the peak resident memory in MB of this process and of its largest finished worker.
+    """
+    # ru_maxrss is in kilobytes on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, workers
+
+
+def run_etl(source, output, workers=ETL_WORKERS, partitions=ETL_PARTITIONS, chunk_rows=ETL_CHUNK_ROWS,
+            csv_path=None, spill_dir=None):
+    """
+    Cleans a CSV file into a partitioned Parquet dataset, see the module docstring.
+
+    Args:
+        source: The source CSV file.
+        output: The output directory; it must not exist or be empty.
+        workers: Worker processes of both passes.
+        partitions: Hash partitions of crime_no.
+        chunk_rows: Rows parsed at a time in the first pass.
+        csv_path: Also write the cleaned rows to this CSV file.
+        spill_dir: Directory for the temporary spill files, next to output by default.
+
+    Returns:
+        A dict with the row counts, the column types and the timings of both passes.
+
+    Raises:
+        KeyError: If the CSV has no crime_no, latitude or longitude column.
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow is required to write the cleaned dataset")
+    columns, _ = read_header(source)
+    missing = [column for column in (KEY_COLUMN, 'latitude', 'longitude') if column not in columns]
+    if missing:
+        raise KeyError(f"The required columns {missing} are not present in the CSV file")
+
+    started = time.perf_counter()
+    output = os.path.abspath(output)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    spill_dir = spill_dir or os.path.dirname(output)
+    os.makedirs(spill_dir, exist_ok=True)
+    spill_root = tempfile.mkdtemp(prefix='etl-', dir=spill_dir)
+    try:
+        spills = os.path.join(spill_root, 'spill')
+        os.makedirs(spills)
+        ranges = byte_ranges(source, max(workers, 1))
+        first = _run(partition_range, [
+            (source, columns, start, stop, worker, spills, partitions, chunk_rows)
+            for worker, (start, stop) in enumerate(ranges)
+        ], workers)
+        rows = sum(result["rows"] for result in first)
+        stats = {column: np.sum([result["stats"][column] for result in first], axis=0).tolist() for column in columns}
+        types = column_types(stats, rows)
+        partitioned = time.perf_counter()
+
+        csv_dir = None
+        if csv_path is not None:
+            csv_dir = os.path.join(spill_root, 'csv')
+            os.makedirs(csv_dir)
+        second = _run(clean_partition, [
+            (part, spills, output, types, csv_dir) for part in range(partitions)
+        ], workers)
+        if csv_path is not None:
+            _concatenate_csv(csv_dir, columns, csv_path)
+        finished = time.perf_counter()
+    finally:
+        shutil.rmtree(spill_root, ignore_errors=True)
+
+    report = {
+        "rows": rows,
+        "duplicates": sum(result["duplicates"] for result in second),
+        "zero_coordinates": sum(result["zero_coordinates"] for result in second),
+        "written": sum(result["written"] for result in second),
+        "types": types,
+        "partition_seconds": round(partitioned - started, 2),
+        "clean_seconds": round(finished - partitioned, 2),
+        "seconds": round(finished - started, 2),
+    }
+    report["rows_per_second"] = round(rows / max(finished - started, 1e-9))
+    report["peak_memory_mb"], report["peak_worker_memory_mb"] = (round(value, 1) for value in peak_memory_mb())
+    return report
+
+
+def _concatenate_csv(csv_dir, columns, csv_path):
+    # Join the per-partition CSV files under one header
+    temporary_path = f"{csv_path}.{os.getpid()}.tmp"
+    with open(temporary_path, 'w', newline='') as target:
+        csv.writer(target, lineterminator='\n').writerow(columns)
+        for name in sorted(os.listdir(csv_dir)):
+            with open(os.path.join(csv_dir, name), newline='') as part:
+                shutil.copyfileobj(part, target, 1 << 20)
+    os.replace(temporary_path, csv_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help="The CSV file to clean")
+    parser.add_argument('output', help="Directory to write the partitioned Parquet dataset to")
+    parser.add_argument('--workers', type=int, default=ETL_WORKERS)
+    parser.add_argument('--partitions', type=int, default=ETL_PARTITIONS, help="Hash partitions of crime_no")
+    parser.add_argument('--chunk-rows', type=int, default=ETL_CHUNK_ROWS, help="Rows parsed at a time")
+    parser.add_argument('--csv', help="Also write the cleaned rows to this CSV file")
+    parser.add_argument('--spill-dir', help="Directory for temporary files, next to the output by default")
+    parser.add_argument('--overwrite', action='store_true', help="Replace the output directory if it exists")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.output) and os.listdir(args.output):
+        if not args.overwrite:
+            parser.error(f"{args.output} is not empty; pass --overwrite to replace it")
+        shutil.rmtree(args.output)
+
+    report = run_etl(args.source, args.output, args.workers, args.partitions, args.chunk_rows, args.csv, args.spill_dir)
+    print(f"{report['rows']} rows read, {report['duplicates']} with a duplicated {KEY_COLUMN} and "
+          f"{report['zero_coordinates']} with zero coordinates dropped, {report['written']} written")
+    print(f"{report['seconds']:.1f} s ({report['partition_seconds']:.1f} s partitioning, "
+          f"{report['clean_seconds']:.1f} s cleaning), {report['rows_per_second']} rows/s")
+    print(f"Peak memory {report['peak_memory_mb']:.0f} MB, largest worker {report['peak_worker_memory_mb']:.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
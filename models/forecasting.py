@@ -0,0 +1,277 @@
+import numpy as np
+import pandas as pd
+
+from aggregates import DATE_COLUMN, temporal_bins
+
+# Area levels forecasts are made for; every level is also split by crime type
+AREA_LEVELS = ("district_name", "unitname")
+CRIME_TYPE_COLUMN = "Crime_Type"
+
+# Months forecast ahead by default
+FORECAST_HORIZON = 3
+# Smoothing factor of the EWMA level; higher values follow recent months more closely
+EWMA_ALPHA = 0.3
+# Pseudo-months pulling each month-of-year factor towards 1 when a series is short or sparse
+SEASONAL_SHRINKAGE = 2.0
+# Pseudo-counts pulling a series' hourly profile towards the statewide one
+HOURLY_SHRINKAGE = 24.0
+# Two-sided 90% normal quantile for the forecast intervals
+INTERVAL_Z = 1.645
+# Months of history used to initialise the level before one-step errors are scored
+WARMUP_MONTHS = 12
+
+# Crime types listed in the prompt table, the busiest first
+PROMPT_CRIME_TYPES = 8
+# Busiest hours listed in the prompt table
+PROMPT_PEAK_HOURS = 4
+
+
+def month_label(month_number):
+    """
+    Formats a month number (year * 12 + month - 1) as YYYY-MM.
+    """
+    year, month = divmod(int(month_number), 12)
+    return f"{year}-{month + 1:02d}"
+
+
+def _month_numbers(frame):
+    # Month number of every row and the last complete month, NaN where the date is unknown
+    dates = pd.to_datetime(frame[DATE_COLUMN], errors='coerce')
+    numbers = (dates.dt.year * 12 + dates.dt.month - 1).to_numpy(dtype=np.float64)
+    last_date = dates.max()
+    if pd.isna(last_date):
+        return numbers, None
+    last = last_date.year * 12 + last_date.month - 1
+    # A month the data stops partway through would look like a sudden drop
+    if last_date.day < last_date.days_in_month and np.nanmin(numbers) < last:
+        last -= 1
+    return numbers, last
+
+
+def _interval(expected, dispersion):
+    # Poisson interval from the square-root transform, whose variance is dispersion / 4
+    root = np.sqrt(expected)
+    spread = INTERVAL_Z / 2.0 * np.sqrt(dispersion)
+    lower = np.floor(np.maximum(root - spread, 0.0) ** 2)
+    upper = np.ceil((root + spread) ** 2)
+    return lower, upper
+
+
+class ForecastModel:
+    """
+    Monthly and hourly crime count forecasts for every district and unit, overall and per crime type.
+
+    All series are built with one bincount per level and fitted together, one NumPy operation
+    per month across every series:
+
+    - each series gets month-of-year factors, shrunk towards 1 by SEASONAL_SHRINKAGE;
+    - an EWMA of the deseasonalised counts gives the level, and the forecast for a month
+      is the level times that month's factor;
+    - intervals are Poisson, widened by the dispersion of the one-step-ahead errors
+      (quasi-Poisson) when the counts vary more than a Poisson process would;
+    - expected counts by hour of day split the next month's forecast by the series' hourly
+      profile, shrunk towards the statewide one.
+
+    Series are addressed like AggregationCube groups, by an area key ((), (district,) or
+    (district, unitname)) and a crime type, None for all crime types.
+
+    Args:
+        frame: The cleaned crime DataFrame.
+        horizon: Number of months to forecast.
+    """
+
+    def __init__(self, frame, horizon=FORECAST_HORIZON):
+        self.horizon = horizon
+        self.levels = [level for level in AREA_LEVELS if level in frame.columns]
+        self.by_type = CRIME_TYPE_COLUMN in frame.columns
+        # (area key, crime type) -> row of the arrays below
+        self.series = {}
+        self._build(frame)
+
+    def _group_levels(self):
+        for depth in range(len(self.levels) + 1):
+            yield self.levels[:depth], False
+            if self.by_type:
+                yield self.levels[:depth], True
+
+    def _build(self, frame):
+        numbers, last = _month_numbers(frame)
+        first = int(np.nanmin(numbers)) if last is not None else 0
+        self.first_month = first
+        self.last_month = last if last is not None else first - 1
+        months = self.last_month - first + 1
+
+        in_range = np.isfinite(numbers) & (numbers <= self.last_month)
+        month_index = np.where(in_range, numbers - first, -1).astype(np.int64)
+        hours = temporal_bins(frame).get("hour", np.full(len(frame), -1, dtype=np.int64))
+
+        monthly, hourly = [], []
+        for key_columns, by_type in self._group_levels():
+            columns = key_columns + ([CRIME_TYPE_COLUMN] if by_type else [])
+            if columns:
+                grouped = frame.groupby(columns, observed=True, sort=True)
+                # Rows with a missing key column are in no group and get -1
+                ids = grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+                keys = [key if isinstance(key, tuple) else (key,) for key in grouped.size().index]
+            else:
+                ids = np.zeros(len(frame), dtype=np.int64)
+                keys = [()]
+
+            offset = len(self.series)
+            for row, key in enumerate(keys):
+                area = tuple(key[:len(key_columns)])
+                self.series[(area, key[-1] if by_type else None)] = offset + row
+
+            counted = (ids >= 0) & (month_index >= 0)
+            monthly.append(np.bincount(
+                ids[counted] * months + month_index[counted], minlength=len(keys) * months,
+            ).reshape(len(keys), months))
+            counted = (ids >= 0) & (hours >= 0)
+            hourly.append(np.bincount(ids[counted] * 24 + hours[counted], minlength=len(keys) * 24).reshape(len(keys), 24))
+
+        self.history = np.vstack(monthly).astype(np.float64)
+        self.hourly_history = np.vstack(hourly).astype(np.float64)
+        self._fit()
+
+    def _fit(self):
+        history = self.history
+        series, months = history.shape
+        month_of_year = (self.first_month + np.arange(months)) % 12
+        one_hot = np.eye(12)[month_of_year]
+
+        # Month-of-year factors, shrunk towards 1 and normalised to average 1
+        mean = history.mean(axis=1, keepdims=True) if months else np.zeros((series, 1))
+        totals = history @ one_hot
+        seen = one_hot.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            factors = (totals + SEASONAL_SHRINKAGE * mean) / ((seen + SEASONAL_SHRINKAGE) * mean)
+        factors = np.where(mean > 0, factors, 1.0)
+        factors /= factors.mean(axis=1, keepdims=True)
+        self.factors = factors
+
+        # EWMA of the deseasonalised counts, scoring one-step-ahead forecasts after the warmup
+        deseasonalised = history / factors[:, month_of_year]
+        warmup = min(WARMUP_MONTHS, months)
+        level = deseasonalised[:, :warmup].mean(axis=1) if warmup else np.zeros(series)
+        absolute_errors = np.zeros(series)
+        pearson = np.zeros(series)
+        scored = 0
+        for month in range(months):
+            if month >= warmup:
+                fitted = level * factors[:, month_of_year[month]]
+                absolute_errors += np.abs(history[:, month] - fitted)
+                pearson += (history[:, month] - fitted) ** 2 / np.maximum(fitted, 1.0)
+                scored += 1
+            level = EWMA_ALPHA * deseasonalised[:, month] + (1 - EWMA_ALPHA) * level
+        self.level = level
+
+        self.mae = absolute_errors / scored if scored else np.full(series, np.nan)
+        self.dispersion = np.maximum(pearson / scored, 1.0) if scored else np.ones(series)
+        # Seasonal-naive error over the same months, the baseline the model should beat
+        if months > 12 and warmup == 12:
+            self.naive_mae = np.abs(history[:, 12:] - history[:, :-12]).mean(axis=1)
+        else:
+            self.naive_mae = np.full(series, np.nan)
+
+        future = (self.last_month + 1 + np.arange(self.horizon)) % 12
+        self.expected = level[:, None] * factors[:, future]
+        self.lower, self.upper = _interval(self.expected, self.dispersion[:, None])
+
+        # Hourly profiles shrunk towards the statewide profile, scaled to next month's forecast
+        statewide = self.hourly_history[self.series[((), None)]] if ((), None) in self.series else np.ones(24)
+        statewide = statewide / max(statewide.sum(), 1.0)
+        shares = (self.hourly_history + HOURLY_SHRINKAGE * statewide) / (
+            self.hourly_history.sum(axis=1, keepdims=True) + HOURLY_SHRINKAGE
+        )
+        self.hourly_expected = shares * self.expected[:, :1]
+        self.hourly_lower, self.hourly_upper = _interval(self.hourly_expected, self.dispersion[:, None])
+
+    def __contains__(self, key):
+        return (key, None) in self.series
+
+    def crime_types(self, key):
+        """
+        Returns the crime types that have a series in an area.
+        """
+        return [crime_type for area, crime_type in self.series if area == key and crime_type is not None]
+
+    def forecast(self, key, crime_type=None, history_months=12):
+        """
+        Returns the forecast of one series with its recent history.
+
+        Args:
+            key: The area key.
+            crime_type: The crime type, or None for all crime types.
+            history_months: Number of most recent observed months to include.
+
+        Returns:
+            A dict with the observed `history`, the monthly `forecast` with intervals, the
+            `hourly` expected counts for the next month and the backtest errors, or None
+            if the series does not exist.
+        """
+        row = self.series.get((key, crime_type))
+        if row is None:
+            return None
+        months = self.history.shape[1]
+        recent = range(max(months - history_months, 0), months)
+        return {
+            "history": [
+                {"month": month_label(self.first_month + month), "count": int(self.history[row, month])}
+                for month in recent
+            ],
+            "forecast": [
+                {
+                    "month": month_label(self.last_month + 1 + step),
+                    "expected": round(float(self.expected[row, step]), 2),
+                    "lower": int(self.lower[row, step]),
+                    "upper": int(self.upper[row, step]),
+                }
+                for step in range(self.horizon)
+            ],
+            "hourly": [
+                {
+                    "hour": hour,
+                    "expected": round(float(self.hourly_expected[row, hour]), 2),
+                    "lower": int(self.hourly_lower[row, hour]),
+                    "upper": int(self.hourly_upper[row, hour]),
+                }
+                for hour in range(24)
+            ],
+            "mae": None if np.isnan(self.mae[row]) else round(float(self.mae[row]), 2),
+            "seasonal_naive_mae": None if np.isnan(self.naive_mae[row]) else round(float(self.naive_mae[row]), 2),
+        }
+
+    def prompt_table(self, key):
+        """
+        Formats the forecasts of an area as a compact plain-text table for the analysis prompt.
+
+        Lists the overall series and the busiest crime types, each with its expected count
+        and 90% interval for every forecast month and its total over the last 12 months,
+        followed by the busiest hours of the next month.
+        """
+        rows = [(None, self.series[(key, None)])]
+        by_type = sorted(
+            ((crime_type, self.series[(key, crime_type)]) for crime_type in self.crime_types(key)),
+            key=lambda item: -self.expected[item[1], 0],
+        )
+        rows += by_type[:PROMPT_CRIME_TYPES]
+
+        months = [month_label(self.last_month + 1 + step) for step in range(self.horizon)]
+        lines = [
+            f"Monthly crime count forecast, expected (90% interval); data up to {month_label(self.last_month)}",
+            " | ".join(["Crime type"] + months + ["Last 12 months"]),
+        ]
+        for crime_type, row in rows:
+            cells = [
+                f"{self.expected[row, step]:.0f} ({self.lower[row, step]:.0f}-{self.upper[row, step]:.0f})"
+                for step in range(self.horizon)
+            ]
+            observed = int(self.history[row, -12:].sum())
+            lines.append(" | ".join([crime_type or "All crimes"] + cells + [str(observed)]))
+
+        overall = self.series[(key, None)]
+        peaks = np.argsort(-self.hourly_expected[overall], kind='stable')[:PROMPT_PEAK_HOURS]
+        lines.append(f"Busiest hours in {months[0]}, expected crimes: " + ", ".join(
+            f"{hour:02d}:00 {self.hourly_expected[overall, hour]:.1f}" for hour in peaks
+        ))
+        return "\n".join(lines)
@@ -0,0 +1,43 @@
+import gc
+import glob
+import os
+
+from dotenv import load_dotenv  # type: ignore
+
+load_dotenv()
+
+# FastAPI is an ASGI app, so the workers must speak ASGI
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = os.getenv('BIND', ':8000')
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+
+# Load app.py, and with it the crime DataFrame, once in the master before forking.
+# Workers then share the master's memory pages copy-on-write instead of each loading
+# their own copy. Set SHADOW_PRELOAD=0 to load the app in every worker instead; the
+# memory mapped dataset artifact is still shared through the page cache in that mode.
+preload_app = os.getenv('SHADOW_PRELOAD', '1') != '0'
+
+# Every worker writes its metrics to this directory, so that /metrics scraped from any
+# worker reports all of them; set before the app is loaded, which reads it at import
+os.environ.setdefault(
+    'METRICS_MULTIPROC_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'metrics'),
+)
+
+
+def on_starting(server):
+    # Entries posted to /entries are only read back by the other workers from the entries file
+    if server.cfg.workers > 1 and float(os.getenv('INGEST_POLL_INTERVAL', '5')) <= 0:
+        raise RuntimeError("INGEST_POLL_INTERVAL=0 needs a single worker: other workers would never see posted entries")
+    # Counters of the workers of an earlier run would otherwise be added to this run's
+    directory = os.environ['METRICS_MULTIPROC_DIR']
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, '*.json*')):
+            os.remove(path)
+
+
+def pre_fork(server, worker):
+    # Move everything allocated so far out of the collector's reach, so that garbage
+    # collection in the workers does not write to (and thereby copy) the shared pages
+    if preload_app:
+        gc.freeze()
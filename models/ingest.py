@@ -0,0 +1,412 @@
+import asyncio
+import csv
+import io
+import json
+import logging
+import os
+import threading
+import time
+
+import pandas as pd
+from dotenv import load_dotenv  # type: ignore
+
+from aggregates import DATE_COLUMN, TIME_COLUMN
+from dataset_loader import DATASET_CACHE_DIR, _read_meta, artifact_paths, feather, pa
+
+load_dotenv()
+
+# File the heatmap backend's /api/entries appends new incidents to
+INGEST_ENTRIES_PATH = os.getenv(
+    'INGEST_ENTRIES_PATH',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'heatmap-backend', 'dataset', 'entries.csv'),
+)
+# Seconds between checks of the entries file for new lines; 0 only ingests entries posted to the API
+INGEST_POLL_INTERVAL = float(os.getenv('INGEST_POLL_INTERVAL', '5'))
+# Seconds, and ingested rows, after which the ingested rows are compacted into a snapshot
+INGEST_COMPACT_INTERVAL = float(os.getenv('INGEST_COMPACT_INTERVAL', '3600'))
+INGEST_COMPACT_ROWS = int(os.getenv('INGEST_COMPACT_ROWS', '10000'))
+
+# Fields of an entry in the order the frontend's form posts them, which is the column
+# order of the headerless entries file
+ENTRY_FIELDS = (
+    "crime_no", "district_name", "unitname", "accused_presentaddress", "victim_presentaddress",
+    "accused_age", "accused_caste", "accused_profession", "accused_sex", "victim_age",
+    "victim_profession", "victim_sex", "crime", "latitude", "longitude", "fir_type", "fir_stage",
+    "distance_from_ps", "beat_name", "place_of_offence", "offence_from_date", "offence_from_time",
+    "offence_to_date", "offence_to_time",
+)
+# Dataset column of every entry field that has one; the other fields are not kept
+ENTRY_COLUMNS = {
+    "crime_no": "crime_no",
+    "district_name": "district_name",
+    "unitname": "unitname",
+    "beat_name": "beat_name",
+    "crime": "Crime_Type",
+    "accused_age": "accused_age",
+    "accused_caste": "accused_caste",
+    "accused_profession": "accused_profession",
+    "victim_age": "victim_age",
+    "victim_profession": "victim_profession",
+    "latitude": "latitude",
+    "longitude": "longitude",
+    "offence_from_date": DATE_COLUMN,
+    "offence_from_time": TIME_COLUMN,
+}
+
+# Bump when the snapshot layout changes so old snapshots are ignored
+SNAPSHOT_VERSION = 2
+# Schema metadata key of the snapshot's own metadata
+SNAPSHOT_META_KEY = b'ingested_snapshot'
+
+# Ingestion progress goes to the server log
+logger = logging.getLogger("uvicorn.error")
+
+
+def parse_entry_lines(lines):
+    """
+    Parses lines of the entries file.
+
+    Returns:
+        A DataFrame with one string column per entry field, and the number of malformed lines.
+    """
+    rows, malformed = [], 0
+    for row in csv.reader(lines):
+        if not row or row[0] == ENTRY_FIELDS[0]:
+            # Blank line, or the header the Node backend writes to a new file
+            continue
+        if len(row) != len(ENTRY_FIELDS):
+            malformed += 1
+            continue
+        rows.append(row)
+    return pd.DataFrame(rows, columns=list(ENTRY_FIELDS), dtype=object), malformed
+
+
+def format_entry_lines(entries):
+    """
+    Formats entries (dicts of entry fields) as lines of the entries file.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for entry in entries:
+        writer.writerow(["" if entry.get(field) is None else entry[field] for field in ENTRY_FIELDS])
+    return buffer.getvalue()
+
+
+def coerce_entries(entries, schema):
+    """
+    Converts parsed entries to rows of the in-memory dataset.
+
+    Entry fields are renamed to their dataset columns, numbers and dates are parsed, and
+    month and year are derived from the offence date. Columns the entries do not have are
+    left empty. Rows without a valid, non-zero latitude and longitude are dropped, as when
+    the dataset is loaded.
+
+    Args:
+        entries: A DataFrame of entry fields, e.g. from parse_entry_lines.
+        schema: The loaded dataset, whose columns and dtypes the rows get.
+
+    Returns:
+        The rows, with a fresh RangeIndex, and the number of entries dropped.
+    """
+    entries = entries.rename(columns=ENTRY_COLUMNS)
+    # Blank form fields mean the value is unknown
+    entries = entries.apply(lambda column: column.astype(str).str.strip().replace({"": None, "nan": None, "None": None}))
+
+    latitude = pd.to_numeric(entries.get("latitude"), errors='coerce')
+    longitude = pd.to_numeric(entries.get("longitude"), errors='coerce')
+    valid = (latitude.abs() <= 90) & (longitude.abs() <= 180) & (latitude != 0) & (longitude != 0)
+    entries = entries[valid.to_numpy(dtype=bool)].reset_index(drop=True)
+    dropped = len(valid) - len(entries)
+
+    if DATE_COLUMN in entries.columns:
+        dates = pd.to_datetime(entries[DATE_COLUMN], errors='coerce', format='mixed')
+        entries[DATE_COLUMN] = dates.dt.strftime('%Y-%m-%d')
+        entries["month"] = dates.dt.month
+        entries["year"] = dates.dt.year
+    if TIME_COLUMN in entries.columns:
+        times = pd.to_datetime(entries[TIME_COLUMN], errors='coerce', format='mixed')
+        entries[TIME_COLUMN] = times.dt.strftime('%H:%M:%S')
+
+    rows = {}
+    for column in schema.columns:
+        values = entries[column] if column in entries.columns else pd.Series([None] * len(entries), dtype=object)
+        dtype = schema[column].dtype
+        if pd.api.types.is_numeric_dtype(dtype):
+            values = pd.to_numeric(values, errors='coerce')
+            # Integer columns become floats when values are missing, as read_csv would make them
+            if pd.api.types.is_integer_dtype(dtype) and not values.isna().any():
+                values = values.astype(dtype)
+        elif isinstance(dtype, pd.CategoricalDtype) or dtype == object:
+            # Categories are matched to the dataset's when the rows are appended
+            values = values.astype(object)
+        else:
+            values = values.astype(dtype)
+        rows[column] = values.reset_index(drop=True)
+    return pd.DataFrame(rows, columns=schema.columns), dropped
+
+
+def append_rows(frame, rows):
+    """
+    Appends coerced rows to the dataset, numbering them after its last row.
+
+    Categorical columns keep their dtype: new values are added to the categories of the
+    whole column, which leaves the codes of the existing rows untouched.
+
+    Returns:
+        The combined DataFrame and the appended rows as they are stored in it.
+    """
+    start = int(frame.index.max()) + 1 if len(frame) else 0
+    rows = rows.set_axis(pd.RangeIndex(start, start + len(rows)))
+    widened = {}
+    for column in frame.columns:
+        series = frame[column]
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            continue
+        added = pd.Index(rows[column].dropna().unique()).difference(series.cat.categories)
+        if len(added):
+            series = widened[column] = series.cat.add_categories(added)
+        rows[column] = pd.Categorical(rows[column], categories=series.cat.categories)
+    if widened:
+        frame = frame.assign(**widened)
+    return pd.concat([frame, rows]), rows
+
+
+class EntryTail:
+    """
+    Reads the lines appended to the entries file since the last read.
+
+    Only complete lines are returned, so a line the Node backend is still writing is
+    read once it is finished. If the file shrinks it was replaced, and is read again
+    from the start.
+
+    Args:
+        path: The entries file.
+        offset: Bytes of the file already ingested.
+    """
+
+    def __init__(self, path=INGEST_ENTRIES_PATH, offset=0):
+        self.path = path
+        self.offset = offset
+
+    def read(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return []
+        if size < self.offset:
+            logger.warning("%s shrank from %d to %d bytes, reading it again", self.path, self.offset, size)
+            self.offset = 0
+        if size == self.offset:
+            return []
+        with open(self.path, 'rb') as entries_file:
+            entries_file.seek(self.offset)
+            data = entries_file.read(size - self.offset)
+        end = data.rfind(b'\n') + 1
+        self.offset += end
+        return data[:end].decode('utf-8', errors='replace').splitlines()
+
+    def append(self, entries):
+        """
+        Appends entries to the file in the Node backend's format.
+        """
+        lines = format_entry_lines(entries)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a', newline='') as entries_file:
+            # Finish a last line written without a newline so the new entries start on their own line
+            if entries_file.tell() and not _ends_with_newline(self.path):
+                entries_file.write('\n')
+            entries_file.write(lines)
+
+
+def _ends_with_newline(path):
+    with open(path, 'rb') as entries_file:
+        entries_file.seek(-1, os.SEEK_END)
+        return entries_file.read(1) == b'\n'
+
+
+def snapshot_path(csv_path):
+    """
+    Returns the path of the ingested-rows snapshot of a dataset.
+    """
+    artifact_path, _ = artifact_paths(csv_path)
+    return artifact_path[:-len('.feather')] + '.ingested.feather'
+
+
+def save_snapshot(frame, csv_path, entries_path, entries_offset):
+    """
+    Writes the dataset including the ingested rows, and how much of the entries file they cover.
+
+    The offset is kept in the schema metadata of the Feather file, so the rows and the
+    offset they cover are replaced in one step and never paired with another writer's.
+    Without pyarrow no snapshot is written, and the whole entries file is ingested again
+    after a restart.
+
+    Args:
+        frame: The dataset with its ingested rows.
+        csv_path: The source CSV file.
+        entries_path: The entries file the rows were ingested from.
+        entries_offset: Bytes of the entries file the rows were ingested from.
+    """
+    if feather is None:
+        return
+    _, base_meta_path = artifact_paths(csv_path)
+    base_meta = _read_meta(base_meta_path)
+    if base_meta is None:
+        return
+    path = snapshot_path(csv_path)
+    os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
+
+    meta = {
+        'version': SNAPSHOT_VERSION,
+        'base_digest': base_meta.get('source_digest'),
+        'columns': list(frame.columns),
+        'entries': os.path.abspath(entries_path),
+        'entries_offset': entries_offset,
+        'rows': len(frame),
+        'built_at': time.time(),
+    }
+    table = pa.Table.from_pandas(frame, preserve_index=True)
+    table = table.replace_schema_metadata({**table.schema.metadata, SNAPSHOT_META_KEY: json.dumps(meta).encode('utf-8')})
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    feather.write_feather(table, temporary_path, compression='uncompressed')
+    os.replace(temporary_path, path)
+
+
+def load_snapshot(frame, csv_path, tail):
+    """
+    Returns the last snapshot of the dataset with its ingested rows, if it still applies.
+
+    A snapshot applies when it was taken from the same source CSV, with the same columns,
+    and the entries file is at least as long as when it was taken. The tail is then moved
+    past the entries the snapshot already holds.
+
+    Args:
+        frame: The dataset as loaded from the source CSV.
+        csv_path: The source CSV file.
+        tail: The EntryTail of the entries file.
+
+    Returns:
+        The snapshot, or frame when there is none that applies.
+    """
+    if feather is None:
+        return frame
+    _, base_meta_path = artifact_paths(csv_path)
+    base_meta = _read_meta(base_meta_path)
+    if base_meta is None:
+        return frame
+    try:
+        table = feather.read_table(snapshot_path(csv_path), memory_map=True)
+        meta = json.loads((table.schema.metadata or {})[SNAPSHOT_META_KEY])
+    except (OSError, KeyError, ValueError, pa.ArrowException):
+        return frame
+    try:
+        entries_size = os.path.getsize(tail.path)
+    except OSError:
+        entries_size = 0
+    if (
+        meta.get('version') != SNAPSHOT_VERSION
+        or meta.get('base_digest') != base_meta.get('source_digest')
+        or meta.get('columns') != list(frame.columns)
+        or meta.get('entries') != os.path.abspath(tail.path)
+        or meta.get('entries_offset', 0) > entries_size
+    ):
+        return frame
+    tail.offset = meta['entries_offset']
+    return table.to_pandas(split_blocks=True)
+
+
+class EntryIngestor:
+    """
+    Folds new incidents into the loaded dataset while the API is running.
+
+    New lines of the entries file are parsed and handed to apply, which appends them to
+    the dataset and updates the aggregates and indexes in place. Every compact_rows rows
+    or compact_interval seconds, compact folds what was applied incrementally into fresh
+    structures and saves a snapshot, so a restart does not ingest the same entries again.
+    Entries keep being ingested while a compaction runs.
+
+    Args:
+        tail: The EntryTail of the entries file.
+        apply: A function taking a DataFrame of entry fields and the offset of the entries
+            file they end at, and returning the numbers of rows ingested and dropped.
+        compact: A function called once the ingested rows should be compacted.
+    """
+
+    def __init__(self, tail, apply, compact):
+        self.tail = tail
+        self.apply = apply
+        self.compact = compact
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self.stats = {
+            "ingested": 0,
+            "rejected": 0,
+            "pending": 0,
+            "compactions": 0,
+            "last_ingest": None,
+            "last_compaction": None,
+            "entries_offset": tail.offset,
+        }
+
+    def poll(self):
+        """
+        Ingests the lines appended to the entries file since the last poll.
+
+        Returns:
+            The numbers of rows ingested and of lines rejected.
+        """
+        with self._lock:
+            lines = self.tail.read()
+            if not lines:
+                return 0, 0
+            entries, malformed = parse_entry_lines(lines)
+            ingested, dropped = self.apply(entries, self.tail.offset) if len(entries) else (0, 0)
+            self.stats["ingested"] += ingested
+            self.stats["rejected"] += malformed + dropped
+            self.stats["pending"] += ingested
+            self.stats["last_ingest"] = time.time()
+            self.stats["entries_offset"] = self.tail.offset
+            if ingested or malformed or dropped:
+                logger.info("Ingested %d entries (%d rejected) from %s", ingested, malformed + dropped, self.tail.path)
+            return ingested, malformed + dropped
+
+    def submit(self, entries):
+        """
+        Appends entries to the entries file and ingests them at once.
+        """
+        with self._lock:
+            self.poll()
+            self.tail.append(entries)
+            return self.poll()
+
+    def compact_now(self):
+        with self._compact_lock:
+            with self._lock:
+                pending = self.stats["pending"]
+            start = time.perf_counter()
+            self.compact()
+            with self._lock:
+                # Rows ingested while compacting are still pending
+                self.stats["pending"] -= pending
+                self.stats["compactions"] += 1
+                self.stats["last_compaction"] = time.time()
+            logger.info("Compacted ingested entries in %.2fs", time.perf_counter() - start)
+
+    async def run(self, poll_interval=INGEST_POLL_INTERVAL, compact_interval=INGEST_COMPACT_INTERVAL,
+                  compact_rows=INGEST_COMPACT_ROWS):
+        """
+        Polls the entries file and compacts the ingested rows, until the task is cancelled.
+        """
+        compacted = time.monotonic()
+        while True:
+            try:
+                if poll_interval > 0:
+                    await asyncio.to_thread(self.poll)
+                due = time.monotonic() - compacted >= compact_interval
+                if self.stats["pending"] and (self.stats["pending"] >= compact_rows or due):
+                    await asyncio.to_thread(self.compact_now)
+                if due or not self.stats["pending"]:
+                    compacted = time.monotonic()
+            except Exception:
+                logger.exception("Ingesting %s failed", self.tail.path)
+            await asyncio.sleep(poll_interval if poll_interval > 0 else min(compact_interval, 60))
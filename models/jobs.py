@@ -0,0 +1,367 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from dotenv import load_dotenv  # type: ignore
+
+from llm_gateway import BackendBusyError, open_stream
+
+load_dotenv()
+
+# SQLite file the jobs are recorded in, shared by every worker process on the machine
+JOBS_PATH = os.getenv(
+    'JOBS_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'jobs.sqlite3'),
+)
+# Jobs each worker process generates at once; the rest wait their turn
+JOBS_CONCURRENCY = int(os.getenv('JOBS_CONCURRENCY', '4'))
+# Jobs each worker process accepts before submissions are rejected with 503
+JOBS_MAX_PENDING = int(os.getenv('JOBS_MAX_PENDING', '256'))
+# Seconds finished jobs are kept
+JOBS_RETENTION = float(os.getenv('JOBS_RETENTION', str(24 * 3600)))
+# Seconds between writes of a running job's partial output, and between polls of another
+# worker's job by subscribers
+JOBS_FLUSH_INTERVAL = float(os.getenv('JOBS_FLUSH_INTERVAL', '0.25'))
+# Seconds a job waits for a backend slot while the backend queue is full before it fails
+JOBS_QUEUE_TIMEOUT = float(os.getenv('JOBS_QUEUE_TIMEOUT', '600'))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class JobCancelledError(Exception):
+    """Raised to subscribers of a job that was cancelled."""
+
+
+class JobFailedError(Exception):
+    """Raised to subscribers of a job whose generation failed."""
+
+
+def job_key(analysis, args):
+    """
+    Builds the deduplication key of a job from its analysis type and arguments.
+    """
+    payload = json.dumps([analysis, args], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    """
+    SQLite table of submitted jobs with their status and (partial) output.
+
+    Every worker process reads and writes the same file, so a job can be polled, streamed
+    or cancelled through any worker; it is generated by the worker it was submitted to.
+
+    Args:
+        path: The SQLite file.
+    """
+
+    def __init__(self, path=JOBS_PATH):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, analysis TEXT NOT NULL, key TEXT NOT NULL, status TEXT NOT NULL, "
+                "output TEXT NOT NULL DEFAULT '', error TEXT, owner INTEGER NOT NULL, "
+                "cancel_requested INTEGER NOT NULL DEFAULT 0, "
+                "created REAL NOT NULL, started REAL, finished REAL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status)")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished)")
+        # The store is created at import, which under gunicorn's preload_app is the master;
+        # close the connection so no worker inherits it through fork
+        self.close()
+
+    def _connection(self):
+        # sqlite3 connections may not be shared between threads or across fork, so keep
+        # one per thread of each process
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def close(self):
+        """
+        Closes the calling thread's connection; the next call opens a new one.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            connection.close()
+        self._local.connection = None
+
+    def create(self, analysis, key):
+        """
+        Records a new queued job, unless an identical one is queued or running.
+
+        Returns:
+            The job id and whether it is an existing identical job.
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for job_id, owner in connection.execute(
+                "SELECT id, owner FROM jobs WHERE key = ? AND status IN ('queued', 'running')", (key,),
+            ).fetchall():
+                if _process_alive(owner):
+                    connection.execute("COMMIT")
+                    return job_id, True
+            job_id = uuid.uuid4().hex
+            connection.execute(
+                "INSERT INTO jobs (id, analysis, key, status, owner, created) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, analysis, key, os.getpid(), time.time()),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return job_id, False
+
+    def get(self, job_id):
+        """
+        Returns a job as a dict, or None. Jobs left active by a worker that exited are failed.
+        """
+        cursor = self._connection().execute(
+            "SELECT id, analysis, status, output, error, owner, cancel_requested, created, started, finished "
+            "FROM jobs WHERE id = ?",
+            (job_id,),
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        job = dict(zip([column[0] for column in cursor.description], row))
+        if job["status"] in ACTIVE_STATUSES and not _process_alive(job["owner"]):
+            self.finish(job_id, "failed", job["output"], "The worker running the job exited")
+            return self.get(job_id)
+        return job
+
+    def start(self, job_id):
+        """
+        Marks a queued job as running, returning False if it was cancelled meanwhile.
+        """
+        cursor = self._connection().execute(
+            "UPDATE jobs SET status = 'running', started = ? "
+            "WHERE id = ? AND status = 'queued' AND cancel_requested = 0",
+            (time.time(), job_id),
+        )
+        return cursor.rowcount == 1
+
+    def update(self, job_id, output):
+        """
+        Saves the partial output of a running job, returning whether its cancellation was requested.
+        """
+        connection = self._connection()
+        connection.execute("UPDATE jobs SET output = ? WHERE id = ?", (output, job_id))
+        row = connection.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def cancel_requested(self, job_id):
+        """
+        Returns whether the job's cancellation was requested.
+        """
+        row = self._connection().execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row is None or bool(row[0])
+
+    def finish(self, job_id, status, output, error=None):
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, output = ?, error = ?, finished = ? "
+            "WHERE id = ? AND status IN ('queued', 'running')",
+            (status, output, error, time.time(), job_id),
+        )
+
+    def request_cancel(self, job_id):
+        """
+        Flags a job for cancellation; queued jobs are cancelled at once.
+        """
+        connection = self._connection()
+        connection.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+        connection.execute(
+            "UPDATE jobs SET status = 'cancelled', finished = ? WHERE id = ? AND status = 'queued'",
+            (time.time(), job_id),
+        )
+
+    def prune(self, retention=JOBS_RETENTION):
+        self._connection().execute("DELETE FROM jobs WHERE finished < ?", (time.time() - retention,))
+
+
+class JobManager:
+    """
+    Runs analysis generations as background jobs on the event loop.
+
+    A submitted job is recorded in the JobStore and returned at once. At most concurrency
+    jobs of this process generate at the same time, through the same backend slots and
+    streaming path as the synchronous endpoints. Submitting a job identical to a queued or
+    running one returns the existing job instead of starting another generation.
+
+    Args:
+        store: The JobStore.
+        concurrency: Jobs generated at once by this process.
+        max_pending: Unfinished jobs this process accepts.
+    """
+
+    def __init__(self, store, concurrency=JOBS_CONCURRENCY, max_pending=JOBS_MAX_PENDING):
+        self.store = store
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self._semaphore = None
+        # job id -> task, output so far and an event set on every new chunk, for this process's jobs
+        self._tasks = {}
+        self._outputs = {}
+        self._updated = {}
+
+    async def submit(self, analysis, func, *args):
+        """
+        Submits a generation of func(*args) as a job.
+
+        Returns:
+            A dict with the job id, its status and whether it is an existing identical job.
+
+        Raises:
+            BackendBusyError: If this process already has max_pending unfinished jobs.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        if len(self._tasks) >= self.max_pending:
+            raise BackendBusyError(f"{analysis} job")
+
+        job_id, deduplicated = await asyncio.to_thread(self.store.create, analysis, job_key(analysis, [func.__name__, args]))
+        if not deduplicated:
+            self._outputs[job_id] = ""
+            self._updated[job_id] = asyncio.Event()
+            self._tasks[job_id] = asyncio.create_task(self._run(job_id, analysis, func, args))
+            await asyncio.to_thread(self.store.prune)
+        job = await self.status(job_id)
+        return {"job_id": job_id, "status": job["status"], "deduplicated": deduplicated}
+
+    async def _run(self, job_id, analysis, func, args):
+        status, error = "failed", None
+        try:
+            async with self._semaphore:
+                if not await asyncio.to_thread(self.store.start, job_id):
+                    return
+                status, error = await self._generate(job_id, analysis, func, args)
+        except asyncio.CancelledError:
+            status = "cancelled"
+        except Exception as e:
+            error = str(e)
+        finally:
+            await asyncio.to_thread(self.store.finish, job_id, status, self._outputs.get(job_id, ""), error)
+            self._updated[job_id].set()
+            self._tasks.pop(job_id, None)
+            self._outputs.pop(job_id, None)
+            self._updated.pop(job_id, None)
+
+    async def _generate(self, job_id, analysis, func, args):
+        # Wait for a backend slot instead of failing the job when the backend queue is full,
+        # until the job is cancelled or has waited JOBS_QUEUE_TIMEOUT
+        deadline = time.monotonic() + JOBS_QUEUE_TIMEOUT
+        while True:
+            try:
+                chunks = await open_stream(analysis, func, *args)
+                break
+            except BackendBusyError as e:
+                if time.monotonic() + e.retry_after > deadline:
+                    return "failed", f"The backend stayed busy for {JOBS_QUEUE_TIMEOUT:g} seconds"
+                await asyncio.sleep(e.retry_after)
+                # Cancellation requested through another worker is seen here
+                if await asyncio.to_thread(self.store.cancel_requested, job_id):
+                    return "cancelled", None
+
+        flushed = time.monotonic()
+        try:
+            async for chunk in chunks:
+                self._outputs[job_id] += chunk
+                self._updated[job_id].set()
+                if time.monotonic() - flushed >= JOBS_FLUSH_INTERVAL:
+                    flushed = time.monotonic()
+                    # Cancellation requested through another worker is seen here
+                    if await asyncio.to_thread(self.store.update, job_id, self._outputs[job_id]):
+                        return "cancelled", None
+        finally:
+            await chunks.aclose()
+        return "done", None
+
+    def active_count(self):
+        """
+        Returns the number of jobs this process is generating or has queued.
+        """
+        return len(self._tasks)
+
+    async def status(self, job_id):
+        """
+        Returns a job with its output so far, or None if there is no such job.
+        """
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is None:
+            return None
+        if job_id in self._outputs:
+            # Running here: the in-memory output is newer than the last flush
+            job["output"] = self._outputs[job_id]
+        job.pop("owner")
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    async def cancel(self, job_id):
+        """
+        Cancels a queued or running job, returning its status afterwards or None if there is no such job.
+        """
+        job = await self.status(job_id)
+        if job is None:
+            return None
+        if job["status"] in ACTIVE_STATUSES:
+            await asyncio.to_thread(self.store.request_cancel, job_id)
+            task = self._tasks.get(job_id)
+            if task is not None:
+                task.cancel()
+                await asyncio.wait([task])
+        return await self.status(job_id)
+
+    async def follow(self, job_id):
+        """
+        Yields a job's output as it is produced, starting with what it has produced so far.
+
+        Raises:
+            JobCancelledError: If the job is cancelled.
+            JobFailedError: If the generation fails.
+        """
+        sent = 0
+        while True:
+            updated = self._updated.get(job_id)
+            if updated is not None:
+                updated.clear()
+            job = await self.status(job_id)
+            output = job["output"]
+            if len(output) > sent:
+                yield output[sent:]
+                sent = len(output)
+            if job["status"] == "cancelled":
+                raise JobCancelledError("The job was cancelled")
+            if job["status"] == "failed":
+                raise JobFailedError(job["error"] or "The job failed")
+            if job["status"] == "done":
+                return
+            if updated is not None:
+                try:
+                    await asyncio.wait_for(updated.wait(), JOBS_FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await asyncio.sleep(JOBS_FLUSH_INTERVAL)
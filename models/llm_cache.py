@@ -0,0 +1,349 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv  # type: ignore
+
+from llm_gateway import LLM_DEADLINE, model_name, stream_text
+from metrics import Counter, Gauge
+
+load_dotenv()
+
+# Set LLM_CACHE=0 to always call the inference backend
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE', '1') != '0'
+# SQLite file shared by every worker process on the machine
+LLM_CACHE_PATH = os.getenv(
+    'LLM_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'llm_cache.sqlite3'),
+)
+# Seconds a cached generation stays valid
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', str(7 * 24 * 3600)))
+# Maximum number of generations kept in the in-process tier
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv('LLM_CACHE_MEMORY_ENTRIES', '256'))
+# Maximum number of generations kept in the on-disk tier
+LLM_CACHE_MAX_ENTRIES = int(os.getenv('LLM_CACHE_MAX_ENTRIES', '10000'))
+
+
+class _InFlight:
+    """
+    A generation currently running for one cache key.
+
+    Requests for the same key made while it runs read the chunks produced so far and
+    then follow along, instead of starting a second upstream generation. The upstream
+    iterator is not tied to the request that started it: whichever request wants the next
+    chunk first pulls it, so the generation goes on for the others when one goes away,
+    and is only closed once none is left.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.iterator = None
+        # Whether a request is pulling the next chunk from the iterator
+        self.pulling = False
+        # Requests reading the generation; guarded by the cache's lock
+        self.consumers = 0
+        self.condition = threading.Condition()
+
+
+class GenerationCache:
+    """
+    Two-tier cache of completed generations keyed on the prompt and generation parameters.
+
+    Args:
+        path: SQLite file for the on-disk tier, or None for memory only.
+        ttl: Seconds an entry stays valid.
+        memory_entries: Size of the in-process LRU tier.
+        max_entries: Size of the on-disk tier; least recently used rows are evicted first.
+    """
+
+    def __init__(self, path, ttl, memory_entries, max_entries):
+        self.path = path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.stats = dict(memory_hits=0, disk_hits=0, misses=0, coalesced=0, stores=0, evictions=0)
+
+        self._memory = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self._connection() as connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS generations ("
+                    "key TEXT PRIMARY KEY, text TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+                )
+                connection.execute("CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used)")
+
+    def _connection(self):
+        # sqlite3 connections may not be shared between threads, so keep one per thread
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        """
+        Returns the cached text for key, or None when it is missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                text, created = entry
+                if now - created < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats['memory_hits'] += 1
+                    return text
+                del self._memory[key]
+
+        if self.path:
+            with self._connection() as connection:
+                row = connection.execute(
+                    "SELECT text, created FROM generations WHERE key = ? AND created > ?",
+                    (key, now - self.ttl),
+                ).fetchone()
+                if row is not None:
+                    connection.execute("UPDATE generations SET last_used = ? WHERE key = ?", (now, key))
+            if row is not None:
+                text, created = row
+                with self._lock:
+                    self._remember(key, text, created)
+                    self.stats['disk_hits'] += 1
+                return text
+
+        with self._lock:
+            self.stats['misses'] += 1
+        return None
+
+    def put(self, key, text):
+        """
+        Stores a completed generation in both tiers.
+        """
+        now = time.time()
+        with self._lock:
+            self._remember(key, text, now)
+            self.stats['stores'] += 1
+
+        if self.path:
+            with self._connection() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO generations (key, text, created, last_used) VALUES (?, ?, ?, ?)",
+                    (key, text, now, now),
+                )
+                connection.execute("DELETE FROM generations WHERE created <= ?", (now - self.ttl,))
+                evicted = connection.execute(
+                    "DELETE FROM generations WHERE key IN ("
+                    "SELECT key FROM generations ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                ).rowcount
+            with self._lock:
+                self.stats['evictions'] += max(evicted, 0)
+
+    def _remember(self, key, text, created):
+        # Caller holds self._lock
+        self._memory[key] = (text, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def stream(self, key, produce):
+        """
+        Yields the text for key, generating it with produce() only if nobody else is.
+
+        Args:
+            key: The cache key of the generation.
+            produce: A function returning an iterator of text chunks from the backend.
+
+        Returns:
+            A generator of text chunks. A cache hit yields the whole text at once.
+        """
+        text = self.get(key)
+        if text is not None:
+            yield text
+            return
+
+        with self._lock:
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                in_flight = self._in_flight[key] = _InFlight()
+            else:
+                self.stats['coalesced'] += 1
+            in_flight.consumers += 1
+
+        yield from self._consume(key, in_flight, produce)
+
+    def _consume(self, key, in_flight, produce, timeout=LLM_DEADLINE):
+        position = 0
+        try:
+            while True:
+                with in_flight.condition:
+                    ready = in_flight.condition.wait_for(
+                        lambda: len(in_flight.chunks) > position or in_flight.done or not in_flight.pulling, timeout,
+                    )
+                    if not ready:
+                        raise TimeoutError(f"No generated text for {timeout:g} seconds")
+                    chunks = in_flight.chunks[position:]
+                    done = in_flight.done
+                    pull = not chunks and not done
+                    if pull:
+                        in_flight.pulling = True
+                position += len(chunks)
+                if chunks:
+                    yield "".join(chunks)
+                elif done:
+                    if in_flight.error is not None:
+                        raise in_flight.error
+                    return
+                else:
+                    self._pull(key, in_flight, produce)
+        finally:
+            with self._lock:
+                in_flight.consumers -= 1
+                abandoned = not in_flight.consumers and not in_flight.done
+                if abandoned:
+                    self._in_flight.pop(key, None)
+            if abandoned:
+                # Nobody reads the generation any more, so stop the upstream one
+                if in_flight.iterator is not None:
+                    in_flight.iterator.close()
+                with in_flight.condition:
+                    in_flight.error = RuntimeError("Generation was cancelled")
+                    in_flight.done = True
+
+    def _pull(self, key, in_flight, produce):
+        # Reads the next chunk of the generation for every request reading it; the caller set pulling
+        chunk, done, error = None, False, None
+        try:
+            if in_flight.iterator is None:
+                in_flight.iterator = iter(produce())
+            chunk = next(in_flight.iterator, None)
+            if chunk is None:
+                done = True
+                self.put(key, "".join(in_flight.chunks))
+        except Exception as e:
+            done, error = True, e
+        finally:
+            if done:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+            with in_flight.condition:
+                if done:
+                    in_flight.done, in_flight.error = True, error
+                elif chunk:
+                    in_flight.chunks.append(chunk)
+                in_flight.pulling = False
+                in_flight.condition.notify_all()
+
+
+def cache_key(model, prompt, parameters):
+    """
+    Builds the cache key for a generation.
+
+    Whitespace in the prompt is normalised so that cosmetic differences in the posted
+    data do not cause misses.
+    """
+    normalized_prompt = " ".join(prompt.split())
+    payload = json.dumps(
+        {"model": model, "prompt": normalized_prompt, "parameters": parameters},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Returns the process-wide generation cache, creating it on first use.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = GenerationCache(
+                LLM_CACHE_PATH,
+                LLM_CACHE_TTL,
+                LLM_CACHE_MEMORY_ENTRIES,
+                LLM_CACHE_MAX_ENTRIES,
+            )
+    return _cache
+
+
+def cached_generation(backend, prompt, generation_parameters):
+    """
+    Streams a text generation, serving it from the cache when it has been produced before.
+
+    Args:
+        backend: The analysis type making the request.
+        prompt: The formatted prompt.
+        generation_parameters: The sampling parameters passed to text_generation.
+
+    Returns:
+        A generator of text chunks.
+    """
+    def produce():
+        return stream_text(backend, prompt, generation_parameters)
+
+    if not LLM_CACHE_ENABLED:
+        return produce()
+
+    key = cache_key(model_name(), prompt, generation_parameters)
+    return get_cache().stream(key, produce)
+
+
+def cache_stats():
+    """
+    Returns the hit/miss counters of the generation cache.
+    """
+    if not LLM_CACHE_ENABLED:
+        return {"enabled": False}
+    cache = get_cache()
+    with cache._lock:
+        stats = dict(cache.stats)
+        stats['memory_entries'] = len(cache._memory)
+        stats['in_flight'] = len(cache._in_flight)
+    lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+    stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+    stats['enabled'] = True
+    return stats
+
+
+def _scraped_stats():
+    # Metrics read the counters without creating the cache before its first use
+    if not LLM_CACHE_ENABLED or _cache is None:
+        return {}
+    return cache_stats()
+
+
+LLM_CACHE_EVENTS = Counter(
+    "shadow_llm_cache_events_total", "Generation cache lookups by outcome, stores and evictions", ("event",),
+    collect=lambda: {
+        (event,): value for event, value in _scraped_stats().items()
+        if event in ('memory_hits', 'disk_hits', 'misses', 'coalesced', 'stores', 'evictions')
+    },
+)
+LLM_CACHE_HIT_RATIO = Gauge(
+    "shadow_llm_cache_hit_ratio", "Share of generation cache lookups served from memory or disk",
+    collect=lambda: {(): stats['hit_rate'] for stats in [_scraped_stats()] if stats},
+    # A ratio cannot be added up across workers
+    multiprocess_mode="all",
+)
+LLM_CACHE_ENTRIES = Gauge(
+    "shadow_llm_cache_memory_entries", "Generations held in the in-process cache tier",
+    collect=lambda: {(): stats['memory_entries'] for stats in [_scraped_stats()] if stats},
+)
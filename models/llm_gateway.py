@@ -0,0 +1,601 @@
+import asyncio
+import functools
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from dotenv import load_dotenv  # type: ignore
+from huggingface_hub import InferenceClient, InferenceTimeoutError  # type: ignore
+from huggingface_hub.utils import HfHubHTTPError  # type: ignore
+
+try:
+    from huggingface_hub.errors import OverloadedError  # type: ignore
+except ImportError:
+    from huggingface_hub.inference._text_generation import OverloadedError  # type: ignore
+
+try:
+    import httpx  # type: ignore
+    _TRANSPORT_ERRORS = (httpx.TransportError,)
+except ImportError:
+    _TRANSPORT_ERRORS = ()
+
+from metrics import RATE_BUCKETS, Counter, Gauge, Histogram
+
+load_dotenv()
+
+# Analysis types that talk to the inference backend
+BACKENDS = ("spatial", "beatwise", "prediction", "deployment")
+
+# Environment variables holding the API key of each analysis type, in order of preference
+API_KEY_ENV = {
+    "spatial": ("HUGGINGFACE_API_SPATIAL",),
+    "beatwise": ("HUGGINGFACE_API_BEATWISE",),
+    "prediction": ("HUGGINGFACE_API_PREDICTION",),
+    "deployment": ("HUGGINGFACE_API_DEPLOYMENT", "HUGGINGFACE_API_PREDICTION"),
+}
+
+# Model served by the inference backend
+LLM_MODEL = os.getenv('LLM_MODEL', 'mistralai/Mixtral-8x7B-Instruct-v0.1')
+# URL of a self-hosted text-generation server to use instead of the hosted model
+LLM_ENDPOINT_URL = os.getenv('LLM_ENDPOINT_URL')
+# Seconds to wait on a single upstream HTTP read
+LLM_REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', '60'))
+# Seconds a whole generation, including retries, may take
+LLM_DEADLINE = float(os.getenv('LLM_DEADLINE', '180'))
+# Retries after the first attempt on 429/5xx, timeouts and connection errors
+LLM_MAX_RETRIES = int(os.getenv('LLM_MAX_RETRIES', '3'))
+# Base and cap, in seconds, of the jittered exponential backoff between retries
+LLM_BACKOFF_BASE = float(os.getenv('LLM_BACKOFF_BASE', '0.5'))
+LLM_BACKOFF_MAX = float(os.getenv('LLM_BACKOFF_MAX', '8'))
+# Consecutive failures that open the circuit of an analysis type, and how long it stays open
+LLM_BREAKER_THRESHOLD = int(os.getenv('LLM_BREAKER_THRESHOLD', '5'))
+LLM_BREAKER_COOLDOWN = float(os.getenv('LLM_BREAKER_COOLDOWN', '30'))
+# Default upstream requests per minute per analysis type (0 means unlimited)
+LLM_RATE_LIMIT = float(os.getenv('LLM_RATE_LIMIT', '0'))
+
+# Default number of generations allowed in flight per analysis type
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '16'))
+# Default number of requests allowed to wait for a free slot per analysis type
+LLM_MAX_QUEUE = int(os.getenv('LLM_MAX_QUEUE', '64'))
+# Seconds a request may wait for a free slot before it is rejected
+LLM_QUEUE_TIMEOUT = float(os.getenv('LLM_QUEUE_TIMEOUT', '30'))
+
+
+class BackendBusyError(Exception):
+    """Raised when an analysis backend has no free slot and its wait queue is full."""
+
+    def __init__(self, backend, retry_after=5):
+        super().__init__(f"Too many pending {backend} requests, please retry later")
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+class BackendUnavailableError(BackendBusyError):
+    """Raised when the circuit of an analysis backend is open after repeated upstream failures."""
+
+    def __init__(self, backend, retry_after):
+        Exception.__init__(self, f"The {backend} inference backend is unavailable, please retry later")
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a generation does not finish within its deadline."""
+
+
+class BackendLimiter:
+    """
+    Concurrency limit and bounded wait queue for one analysis backend.
+
+    Args:
+        limit: Maximum number of generations running at once.
+        max_queue: Maximum number of requests allowed to wait for a slot.
+    """
+
+    def __init__(self, limit, max_queue):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.semaphore = asyncio.Semaphore(limit)
+        self.waiting = 0
+        self.in_flight = 0
+
+
+_limiters = {}
+_END_OF_STREAM = object()
+_executor = None
+
+LLM_IN_FLIGHT = Gauge(
+    "shadow_llm_in_flight", "Generations holding a backend slot", ("backend",),
+    collect=lambda: {(backend,): limiter.in_flight for backend, limiter in list(_limiters.items())},
+)
+LLM_WAITING = Gauge(
+    "shadow_llm_waiting", "Requests waiting for a backend slot", ("backend",),
+    collect=lambda: {(backend,): limiter.waiting for backend, limiter in list(_limiters.items())},
+)
+LLM_QUEUE_WAIT_SECONDS = Histogram("shadow_llm_queue_wait_seconds", "Time waited for a backend slot", ("backend",))
+GENERATION_SECONDS = Histogram(
+    "shadow_generation_seconds", "Time from taking a backend slot to the end of a generation, cached or not",
+    ("backend", "mode"),
+)
+LLM_TTFT_SECONDS = Histogram(
+    "shadow_llm_ttft_seconds", "Time from calling the upstream to its first token, retries included", ("backend",),
+)
+LLM_UPSTREAM_SECONDS = Histogram("shadow_llm_upstream_seconds", "Time an upstream generation took", ("backend",))
+LLM_TOKENS_PER_SECOND = Histogram(
+    "shadow_llm_tokens_per_second", "Upstream decoding speed after the first token", ("backend",), RATE_BUCKETS,
+)
+LLM_TOKENS = Counter("shadow_llm_tokens_total", "Tokens received from the upstream", ("backend",))
+
+
+def backend_setting(name, backend, default, cast=int):
+    """
+    Reads a setting of one analysis type, falling back to default.
+
+    Per-type overrides look like LLM_MAX_CONCURRENCY_SPATIAL=4 for the setting
+    LLM_MAX_CONCURRENCY and the analysis type spatial.
+    """
+    return cast(os.getenv(f"{name}_{backend.upper()}", default))
+
+
+def get_limiter(backend):
+    """
+    Returns the limiter for an analysis backend, creating it on first use.
+    """
+    limiter = _limiters.get(backend)
+    if limiter is None:
+        limiter = BackendLimiter(
+            backend_setting('LLM_MAX_CONCURRENCY', backend, LLM_MAX_CONCURRENCY),
+            backend_setting('LLM_MAX_QUEUE', backend, LLM_MAX_QUEUE),
+        )
+        _limiters[backend] = limiter
+    return limiter
+
+
+def get_executor():
+    """
+    Returns the thread pool the blocking inference client runs on.
+
+    The pool is sized so that every backend can use its full concurrency limit at once.
+    """
+    global _executor
+    if _executor is None:
+        max_workers = sum(get_limiter(backend).limit for backend in BACKENDS)
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+    return _executor
+
+
+async def acquire_slot(backend):
+    """
+    Takes one concurrency slot of a backend, waiting in its bounded queue if needed.
+
+    Requests beyond the concurrency limit wait in a bounded queue; once the queue is
+    full, or a request waits longer than LLM_QUEUE_TIMEOUT, BackendBusyError is raised
+    so the caller can shed load instead of piling up work.
+    """
+    limiter = get_limiter(backend)
+    if not limiter.semaphore.locked():
+        # A slot is free, so this returns without suspending
+        await limiter.semaphore.acquire()
+        LLM_QUEUE_WAIT_SECONDS.observe(0.0, backend)
+    else:
+        if limiter.waiting >= limiter.max_queue:
+            raise BackendBusyError(backend)
+
+        limiter.waiting += 1
+        start = time.perf_counter()
+        # The acquire runs as a task of its own so that a slot granted just as the wait
+        # times out or is cancelled is seen, rather than lost as with asyncio.wait_for
+        acquire = asyncio.ensure_future(limiter.semaphore.acquire())
+        try:
+            await asyncio.wait({acquire}, timeout=LLM_QUEUE_TIMEOUT)
+        except asyncio.CancelledError:
+            if await _settle(acquire):
+                limiter.semaphore.release()
+            raise
+        finally:
+            limiter.waiting -= 1
+            LLM_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - start, backend)
+        if not await _settle(acquire):
+            raise BackendBusyError(backend)
+
+    limiter.in_flight += 1
+
+
+async def _settle(acquire):
+    # Cancels a semaphore acquire that is still waiting, returning whether it took a slot
+    if not acquire.done():
+        acquire.cancel()
+        await asyncio.wait({acquire})
+    return not acquire.cancelled()
+
+
+def release_slot(backend):
+    """
+    Gives back a slot taken with acquire_slot.
+    """
+    limiter = get_limiter(backend)
+    limiter.in_flight -= 1
+    limiter.semaphore.release()
+
+
+@asynccontextmanager
+async def generation_slot(backend):
+    """
+    Holds one concurrency slot of a backend for the duration of the block.
+    """
+    await acquire_slot(backend)
+    try:
+        yield
+    finally:
+        release_slot(backend)
+
+
+async def run_generation(backend, func, *args, **kwargs):
+    """
+    Runs a blocking generate_* function without holding the event loop.
+
+    Args:
+        backend: The analysis type the call is accounted against.
+        func: The blocking function to call.
+        *args, **kwargs: Arguments forwarded to func.
+
+    Returns:
+        Whatever func returns.
+    """
+    async with generation_slot(backend):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+        finally:
+            GENERATION_SECONDS.observe(time.perf_counter() - start, backend, "complete")
+
+
+async def open_stream(backend, func, *args, **kwargs):
+    """
+    Starts a blocking stream_* generator on the thread pool and exposes it as an async iterator.
+
+    The backend slot is taken before this returns, so BackendBusyError surfaces before
+    a streaming response has been started. The slot is released once the stream is
+    exhausted, fails or is closed by the consumer (e.g. when the client disconnects).
+
+    Args:
+        backend: The analysis type the call is accounted against.
+        func: A function returning an iterator of text chunks.
+        *args, **kwargs: Arguments forwarded to func.
+
+    Returns:
+        An async generator yielding the text chunks as they are produced.
+    """
+    await acquire_slot(backend)
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+
+    def publish(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # The event loop is gone; nobody is listening any more
+            stop.set()
+
+    def produce():
+        chunks = None
+        try:
+            chunks = func(*args, **kwargs)
+            for chunk in chunks:
+                if stop.is_set():
+                    break
+                publish((chunk, None))
+        except Exception as e:
+            publish((None, e))
+            return
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+        publish((_END_OF_STREAM, None))
+
+    try:
+        producer = loop.run_in_executor(get_executor(), produce)
+    except Exception:
+        release_slot(backend)
+        raise
+
+    def finished(_):
+        GENERATION_SECONDS.observe(time.perf_counter() - start, backend, "stream")
+        release_slot(backend)
+
+    producer.add_done_callback(finished)
+
+    async def consume():
+        try:
+            while True:
+                chunk, error = await queue.get()
+                if error is not None:
+                    raise error
+                if chunk is _END_OF_STREAM:
+                    break
+                yield chunk
+        finally:
+            stop.set()
+
+    return consume()
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing, then lets a single trial request through.
+
+    Args:
+        threshold: Consecutive failures after which the circuit opens.
+        cooldown: Seconds the circuit stays open before a trial request is allowed.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self, backend):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.cooldown - time.monotonic()
+            if remaining > 0 or self.trial_running:
+                raise BackendUnavailableError(backend, retry_after=max(int(remaining) + 1, 1))
+            # Half open: this caller is the trial request
+            self.trial_running = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+class RateLimiter:
+    """
+    Token bucket limiting how many upstream requests an analysis type may start per minute.
+
+    Args:
+        per_minute: Allowed requests per minute; 0 disables the limit.
+    """
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = max(per_minute / 60.0, 1.0) if per_minute else 0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self, deadline):
+        """
+        Blocks until a request may start, raising DeadlineExceededError if that is after deadline.
+        """
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            if now + delay > deadline:
+                raise DeadlineExceededError("Rate limit quota would be exceeded before the deadline")
+            time.sleep(delay)
+
+
+_clients = {}
+_breakers = {}
+_rate_limiters = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(backend):
+    """
+    Returns the InferenceClient of an analysis type, creating it on first use.
+
+    One client is kept per analysis type for the life of the process so that its
+    HTTP connections are reused between requests.
+    """
+    with _clients_lock:
+        client = _clients.get(backend)
+        if client is None:
+            hf_api_key = next(filter(None, (os.getenv(name) for name in API_KEY_ENV[backend])), None)
+            if not hf_api_key:
+                raise ValueError(f"Hugging Face API Key not set in environment variable {API_KEY_ENV[backend][0]}")
+            client = InferenceClient(
+                model=LLM_ENDPOINT_URL or LLM_MODEL,
+                token=hf_api_key,
+                timeout=LLM_REQUEST_TIMEOUT,
+            )
+            _clients[backend] = client
+            _breakers[backend] = CircuitBreaker(
+                backend_setting('LLM_BREAKER_THRESHOLD', backend, LLM_BREAKER_THRESHOLD),
+                backend_setting('LLM_BREAKER_COOLDOWN', backend, LLM_BREAKER_COOLDOWN, float),
+            )
+            _rate_limiters[backend] = RateLimiter(
+                backend_setting('LLM_RATE_LIMIT', backend, LLM_RATE_LIMIT, float),
+            )
+        return client
+
+
+def model_name():
+    """
+    Returns the identifier of the model generations are requested from.
+    """
+    return LLM_ENDPOINT_URL or LLM_MODEL
+
+
+def _retry_after(error):
+    # Seconds the upstream asked us to wait, if it said so
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(error):
+    if isinstance(error, HfHubHTTPError):
+        status_code = getattr(getattr(error, 'response', None), 'status_code', None)
+        return status_code == 429 or (status_code is not None and status_code >= 500)
+    return isinstance(error, (OverloadedError, InferenceTimeoutError, OSError) + _TRANSPORT_ERRORS)
+
+
+def stream_text(backend, prompt, generation_parameters):
+    """
+    Streams a text generation from the inference backend of an analysis type.
+
+    Failed attempts are retried and repeated failures open the circuit of the analysis
+    type, see _attempt_stream. The time to first token, the decoding speed and the
+    token count of every generation are recorded in the metrics.
+
+    Args:
+        backend: The analysis type making the request.
+        prompt: The formatted prompt.
+        generation_parameters: The sampling parameters passed to text_generation.
+
+    Returns:
+        A generator of text chunks.
+    """
+    started = time.perf_counter()
+    first_token = None
+    tokens = 0
+    try:
+        for text in _attempt_stream(backend, prompt, generation_parameters):
+            tokens += 1
+            if first_token is None:
+                first_token = time.perf_counter()
+                LLM_TTFT_SECONDS.observe(first_token - started, backend)
+            yield text
+    finally:
+        if tokens:
+            finished = time.perf_counter()
+            LLM_TOKENS.inc(tokens, backend)
+            LLM_UPSTREAM_SECONDS.observe(finished - started, backend)
+            if tokens > 1 and finished > first_token:
+                LLM_TOKENS_PER_SECOND.observe((tokens - 1) / (finished - first_token), backend)
+
+
+def _attempt_stream(backend, prompt, generation_parameters):
+    """
+    Streams a text generation from the inference backend, retrying failed attempts.
+
+    Failed attempts are retried with jittered exponential backoff as long as no text has
+    been produced yet and the deadline allows it. Repeated failures open the circuit of
+    the analysis type so that further requests fail fast with BackendUnavailableError.
+
+    Args:
+        backend: The analysis type making the request.
+        prompt: The formatted prompt.
+        generation_parameters: The sampling parameters passed to text_generation.
+
+    Returns:
+        A generator of text chunks.
+    """
+    client = get_client(backend)
+    breaker = _breakers[backend]
+    rate_limiter = _rate_limiters[backend]
+    deadline = time.monotonic() + LLM_DEADLINE
+
+    attempt = 0
+    while True:
+        rate_limiter.wait(deadline)
+        breaker.before_call(backend)
+        produced = False
+        try:
+            generated_text_stream = client.text_generation(
+                prompt,
+                **generation_parameters,
+                stream=True,
+                details=True,
+                return_full_text=True,
+            )
+            for text in token_texts(generated_text_stream):
+                if time.monotonic() > deadline:
+                    raise DeadlineExceededError(f"Generation did not finish within {LLM_DEADLINE:g} seconds")
+                produced = True
+                yield text
+        except GeneratorExit:
+            # The consumer stopped reading; that says nothing about the upstream's health
+            breaker.record_success()
+            raise
+        except Exception as e:
+            retryable = _is_retryable(e) or isinstance(e, DeadlineExceededError)
+            if retryable:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if not retryable or produced or attempt >= LLM_MAX_RETRIES:
+                raise
+            delay = _retry_after(e) or random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+            if time.monotonic() + delay > deadline:
+                raise
+            attempt += 1
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        return
+
+
+def token_texts(generated_text_stream):
+    """
+    Yields the text of each token from a streaming text_generation call.
+    """
+    for text_segment in generated_text_stream:
+        yield text_segment.token.text
+
+
+def _partial_marker_length(text, marker):
+    # Length of the longest suffix of text that could be the start of marker
+    for length in range(min(len(marker) - 1, len(text)), 0, -1):
+        if text.endswith(marker[:length]):
+            return length
+    return 0
+
+
+def strip_stream(chunks, marker):
+    """
+    Removes every occurrence of marker from a stream of text chunks.
+
+    Gives the same result as joining the chunks and calling str.replace(marker, ''),
+    but emits text as soon as it can no longer be part of a marker split across chunks.
+
+    Args:
+        chunks: An iterable of text chunks.
+        marker: The substring to remove.
+
+    Returns:
+        A generator of cleaned text chunks.
+    """
+    pending = ""
+    for chunk in chunks:
+        parts = (pending + chunk).split(marker)
+        rest = parts[-1]
+        held = _partial_marker_length(rest, marker)
+        pending = rest[len(rest) - held:]
+        text = "".join(parts[:-1]) + rest[:len(rest) - held]
+        if text:
+            yield text
+    if pending:
+        yield pending
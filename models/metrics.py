@@ -0,0 +1,457 @@
+import asyncio
+import contextvars
+import glob
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+
+from dotenv import load_dotenv  # type: ignore
+
+load_dotenv()
+
+# Allow profiling a request by sending the X-Profile header; off by default since the
+# profile shows code paths of every request served meanwhile
+METRICS_PROFILING = os.getenv('METRICS_PROFILING', 'false').lower() in ('1', 'true', 'yes')
+# Seconds between stack samples of a profiled request
+METRICS_PROFILE_INTERVAL = float(os.getenv('METRICS_PROFILE_INTERVAL', '0.005'))
+# Directory the profiles are written to
+METRICS_PROFILE_DIR = os.getenv(
+    'METRICS_PROFILE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'profiles'),
+)
+
+# Directory every worker process writes its metrics to, so that /metrics served by any
+# worker reports the whole server; empty reports only the process serving the scrape.
+# gunicorn.conf.py sets it and empties it when the server starts.
+METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR', '')
+# Seconds between writes of a process's metrics to METRICS_MULTIPROC_DIR
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '1'))
+
+# Request header that turns the profiler on, and response header naming the profile
+PROFILE_HEADER = "x-profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+# Histogram buckets in seconds, from a millisecond to two minutes
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Histogram buckets of generation speed in tokens per second
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300)
+
+# Every metric, in the order /metrics lists them
+REGISTRY = []
+
+# Route of the request being served, the endpoint label of the stage timings
+_endpoint = contextvars.ContextVar("metrics_endpoint", default="other")
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class _Metric:
+    """
+    Base of the metrics: a name, help text, label names and registration in REGISTRY.
+
+    In multiprocess mode the series of every process are combined: those of counters and
+    histograms are added up, including the ones of processes that have exited.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+    def merge(self, processes):
+        """
+        Combines the series written by every process.
+
+        Args:
+            processes: {pid: {metric name: {label values: value}}}.
+
+        Returns:
+            The combined series and their label names.
+        """
+        values = {}
+        for metrics in processes.values():
+            for label_values, value in metrics.get(self.name, {}).items():
+                values.setdefault(label_values, []).append(value)
+        return {label_values: self.combine(series) for label_values, series in values.items()}, self.labels
+
+
+class Histogram(_Metric):
+    """
+    Counts observations into cumulative buckets, like a Prometheus client histogram.
+
+    Args:
+        name: The metric name.
+        help: What is observed.
+        labels: Label names; observe takes one value per label after the observation.
+        buckets: Upper bounds of the buckets, ascending.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket (the last is +Inf), sum]
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def series(self):
+        with self._lock:
+            return {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+
+    @staticmethod
+    def combine(series):
+        counts = [sum(bucket) for bucket in zip(*(counts for counts, _ in series))]
+        return counts, sum(total for _, total in series)
+
+    def render(self, series=None, labels=None):
+        lines = self._header()
+        series = self.series() if series is None else series
+        labels = self.labels if labels is None else labels
+        for label_values, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(labels, label_values, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(labels, label_values)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(labels, label_values)} {cumulative}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """
+    A monotonically increasing count per label values.
+
+    With collect, the values are read from a function returning {label values: value} at
+    every scrape instead, for counts another module already keeps.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=(), collect=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+        self._values = {}
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def values(self):
+        if self.collect is not None:
+            return self.collect()
+        with self._lock:
+            return dict(self._values)
+
+    def series(self):
+        return self.values()
+
+    @staticmethod
+    def combine(series):
+        return sum(series)
+
+    def render(self, series=None, labels=None):
+        lines = self._header()
+        series = self.values() if series is None else series
+        labels = self.labels if labels is None else labels
+        for label_values, value in sorted(series.items()):
+            lines.append(f"{self.name}{_labels(labels, label_values)} {_number(value)}")
+        return "\n".join(lines)
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down, set directly, with inc and dec, or read by collect.
+
+    In multiprocess mode only processes still running are reported, combined by
+    multiprocess_mode: "sum" adds them up, "max" takes the largest, e.g. for a value
+    every worker holds a copy of, and "all" reports each process with a pid label.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=(), collect=None, multiprocess_mode="sum"):
+        super().__init__(name, help, labels, collect)
+        self.multiprocess_mode = multiprocess_mode
+
+    def merge(self, processes):
+        processes = {pid: metrics for pid, metrics in processes.items() if _process_alive(pid)}
+        if self.multiprocess_mode == "all":
+            series = {
+                label_values + (str(pid),): value
+                for pid, metrics in processes.items() for label_values, value in metrics.get(self.name, {}).items()
+            }
+            return series, self.labels + ("pid",)
+        return super().merge(processes)
+
+    def combine(self, series):
+        return max(series) if self.multiprocess_mode == "max" else sum(series)
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def dec(self, amount=1, *label_values):
+        self.inc(-amount, *label_values)
+
+
+def render_metrics():
+    """
+    Returns every registered metric in the Prometheus text exposition format.
+
+    With METRICS_MULTIPROC_DIR set, the metrics of every worker process are combined, so
+    a scrape of any worker reports the whole server.
+    """
+    if not METRICS_MULTIPROC_DIR:
+        return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+    write_process_metrics()
+    processes = read_process_metrics()
+    return "\n".join(metric.render(*metric.merge(processes)) for metric in REGISTRY) + "\n"
+
+
+def write_process_metrics(directory=METRICS_MULTIPROC_DIR):
+    """
+    Writes the series of every metric of this process to <directory>/<pid>.json.
+    """
+    state = {metric.name: [[list(label_values), value] for label_values, value in metric.series().items()] for metric in REGISTRY}
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    # Written to a temporary file first so that scrapes never read a partial file
+    with open(f"{path}.tmp", 'w') as metrics_file:
+        json.dump(state, metrics_file)
+    os.replace(f"{path}.tmp", path)
+
+
+def read_process_metrics(directory=METRICS_MULTIPROC_DIR):
+    """
+    Returns the metrics written by every process as {pid: {metric name: {label values: value}}}.
+    """
+    processes = {}
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        try:
+            with open(path) as metrics_file:
+                state = json.load(metrics_file)
+            pid = int(os.path.basename(path)[:-len(".json")])
+        except (OSError, ValueError):
+            continue
+        processes[pid] = {name: {tuple(label_values): value for label_values, value in series} for name, series in state.items()}
+    return processes
+
+
+# Process the flushing thread was started in; a forked worker starts its own
+_flushing_pid = None
+
+
+def start_flushing(interval=METRICS_FLUSH_INTERVAL):
+    """
+    Writes this process's metrics to METRICS_MULTIPROC_DIR every interval seconds, from a thread.
+    """
+    global _flushing_pid
+    if not METRICS_MULTIPROC_DIR or _flushing_pid == os.getpid():
+        return
+    _flushing_pid = os.getpid()
+
+    def flush():
+        while True:
+            time.sleep(interval)
+            try:
+                write_process_metrics()
+            except Exception:
+                # A failed write is retried at the next interval; scrapes report the last one
+                pass
+
+    threading.Thread(target=flush, name="metrics-flush", daemon=True).start()
+
+
+REQUEST_SECONDS = Histogram(
+    "shadow_request_seconds", "Time to serve a request, until the last byte of a streamed response",
+    ("endpoint", "method", "status"),
+)
+REQUESTS_IN_PROGRESS = Gauge("shadow_requests_in_progress", "Requests being served", ("endpoint",))
+STAGE_SECONDS = Histogram(
+    "shadow_stage_seconds", "Time spent in a stage of a request: slice, serialize or prepare",
+    ("endpoint", "stage"),
+)
+
+
+@contextmanager
+def stage(name):
+    """
+    Times the block as a stage of the request being served.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, _endpoint.get(), name)
+
+
+class StackSampler:
+    """
+    A sampling profiler: records the stacks of all busy threads every interval seconds.
+
+    Threads waiting in threading, queue or selectors (idle workers, the event loop
+    between events) are skipped. The result is in the collapsed format flame graph tools
+    read, one "thread;outer;...;inner count" line per distinct stack.
+    """
+
+    _IDLE_FILES = ("threading.py", "queue.py", "selectors.py")
+
+    def __init__(self, interval=METRICS_PROFILE_INTERVAL):
+        self.interval = interval
+        self.samples = 0
+        self._stacks = StackCounter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            names.update((thread.ident, thread.name) for thread in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == own or os.path.basename(frame.f_code.co_filename) in self._IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self._stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+
+def profile_path(profile_id):
+    """
+    Returns the file of a saved profile, or None for an id that is not one.
+    """
+    if not profile_id.replace('-', '').isalnum():
+        return None
+    return os.path.join(METRICS_PROFILE_DIR, f"{profile_id}.folded")
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every request by route and serving the profiler hook.
+
+    In multiprocess mode it starts writing the metrics of the worker it runs in.
+
+    The endpoint label is the route's path template (e.g. /jobs/{job_id}), so requests
+    for different ids share one series. With METRICS_PROFILING on, a request carrying
+    the X-Profile header is profiled by a StackSampler; the profile is saved under
+    METRICS_PROFILE_DIR and named by the X-Profile-Id response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    @staticmethod
+    def endpoint(scope):
+        from starlette.routing import Match
+
+        app = scope.get("app")
+        for route in getattr(getattr(app, "router", None), "routes", ()):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        start_flushing()
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self.endpoint(scope)
+        token = _endpoint.set(endpoint)
+        status = [500]
+        sampler = None
+        profile_id = None
+        if METRICS_PROFILING and any(name == PROFILE_HEADER.encode() for name, _ in scope.get("headers", ())):
+            profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+            sampler = StackSampler().start()
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                if profile_id is not None:
+                    headers = list(message.get("headers", ())) + [(PROFILE_ID_HEADER.lower().encode(), profile_id.encode())]
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        REQUESTS_IN_PROGRESS.inc(1, endpoint)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint, scope.get("method", ""), str(status[0]))
+            REQUESTS_IN_PROGRESS.dec(1, endpoint)
+            _endpoint.reset(token)
+            if sampler is not None:
+                # Joining the sampler and writing the profile block, so they run off the event loop
+                await asyncio.to_thread(self.save_profile, sampler, profile_id, scope)
+
+    @staticmethod
+    def save_profile(sampler, profile_id, scope):
+        sampler.stop()
+        os.makedirs(METRICS_PROFILE_DIR, exist_ok=True)
+        with open(profile_path(profile_id), 'w') as profile_file:
+            profile_file.write(f"# {scope.get('method')} {scope.get('path')}: {sampler.samples} samples "
+                               f"every {sampler.interval:g} s\n")
+            profile_file.write(sampler.collapsed())
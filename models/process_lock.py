@@ -0,0 +1,56 @@
+import asyncio
+import fcntl
+import os
+
+# Seconds between attempts of a worker waiting to take over a held lock
+PROCESS_LOCK_RETRY_INTERVAL = 5.0
+
+
+class ProcessLock:
+    """
+    An exclusive lock on a file, held by at most one process on the machine at a time.
+
+    It elects the one gunicorn worker that runs a background duty, such as scheduled
+    batches or ingest compaction, when several workers run the same app. The operating
+    system releases the lock when its holder exits, however it exits, so a waiting worker
+    then takes over.
+
+    Args:
+        path: The lock file; it is created if missing and never removed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def acquire(self):
+        """
+        Takes the lock if no other process holds it, returning whether this process holds it.
+        """
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            lock_file = open(self.path, 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._file = lock_file
+        return True
+
+    async def wait(self, interval=PROCESS_LOCK_RETRY_INTERVAL):
+        """
+        Waits until this process holds the lock.
+        """
+        while not self.acquire():
+            await asyncio.sleep(interval)
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
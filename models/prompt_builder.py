@@ -0,0 +1,275 @@
+import logging
+import os
+import re
+import threading
+import time
+
+from dotenv import load_dotenv  # type: ignore
+
+from llm_gateway import backend_setting
+from metrics import Counter, Histogram
+
+try:
+    from tokenizers import Tokenizer  # type: ignore
+except ImportError:
+    Tokenizer = None
+
+load_dotenv()
+
+# Most input tokens a prompt may use; data is truncated by priority to fit
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', '3000'))
+# Local tokenizer used to count tokens: a tokenizer.json path or a Hugging Face model id.
+# Without it (or without the tokenizers package) tokens are estimated as characters / 4
+PROMPT_TOKENIZER = os.getenv('PROMPT_TOKENIZER', '')
+
+# Characters per token of the fallback estimate
+CHARS_PER_TOKEN = 4
+
+# Request fields that are not data, or that the prompt already states
+CONTROL_FIELDS = (
+    "server_data", "officers", "effectiveness", "min_per_beat", "max_per_beat",
+    "district", "police_station", "unitname", "beat_name",
+)
+
+# Priorities of the data sections; higher numbers are dropped first when over budget
+PRIORITY_TABLE = 0
+PRIORITY_TEXT = 1
+PRIORITY_FIELDS = 2
+
+# Rewrites of the sentences the frontend builds its analysis text from
+_VALUE_PATTERN = re.compile(r'\d+\.\s*([^;]*?):\s*(\d+)\s*\((\d+)% of total\)')
+_SPATIAL_LINE = re.compile(r'^\d+\)\s*Most of the (?P<field>.+?) in this .+? unit belongs to (?P<values>.*?)\.?$')
+_BEATWISE_LINE = re.compile(r'^\d+\)\s*In the beat of .+? district, the top \d+ frequencies in (?P<field>.+?) are: (?P<values>.*?)\.?$')
+_PREDICTION_LINE = re.compile(
+    r'^\d+\.\s*For the selected (?P<period>.+?), there were (?P<count>\d+) (?P<crime>.+?) cases recorded '
+    r'where accused demographics are:\s*(?P<rest>.*)$'
+)
+
+# Token counts go to the server log
+logger = logging.getLogger("uvicorn.error")
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_tokenizer():
+    """
+    Returns the local tokenizer named by PROMPT_TOKENIZER, or None to use the estimate.
+    """
+    global _tokenizer, _tokenizer_loaded
+    if _tokenizer_loaded:
+        return _tokenizer
+    with _tokenizer_lock:
+        if not _tokenizer_loaded:
+            if PROMPT_TOKENIZER and Tokenizer is not None:
+                try:
+                    if os.path.exists(PROMPT_TOKENIZER):
+                        _tokenizer = Tokenizer.from_file(PROMPT_TOKENIZER)
+                    else:
+                        _tokenizer = Tokenizer.from_pretrained(PROMPT_TOKENIZER)
+                except Exception as e:
+                    logger.warning("Could not load tokenizer %s, estimating tokens instead: %s", PROMPT_TOKENIZER, e)
+            _tokenizer_loaded = True
+    return _tokenizer
+
+
+def count_tokens(text):
+    """
+    Counts the tokens of a text with the local tokenizer, or estimates them as characters / 4.
+    """
+    if not text:
+        return 0
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+
+def _compact_values(values):
+    # "1. a: 5 (33% of total); 2. b: 3 (20% of total)" -> "a (5, 33%), b (3, 20%)"
+    matches = _VALUE_PATTERN.findall(values)
+    if not matches:
+        return values
+    return ", ".join(f"{value.strip()} ({freq}, {percent}%)" for value, freq, percent in matches)
+
+
+def compact_text(text):
+    """
+    Rewrites the frontend's analysis text as one short line per field.
+
+    The district and unit names repeated in every sentence are dropped, since the prompt
+    states them once, as are duplicate lines and markup. Lines that match none of the
+    frontend's sentence patterns are kept with their whitespace collapsed.
+
+    Returns:
+        The compacted lines.
+    """
+    lines, seen, periods = [], set(), set()
+    for line in re.split(r'\n|<br\s*/?>', text or ''):
+        line = ' '.join(line.split())
+        if not line:
+            continue
+        match = _SPATIAL_LINE.match(line) or _BEATWISE_LINE.match(line)
+        if match:
+            line = f"{match.group('field')}: {_compact_values(match.group('values'))}"
+        else:
+            match = _PREDICTION_LINE.match(line)
+            if match:
+                if match.group('period') not in periods:
+                    periods.add(match.group('period'))
+                    lines.append(f"Period: {match.group('period')}")
+                rest = re.sub(r'\s*occurrences\)', ')', match.group('rest'))
+                rest = re.sub(r'Accused (\w+):', r'accused \1:', rest)
+                line = f"{match.group('crime')}: {match.group('count')} cases; {rest}"
+        if line not in seen:
+            seen.add(line)
+            lines.append(line)
+    return lines
+
+
+def _field_lines(top):
+    # One line per field of an AggregationCube summary: "Crime_Type: Theft (120), Assault (80)"
+    return [
+        f"{field}: " + ", ".join(f"{item['value']} ({item['freq']})" for item in items)
+        for field, items in top.items() if items
+    ]
+
+
+def data_sections(data):
+    """
+    Splits the data of an analysis request into prioritised sections of lines.
+
+    Args:
+        data: A prepared table (str), or a request or summary dict.
+
+    Returns:
+        A list of (priority, lines) tuples in prompt order.
+    """
+    if isinstance(data, str):
+        return [(PRIORITY_TABLE, data.splitlines())]
+
+    sections = []
+    data = dict(data or {})
+    text = data.pop("analysis_text", None)
+    if text:
+        sections.append((PRIORITY_TEXT, compact_text(text)))
+    if "total" in data:
+        sections.append((PRIORITY_TABLE, [f"Total crimes: {data.pop('total')}"]))
+    if isinstance(data.get("top"), dict):
+        sections.append((PRIORITY_FIELDS, _field_lines(data.pop("top"))))
+    other = [
+        f"{key}: {value}" for key, value in data.items()
+        if key not in CONTROL_FIELDS and value not in (None, "", [], {})
+    ]
+    if other:
+        sections.append((PRIORITY_FIELDS, other))
+    return sections
+
+
+def fit_sections(sections, budget):
+    """
+    Drops data lines until the sections fit a token budget.
+
+    Lines are removed from the end of the lowest priority section first. If a single line
+    of the highest priority is still too long, it is cut short.
+
+    Returns:
+        The remaining lines in prompt order and whether anything was removed.
+    """
+    counted = [(priority, [(line, count_tokens(line) + 1) for line in lines]) for priority, lines in sections]
+    total = sum(tokens for _, lines in counted for _, tokens in lines)
+    truncated = False
+    while total > budget:
+        candidates = [index for index, (_, lines) in enumerate(counted) if lines]
+        if not candidates:
+            break
+        index = max(candidates, key=lambda index: (counted[index][0], index))
+        lines = counted[index][1]
+        if len(lines) == 1 and len(candidates) == 1:
+            line, tokens = lines[0]
+            keep = max(len(line) * max(budget, 0) // max(tokens, 1), 0)
+            lines[0] = (line[:keep], count_tokens(line[:keep]) + 1)
+            total += lines[0][1] - tokens
+            truncated = True
+            break
+        total -= lines.pop()[1]
+        truncated = True
+    return [line for _, lines in counted for line, _ in lines if line], truncated
+
+
+def build_prompt(backend, system_context_prompt, user_context_prompt, data):
+    """
+    Builds the model prompt from the instructions and the compacted request data.
+
+    The data is compacted by data_sections and trimmed by fit_sections so that the whole
+    prompt stays within PROMPT_TOKEN_BUDGET (PROMPT_TOKEN_BUDGET_<TYPE> per analysis type).
+    The token counts of every prompt are logged and added to prompt_stats, and the time
+    it took to build is recorded in the metrics.
+
+    Args:
+        backend: The analysis type.
+        system_context_prompt: The system instructions.
+        user_context_prompt: The request instructions, without the data.
+        data: The data of the request, see data_sections.
+
+    Returns:
+        The formatted prompt string.
+    """
+    start = time.perf_counter()
+    budget = backend_setting('PROMPT_TOKEN_BUDGET', backend, PROMPT_TOKEN_BUDGET)
+    template = f"<s>[SYS] {system_context_prompt} [/SYS]\n[INST] {user_context_prompt}The data is as follows:\n\n{{data}} [/INST]"
+    instruction_tokens = count_tokens(template.replace("{data}", ""))
+
+    sections = data_sections(data)
+    lines, truncated = fit_sections(sections, budget - instruction_tokens)
+    prompt = template.replace("{data}", "\n".join(lines))
+
+    raw_tokens = instruction_tokens + count_tokens(str(data))
+    prompt_tokens = count_tokens(prompt)
+    logger.info(
+        "%s prompt: %d tokens (%d instructions, %d data; %d before compaction, budget %d)%s",
+        backend, prompt_tokens, instruction_tokens, prompt_tokens - instruction_tokens,
+        raw_tokens, budget, ", truncated" if truncated else "",
+    )
+    with _stats_lock:
+        stats = _stats.setdefault(backend, {"prompts": 0, "tokens": 0, "raw_tokens": 0, "truncated": 0})
+        stats["prompts"] += 1
+        stats["tokens"] += prompt_tokens
+        stats["raw_tokens"] += raw_tokens
+        stats["truncated"] += int(truncated)
+    PROMPT_BUILD_SECONDS.observe(time.perf_counter() - start, backend)
+    return prompt
+
+
+def prompt_stats():
+    """
+    Returns the number of prompts built per analysis type with their total token counts
+    after and before compaction, and how many had data cut to fit the budget.
+    """
+    with _stats_lock:
+        return {backend: dict(stats) for backend, stats in _stats.items()}
+
+
+PROMPT_BUILD_SECONDS = Histogram(
+    "shadow_prompt_build_seconds", "Time to compact the request data and build a prompt", ("backend",),
+)
+PROMPTS = Counter(
+    "shadow_prompts_total", "Prompts built", ("backend",),
+    collect=lambda: {(backend,): stats["prompts"] for backend, stats in prompt_stats().items()},
+)
+PROMPTS_TRUNCATED = Counter(
+    "shadow_prompts_truncated_total", "Prompts whose data was cut to fit the token budget", ("backend",),
+    collect=lambda: {(backend,): stats["truncated"] for backend, stats in prompt_stats().items()},
+)
+PROMPT_TOKENS = Counter(
+    "shadow_prompt_tokens_total", "Prompt tokens, as sent (compacted) and before compaction (raw)",
+    ("backend", "form"),
+    collect=lambda: {
+        key: value for backend, stats in prompt_stats().items()
+        for key, value in (((backend, "compacted"), stats["tokens"]), ((backend, "raw"), stats["raw_tokens"]))
+    },
+)
@@ -0,0 +1,119 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson  # type: ignore
+except ImportError:
+    orjson = None
+
+try:
+    import pyarrow as pa  # type: ignore
+except ImportError:
+    pa = None
+
+# Media type of the Arrow IPC stream format
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def column_values(series):
+    """
+    Converts a column to a list of plain Python values with missing values as None.
+
+    The conversion happens once per column instead of once per cell.
+
+    Args:
+        series: The pandas Series to convert.
+
+    Returns:
+        A list with one JSON-serialisable value per row.
+    """
+    # Integer and boolean columns cannot hold missing values
+    if series.dtype.kind in 'iub':
+        return series.to_numpy().tolist()
+
+    values = series.to_numpy(dtype=object, copy=True)
+    missing = pd.isna(series).to_numpy()
+    if missing.any():
+        values[missing] = None
+    return values.tolist()
+
+
+def dumps(content):
+    """
+    Encodes content as JSON bytes, using orjson when it is installed.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=str)
+    return json.dumps(content, default=str, separators=(',', ':')).encode('utf-8')
+
+
+def frame_to_records_json(frame):
+    """
+    Serialises a DataFrame as a JSON array of row objects, with NaN written as null.
+    """
+    columns = list(frame.columns)
+    values = [column_values(frame[column]) for column in columns]
+    records = [dict(zip(columns, row)) for row in zip(*values)]
+    return dumps(records)
+
+
+def frame_to_columns_json(frame, **extra):
+    """
+    Serialises a DataFrame as one JSON array per column, with NaN written as null.
+
+    Args:
+        frame: The DataFrame to serialise.
+        **extra: Additional top-level keys to include, such as pagination cursors.
+
+    Returns:
+        JSON bytes of the form {"columns": [...], "data": {"column": [...]}, ...}.
+    """
+    columns = list(frame.columns)
+    content = {
+        "columns": columns,
+        "data": {column: column_values(frame[column]) for column in columns},
+        "length": len(frame),
+    }
+    content.update(extra)
+    return dumps(content)
+
+
+def frame_to_arrow(frame):
+    """
+    Serialises a DataFrame as an Arrow IPC stream.
+
+    Raises:
+        RuntimeError: If pyarrow is not installed.
+    """
+    if pa is None:
+        raise RuntimeError("pyarrow is required for Arrow responses")
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def keyset_slice(frame, cursor, limit):
+    """
+    Returns the rows that come after cursor in index order, for keyset pagination.
+
+    Unlike offset pagination, this stays correct when rows are appended and its cost
+    does not grow with the page number.
+
+    Args:
+        frame: A DataFrame with a monotonically increasing index.
+        cursor: The index label of the last row already seen, or None to start at the top.
+        limit: Maximum number of rows to return.
+
+    Returns:
+        A tuple of the row slice and the cursor of the next page (None on the last page).
+    """
+    start = 0 if cursor is None else int(np.searchsorted(frame.index.to_numpy(), cursor, side='right'))
+    page = frame.iloc[start:start + limit]
+    next_cursor = None
+    if start + limit < len(frame) and len(page):
+        next_cursor = page.index[-1].item() if hasattr(page.index[-1], 'item') else page.index[-1]
+    return page, next_cursor
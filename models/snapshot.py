@@ -0,0 +1,154 @@
+import gzip
+import hashlib
+import os
+import re
+import threading
+
+from fastapi.responses import Response
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+
+class Snapshot:
+    """
+    A serialised response body together with its pre-compressed variants.
+
+    Args:
+        body: The uncompressed body.
+        digest: Hash of the source file the body was built from.
+        media_type: Content type of the body.
+    """
+
+    def __init__(self, body, digest, media_type):
+        self.media_type = media_type
+        self.encodings = {"identity": body, "gzip": gzip.compress(body, compresslevel=9)}
+        if brotli is not None:
+            self.encodings["br"] = brotli.compress(body)
+        self.etags = {
+            encoding: f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+            for encoding in self.encodings
+        }
+
+
+class FileSnapshot:
+    """
+    Keeps a response derived from a file, rebuilding it only when the file changes.
+
+    A change of modification time or size triggers a rehash of the file; the body is
+    only rebuilt when the hash differs from the one it was built from.
+
+    Args:
+        path: The source file.
+        build: A function taking the path and returning the body as bytes.
+        media_type: Content type of the body.
+    """
+
+    def __init__(self, path, build, media_type="application/json"):
+        self.path = path
+        self.build = build
+        self.media_type = media_type
+        self._stat = None
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """
+        Returns an up to date Snapshot, rebuilding it first if the source file changed.
+        """
+        stat = os.stat(self.path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        if key == self._stat and self._snapshot is not None:
+            return self._snapshot
+
+        with self._lock:
+            if key != self._stat or self._snapshot is None:
+                digest = file_digest(self.path)
+                if self._snapshot is None or f'"{digest}"' != self._snapshot.etags["identity"]:
+                    self._snapshot = Snapshot(self.build(self.path), digest, self.media_type)
+                self._stat = key
+            return self._snapshot
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Returns a short SHA-256 hex digest of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def _preferred_encoding(accept_encoding, available):
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        match = re.search(r'q=([0-9.]+)', params)
+        if match:
+            quality = float(match.group(1))
+        accepted[name.strip().lower()] = quality
+    for encoding in ("br", "gzip"):
+        if encoding in available and accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return "identity"
+
+
+def _parse_range(range_header, length):
+    # Only a single byte range is supported; anything else is served in full
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', range_header)
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        start, end = max(length - int(last), 0), length - 1
+    else:
+        start = int(first)
+        end = min(int(last), length - 1) if last else length - 1
+    if start > end or start >= length:
+        return False
+    return start, end
+
+
+def snapshot_response(request, snapshot):
+    """
+    Serves a Snapshot with content negotiation, conditional GET and byte ranges.
+
+    Returns 304 when If-None-Match matches, 206 for a satisfiable single Range,
+    416 for an unsatisfiable one, and 200 with the best accepted encoding otherwise.
+    """
+    encoding = _preferred_encoding(request.headers.get('accept-encoding', ''), snapshot.encodings)
+    body = snapshot.encodings[encoding]
+    etag = snapshot.etags[encoding]
+    headers = {
+        "ETag": etag,
+        "Vary": "Accept-Encoding",
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "no-cache",
+    }
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        candidates = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        if '*' in candidates or candidates & set(snapshot.etags.values()):
+            return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    if range_header and (if_range is None or if_range == etag):
+        byte_range = _parse_range(range_header, len(body))
+        if byte_range is False:
+            headers["Content-Range"] = f"bytes */{len(body)}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+            return Response(content=body[start:end + 1], status_code=206, media_type=snapshot.media_type, headers=headers)
+
+    return Response(content=body, media_type=snapshot.media_type, headers=headers)
@@ -0,0 +1,245 @@
+import numpy as np
+import pandas as pd
+
+# Side of a grid cell in degrees, about 1.1 km of latitude
+CELL_SIZE_DEGREES = 0.01
+# Mean Earth radius used for great-circle distances
+EARTH_RADIUS_KM = 6371.0088
+# Kilometres per degree of latitude
+KM_PER_DEGREE = np.pi * EARTH_RADIUS_KM / 180.0
+
+# Columns the queries can be filtered on
+FILTER_COLUMNS = ("district_name", "unitname", "beat_name", "Crime_Type", "crime_group_name")
+
+
+def haversine_km(latitude, longitude, latitudes, longitudes):
+    """
+    Returns the great-circle distances in km from one point to an array of points.
+    """
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _concatenate_ranges(starts, stops):
+    # Indices of all the [start, stop) ranges, without a Python loop over the ranges
+    lengths = stops - starts
+    keep = lengths > 0
+    starts, lengths = starts[keep], lengths[keep]
+    if not len(lengths):
+        return np.zeros(0, dtype=np.int64)
+    ends = np.cumsum(lengths)
+    return np.arange(ends[-1], dtype=np.int64) + np.repeat(starts - (ends - lengths), lengths)
+
+
+class SpatialIndex:
+    """
+    A sorted grid index over the incident coordinates.
+
+    Points are bucketed into square cells of cell_size degrees and sorted by cell number,
+    row by row. The cells of one grid row that overlap a bounding box are then a single
+    contiguous run of the sorted arrays, found with a binary search, so a query touches
+    one run per grid row instead of every point. Filter columns are stored as integer
+    codes in the same order, so attribute filters are applied to the candidates only.
+
+    Args:
+        frame: The cleaned crime DataFrame.
+        cell_size: Side of a grid cell in degrees.
+        filter_columns: Columns the queries may be filtered on; those missing from frame are skipped.
+    """
+
+    def __init__(self, frame, cell_size=CELL_SIZE_DEGREES, filter_columns=FILTER_COLUMNS):
+        self.cell_size = cell_size
+        self.filter_columns = [column for column in filter_columns if column in frame.columns]
+
+        latitude = frame['latitude'].to_numpy(dtype=np.float64)
+        longitude = frame['longitude'].to_numpy(dtype=np.float64)
+        valid = np.flatnonzero(np.isfinite(latitude) & np.isfinite(longitude))
+        latitude, longitude = latitude[valid], longitude[valid]
+
+        self.south = latitude.min() if len(valid) else 0.0
+        self.west = longitude.min() if len(valid) else 0.0
+        self.north = latitude.max() if len(valid) else 0.0
+        self.east = longitude.max() if len(valid) else 0.0
+        cell_y = self._cell(latitude, self.south)
+        cell_x = self._cell(longitude, self.west)
+        self.grid_rows = int(cell_y.max(initial=0)) + 1
+        self.grid_columns = int(cell_x.max(initial=0)) + 1
+
+        cells = cell_y * self.grid_columns + cell_x
+        order = np.argsort(cells, kind='stable')
+        self.cells = cells[order]
+        # Row positions in frame of the sorted points
+        self.positions = valid[order]
+        self.latitude = latitude[order]
+        self.longitude = longitude[order]
+
+        # column -> (codes of the sorted points, {value: code})
+        self.attributes = {}
+        for column in self.filter_columns:
+            series = frame[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                codes, categories = series.cat.codes.to_numpy(), series.cat.categories
+            else:
+                codes, categories = pd.factorize(series)
+            lookup = {value: code for code, value in enumerate(categories)}
+            self.attributes[column] = (codes[self.positions].astype(np.int32), lookup)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def with_rows(self, frame, combined):
+        """
+        Returns an index that also holds newly ingested rows.
+
+        The new points are merged into the sorted arrays at their cells instead of sorting
+        everything again. This index is left unchanged, so queries running meanwhile see a
+        consistent state until the caller swaps in the new one. Points outside the current
+        grid would shift every cell number, so then the index is rebuilt from combined.
+
+        Args:
+            frame: The new rows.
+            combined: The whole dataset, ending with the new rows.
+        """
+        latitude = frame['latitude'].to_numpy(dtype=np.float64)
+        longitude = frame['longitude'].to_numpy(dtype=np.float64)
+        valid = np.flatnonzero(np.isfinite(latitude) & np.isfinite(longitude))
+        latitude, longitude = latitude[valid], longitude[valid]
+        cell_y = self._cell(latitude, self.south)
+        cell_x = self._cell(longitude, self.west)
+        if not len(self) or (cell_y < 0).any() or (cell_y >= self.grid_rows).any() \
+                or (cell_x < 0).any() or (cell_x >= self.grid_columns).any():
+            return SpatialIndex(combined, self.cell_size, self.filter_columns)
+
+        cells = cell_y * self.grid_columns + cell_x
+        order = np.argsort(cells, kind='stable')
+        # Insert after the points already in the same cell, keeping every cell's points in row order
+        at = np.searchsorted(self.cells, cells[order], side='right')
+        index = object.__new__(SpatialIndex)
+        index.__dict__.update(self.__dict__)
+        index.cells = np.insert(self.cells, at, cells[order])
+        index.positions = np.insert(self.positions, at, (len(combined) - len(frame) + valid)[order])
+        index.latitude = np.insert(self.latitude, at, latitude[order])
+        index.longitude = np.insert(self.longitude, at, longitude[order])
+        index.north = max(self.north, latitude.max(initial=self.north))
+        index.east = max(self.east, longitude.max(initial=self.east))
+
+        index.attributes = {}
+        for column, (codes, lookup) in self.attributes.items():
+            lookup = dict(lookup)
+            values = frame[column].to_numpy(dtype=object)[valid]
+            new_codes = np.full(len(values), -1, dtype=np.int32)
+            for row, value in enumerate(values):
+                if pd.isna(value):
+                    continue
+                new_codes[row] = lookup.setdefault(value, len(lookup))
+            index.attributes[column] = (np.insert(codes, at, new_codes[order]), lookup)
+        return index
+
+    def _cell(self, values, origin):
+        return np.floor((values - origin) / self.cell_size).astype(np.int64)
+
+    def _candidates(self, south, west, north, east):
+        # Sorted-array indices of the points in the cells overlapping the bounding box
+        first_row = max(int(np.floor((south - self.south) / self.cell_size)), 0)
+        last_row = min(int(np.floor((north - self.south) / self.cell_size)), self.grid_rows - 1)
+        first_column = max(int(np.floor((west - self.west) / self.cell_size)), 0)
+        last_column = min(int(np.floor((east - self.west) / self.cell_size)), self.grid_columns - 1)
+        if first_row > last_row or first_column > last_column:
+            return np.zeros(0, dtype=np.int64)
+
+        row_starts = np.arange(first_row, last_row + 1, dtype=np.int64) * self.grid_columns
+        starts = np.searchsorted(self.cells, row_starts + first_column, side='left')
+        stops = np.searchsorted(self.cells, row_starts + last_column, side='right')
+        return _concatenate_ranges(starts, stops)
+
+    def _filter(self, candidates, filters):
+        # Keep the candidates matching every column=value filter; unknown columns raise KeyError
+        for column, value in filters.items():
+            if value is None:
+                continue
+            if column not in self.attributes:
+                raise KeyError(column)
+            codes, lookup = self.attributes[column]
+            code = lookup.get(value)
+            if code is None:
+                return candidates[:0]
+            candidates = candidates[codes[candidates] == code]
+        return candidates
+
+    def viewport(self, south, west, north, east, **filters):
+        """
+        Finds the points inside a bounding box.
+
+        Args:
+            south, west, north, east: The bounding box in degrees.
+            **filters: column=value filters on the filter columns.
+
+        Returns:
+            The row positions in frame of the matching points, in ascending order.
+        """
+        candidates = self._candidates(south, west, north, east)
+        latitude, longitude = self.latitude[candidates], self.longitude[candidates]
+        inside = (latitude >= south) & (latitude <= north) & (longitude >= west) & (longitude <= east)
+        candidates = self._filter(candidates[inside], filters)
+        return np.sort(self.positions[candidates])
+
+    def _within(self, latitude, longitude, radius_km, filters):
+        # Sorted-array indices and distances of the points within radius_km, and whether the
+        # search box covered the whole extent of the points
+        delta_latitude = radius_km / KM_PER_DEGREE
+        cos_latitude = np.cos(np.radians(min(abs(latitude) + delta_latitude, 90.0)))
+        delta_longitude = 360.0 if cos_latitude < 1e-9 else radius_km / (KM_PER_DEGREE * cos_latitude)
+        south, north = latitude - delta_latitude, latitude + delta_latitude
+        west, east = longitude - delta_longitude, longitude + delta_longitude
+
+        candidates = self._filter(self._candidates(south, west, north, east), filters)
+        distances = haversine_km(latitude, longitude, self.latitude[candidates], self.longitude[candidates])
+        inside = distances <= radius_km
+        covered = south <= self.south and north >= self.north and west <= self.west and east >= self.east
+        return candidates[inside], distances[inside], covered
+
+    def radius(self, latitude, longitude, radius_km, **filters):
+        """
+        Finds the points within a great-circle distance of a location.
+
+        Args:
+            latitude, longitude: The centre in degrees.
+            radius_km: The search radius in km.
+            **filters: column=value filters on the filter columns.
+
+        Returns:
+            The row positions in frame of the matching points and their distances in km,
+            nearest first.
+        """
+        candidates, distances, _ = self._within(latitude, longitude, radius_km, filters)
+        order = np.argsort(distances, kind='stable')
+        return self.positions[candidates[order]], distances[order]
+
+    def nearest(self, latitude, longitude, k, **filters):
+        """
+        Finds the k points nearest to a location.
+
+        The search radius starts at one cell and doubles until it holds k points, which are
+        then guaranteed to be the k nearest. Once it covers every point, all matching points
+        are ranked instead.
+
+        Returns:
+            The row positions in frame of up to k points and their distances in km, nearest first.
+        """
+        if k <= 0 or not len(self):
+            return self.positions[:0], np.zeros(0)
+        radius_km = self.cell_size * KM_PER_DEGREE
+        while True:
+            candidates, distances, covered = self._within(latitude, longitude, radius_km, filters)
+            if len(candidates) >= k:
+                break
+            if covered:
+                # Fewer than k points within the radius: rank every matching point instead
+                candidates = self._filter(np.arange(len(self), dtype=np.int64), filters)
+                distances = haversine_km(latitude, longitude, self.latitude[candidates], self.longitude[candidates])
+                break
+            radius_km *= 2.0
+        order = np.argsort(distances, kind='stable')[:k]
+        return self.positions[candidates[order]], distances[order]
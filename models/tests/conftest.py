@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The models are run from their own directory, which is where their imports resolve from
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
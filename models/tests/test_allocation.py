@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from allocation import MAX_PER_BEAT_LIMIT, allocate
+
+
+def greedy_allocation(intensity, officers, effectiveness, min_per_beat, max_per_beat):
+    # Hands out the officers of every shift one at a time, each to the largest marginal gain
+    beats, shifts = intensity.shape
+    max_per_beat = max(max_per_beat, min_per_beat)
+    allocation = np.zeros((beats, shifts), dtype=np.int64)
+    for shift in range(shifts):
+        budget = officers[shift]
+        floor = min(min_per_beat, budget // beats)
+        allocation[:, shift] = floor
+        budget -= floor * beats
+        for _ in range(budget):
+            gains = intensity[:, shift] * effectiveness * (1 - effectiveness) ** allocation[:, shift]
+            gains[allocation[:, shift] >= max_per_beat] = -1
+            if gains.max() < 0:
+                break
+            allocation[np.argmax(gains), shift] += 1
+    return allocation
+
+
+def coverage(intensity, allocation, effectiveness):
+    return (intensity * (1 - (1 - effectiveness) ** allocation)).sum(axis=0)
+
+
+@pytest.mark.parametrize("officers, min_per_beat, max_per_beat", [
+    ([0, 5, 40], 0, 10),
+    ([7, 60, 500], 1, 3),
+    ([25, 25, 25], 2, 2),
+    ([3, 1000, 12], 0, MAX_PER_BEAT_LIMIT),
+])
+def test_allocate_matches_a_step_by_step_greedy_allocation(officers, min_per_beat, max_per_beat):
+    rng = np.random.default_rng(7)
+    intensity = rng.random((20, 3)) * 10
+
+    allocation = allocate(intensity, officers, 0.3, min_per_beat, max_per_beat)
+    expected = greedy_allocation(intensity, officers, 0.3, min_per_beat, max_per_beat)
+
+    assert allocation.sum(axis=0).tolist() == expected.sum(axis=0).tolist()
+    assert allocation.max() <= max(max_per_beat, min_per_beat)
+    # Ties between equal gains may be broken differently, but the coverage is the same
+    np.testing.assert_allclose(coverage(intensity, allocation, 0.3), coverage(intensity, expected, 0.3))
+
+
+def test_allocate_without_beats():
+    assert allocate(np.zeros((0, 3)), [5, 5, 5]).shape == (0, 3)
+
+
+@pytest.mark.parametrize("min_per_beat, max_per_beat", [(-1, 10), (0, -1), (0, MAX_PER_BEAT_LIMIT + 1), (10 ** 6, 10)])
+def test_allocate_rejects_out_of_range_officers_per_beat(min_per_beat, max_per_beat):
+    with pytest.raises(ValueError):
+        allocate(np.random.rand(200, 3), [1, 1, 1], min_per_beat=min_per_beat, max_per_beat=max_per_beat)
+
+
+def test_allocate_bounds_the_gains_by_the_officers_of_the_shift():
+    # max_per_beat far above the shift's officers must not build a (beats x max_per_beat) array
+    allocation = allocate(np.random.rand(200, 3), [1, 1, 1], max_per_beat=MAX_PER_BEAT_LIMIT)
+    assert allocation.sum(axis=0).tolist() == [1, 1, 1]
@@ -0,0 +1,169 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dataset_loader
+import ingest
+from aggregates import DATE_COLUMN, TIME_COLUMN
+from ingest import ENTRY_FIELDS, EntryTail, append_rows, coerce_entries, format_entry_lines, parse_entry_lines
+
+
+def make_dataset():
+    return pd.DataFrame({
+        "district_name": pd.Categorical(["North", "South"]),
+        "Crime_Type": pd.Categorical(["Theft", "Assault"]),
+        "latitude": [12.9, 13.1],
+        "longitude": [77.5, 77.7],
+        "accused_age": np.array([30, 41], dtype=np.int64),
+        "month": np.array([1, 2], dtype=np.int64),
+        "year": np.array([2024, 2024], dtype=np.int64),
+        DATE_COLUMN: ["2024-01-05", "2024-02-10"],
+        TIME_COLUMN: ["10:00:00", "22:30:00"],
+    })
+
+
+def entry(**fields):
+    values = {
+        "district_name": "North", "crime": "Theft", "latitude": "12.95", "longitude": "77.55",
+        "accused_age": "25", "offence_from_date": "2024-03-01", "offence_from_time": "08:15",
+    }
+    values.update(fields)
+    return {field: values.get(field, "") for field in ENTRY_FIELDS}
+
+
+def parse(*entries):
+    return parse_entry_lines(format_entry_lines(entries).splitlines())[0]
+
+
+def test_coerce_entries_matches_the_dataset_columns_and_dtypes():
+    rows, dropped = coerce_entries(parse(entry()), make_dataset())
+    assert dropped == 0
+    assert list(rows.columns) == list(make_dataset().columns)
+    assert rows["accused_age"].dtype == np.int64
+    assert rows.loc[0, "month"] == 3 and rows.loc[0, "year"] == 2024
+    assert rows.loc[0, TIME_COLUMN] == "08:15:00"
+
+
+def test_coerce_entries_drops_rows_without_valid_coordinates():
+    entries = parse(entry(), entry(latitude="0"), entry(longitude="abc"), entry(latitude="95"))
+    rows, dropped = coerce_entries(entries, make_dataset())
+    assert len(rows) == 1 and dropped == 3
+
+
+def test_missing_values_promote_integer_columns_to_float():
+    rows, _ = coerce_entries(parse(entry(accused_age="")), make_dataset())
+    assert rows["accused_age"].dtype == np.float64
+    assert np.isnan(rows.loc[0, "accused_age"])
+
+    combined, _ = append_rows(make_dataset(), rows)
+    assert combined["accused_age"].dtype == np.float64
+    assert combined["accused_age"].tolist()[:2] == [30.0, 41.0]
+
+
+def test_append_rows_widens_categories_without_recoding_existing_rows():
+    frame = make_dataset()
+    codes = frame["district_name"].cat.codes.tolist()
+    rows, _ = coerce_entries(parse(entry(district_name="East"), entry(district_name="South")), frame)
+
+    combined, appended = append_rows(frame, rows)
+
+    assert isinstance(combined["district_name"].dtype, pd.CategoricalDtype)
+    assert list(combined["district_name"].cat.categories) == ["North", "South", "East"]
+    assert combined["district_name"].cat.codes.tolist()[:2] == codes
+    assert combined["district_name"].tolist() == ["North", "South", "East", "South"]
+    assert list(appended.index) == [2, 3]
+    assert list(combined.index) == [0, 1, 2, 3]
+
+
+def test_tail_returns_complete_lines_only(tmp_path):
+    path = tmp_path / "entries.csv"
+    path.write_bytes(b"a,1\nb,2\nc,")
+    tail = EntryTail(str(path))
+
+    assert tail.read() == ["a,1", "b,2"]
+    assert tail.read() == []
+
+    with open(path, "ab") as entries_file:
+        entries_file.write(b"3\n")
+    assert tail.read() == ["c,3"]
+    assert tail.offset == os.path.getsize(path)
+
+
+def test_tail_reads_a_shrunk_file_from_the_start(tmp_path):
+    path = tmp_path / "entries.csv"
+    path.write_bytes(b"a,1\nb,2\n")
+    tail = EntryTail(str(path))
+    tail.read()
+
+    # The file is replaced by a shorter one
+    path.write_bytes(b"c,3\n")
+    assert tail.read() == ["c,3"]
+
+
+def test_tail_of_a_missing_file_reads_nothing(tmp_path):
+    tail = EntryTail(str(tmp_path / "missing.csv"))
+    assert tail.read() == []
+    assert tail.offset == 0
+
+
+def test_tail_append_starts_on_a_new_line(tmp_path):
+    path = tmp_path / "entries.csv"
+    path.write_bytes(b"unfinished")
+    tail = EntryTail(str(path), offset=len(b"unfinished"))
+    tail.append([entry()])
+    entries, malformed = parse_entry_lines(tail.read())
+    assert malformed == 0
+    assert entries["district_name"].tolist() == ["North"]
+
+
+@pytest.fixture
+def dataset(tmp_path, monkeypatch):
+    pytest.importorskip("pyarrow")
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setattr(dataset_loader, "DATASET_CACHE_DIR", str(cache_dir))
+    monkeypatch.setattr(ingest, "DATASET_CACHE_DIR", str(cache_dir))
+    csv_path = tmp_path / "dataset.csv"
+    make_dataset().to_csv(csv_path, index=False)
+    return str(csv_path), dataset_loader.load_dataset(str(csv_path))
+
+
+def test_snapshot_resumes_after_the_ingested_entries(tmp_path, dataset):
+    csv_path, frame = dataset
+    entries_path = tmp_path / "entries.csv"
+    tail = EntryTail(str(entries_path))
+    tail.append([entry(district_name="East")])
+    rows, _ = coerce_entries(parse_entry_lines(tail.read())[0], frame)
+    combined, _ = append_rows(frame, rows)
+    offset = tail.offset
+    ingest.save_snapshot(combined, csv_path, tail.path, offset)
+    # An entry appended after the snapshot is read once the snapshot is loaded
+    tail.append([entry(district_name="West")])
+
+    resumed = EntryTail(str(entries_path))
+    loaded = ingest.load_snapshot(frame, csv_path, resumed)
+
+    assert len(loaded) == 3
+    assert loaded["district_name"].tolist()[-1] == "East"
+    assert resumed.offset == offset
+    assert parse_entry_lines(resumed.read())[0]["district_name"].tolist() == ["West"]
+
+
+def test_snapshot_is_ignored_when_the_entries_file_shrank(tmp_path, dataset):
+    csv_path, frame = dataset
+    entries_path = tmp_path / "entries.csv"
+    tail = EntryTail(str(entries_path))
+    tail.append([entry(), entry()])
+    tail.read()
+    ingest.save_snapshot(frame, csv_path, tail.path, tail.offset)
+
+    entries_path.write_text("")
+    resumed = EntryTail(str(entries_path))
+    assert ingest.load_snapshot(frame, csv_path, resumed) is frame
+    assert resumed.offset == 0
+
+
+def test_snapshot_is_ignored_without_one(tmp_path, dataset):
+    csv_path, frame = dataset
+    assert ingest.load_snapshot(frame, csv_path, EntryTail(str(tmp_path / "entries.csv"))) is frame
@@ -0,0 +1,125 @@
+import pytest
+
+import llm_cache
+from llm_cache import GenerationCache
+
+
+class Upstream:
+    """
+    A fake generation yielding the given chunks, recording how often it was started and closed.
+    """
+
+    def __init__(self, chunks, error=None):
+        self.chunks = chunks
+        self.error = error
+        self.started = 0
+        self.closed = False
+
+    def __call__(self):
+        self.started += 1
+        return self._generate()
+
+    def _generate(self):
+        try:
+            yield from self.chunks
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.closed = True
+
+
+@pytest.fixture(params=["memory", "disk"])
+def cache(request, tmp_path):
+    path = str(tmp_path / "cache.sqlite3") if request.param == "disk" else None
+    return GenerationCache(path, ttl=60, memory_entries=8, max_entries=8)
+
+
+def test_generation_is_cached(cache):
+    upstream = Upstream(["a", "b"])
+    assert "".join(cache.stream("key", upstream)) == "ab"
+    assert "".join(cache.stream("key", upstream)) == "ab"
+    assert upstream.started == 1
+    assert cache.stats["misses"] == 1 and cache.stats["memory_hits"] == 1
+
+
+def test_concurrent_requests_share_one_generation(cache):
+    upstream = Upstream(["a", "b", "c"])
+    leader = cache.stream("key", upstream)
+    assert next(leader) == "a"
+
+    follower = cache.stream("key", upstream)
+    assert "".join(follower) == "abc"
+    assert "".join(leader) == "bc"
+    assert upstream.started == 1
+    assert cache.stats["coalesced"] == 1
+    assert cache.get("key") == "abc"
+
+
+def test_followers_finish_the_generation_when_the_leader_goes_away(cache):
+    upstream = Upstream(["a", "b", "c"])
+    leader = cache.stream("key", upstream)
+    assert next(leader) == "a"
+    follower = cache.stream("key", upstream)
+    assert next(follower) == "a"
+
+    # The leader's client disconnects
+    leader.close()
+
+    assert "".join(follower) == "bc"
+    assert upstream.started == 1
+    assert cache.get("key") == "abc"
+
+
+def test_generation_is_closed_once_every_request_went_away(cache):
+    upstream = Upstream(["a", "b", "c"])
+    leader = cache.stream("key", upstream)
+    next(leader)
+    follower = cache.stream("key", upstream)
+    next(follower)
+
+    leader.close()
+    assert not upstream.closed
+    follower.close()
+    assert upstream.closed
+    assert cache.get("key") is None
+
+    # A later request starts a new generation
+    assert "".join(cache.stream("key", upstream)) == "abc"
+    assert upstream.started == 2
+
+
+def test_errors_reach_every_request_and_are_not_cached(cache):
+    upstream = Upstream(["a"], error=ValueError("upstream failed"))
+    leader = cache.stream("key", upstream)
+    assert next(leader) == "a"
+    follower = cache.stream("key", upstream)
+    assert next(follower) == "a"
+
+    with pytest.raises(ValueError):
+        list(follower)
+    with pytest.raises(ValueError):
+        list(leader)
+    assert cache.get("key") is None
+
+
+def test_expired_generations_are_produced_again(cache, monkeypatch):
+    upstream = Upstream(["a"])
+    now = 1000.0
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now)
+    assert "".join(cache.stream("key", upstream)) == "a"
+
+    now += 59
+    assert cache.get("key") == "a"
+    now += 2
+    assert cache.get("key") is None
+    assert "".join(cache.stream("key", upstream)) == "a"
+    assert upstream.started == 2
+
+
+def test_waiting_for_a_stalled_generation_times_out(cache):
+    upstream = Upstream(["a"])
+    in_flight = llm_cache._InFlight()
+    in_flight.pulling = True
+    in_flight.consumers = 1
+    with pytest.raises(TimeoutError):
+        next(cache._consume("key", in_flight, upstream, timeout=0.01))
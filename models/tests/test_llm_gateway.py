@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+import llm_gateway
+from llm_gateway import BackendBusyError, BackendLimiter, acquire_slot, release_slot
+
+
+@pytest.fixture
+def limiter(monkeypatch):
+    limiter = BackendLimiter(limit=2, max_queue=8)
+    monkeypatch.setitem(llm_gateway._limiters, "test", limiter)
+    monkeypatch.setattr(llm_gateway, "LLM_QUEUE_TIMEOUT", 0.05)
+    return limiter
+
+
+def assert_idle(limiter):
+    assert limiter.in_flight == 0 and limiter.waiting == 0
+    assert limiter.semaphore._value == limiter.limit
+
+
+def test_waiting_on_a_saturated_limiter_times_out(limiter):
+    async def main():
+        await acquire_slot("test")
+        await acquire_slot("test")
+        with pytest.raises(BackendBusyError):
+            await acquire_slot("test")
+        release_slot("test")
+        release_slot("test")
+
+    asyncio.run(main())
+    assert_idle(limiter)
+
+
+def test_queue_is_bounded(limiter):
+    limiter.max_queue = 0
+
+    async def main():
+        await acquire_slot("test")
+        await acquire_slot("test")
+        with pytest.raises(BackendBusyError):
+            await acquire_slot("test")
+        assert limiter.waiting == 0
+        release_slot("test")
+        release_slot("test")
+
+    asyncio.run(main())
+    assert_idle(limiter)
+
+
+def test_slots_released_around_the_timeout_are_never_lost(limiter):
+    # Slots are given back around the moment the waiters time out, so some are granted
+    # as the wait ends; every one of them must be either used or given back
+    async def waiter():
+        try:
+            await acquire_slot("test")
+        except BackendBusyError:
+            return
+        await asyncio.sleep(0)
+        release_slot("test")
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        for round in range(40):
+            await acquire_slot("test")
+            await acquire_slot("test")
+            waiters = [asyncio.ensure_future(waiter()) for _ in range(4)]
+            delay = llm_gateway.LLM_QUEUE_TIMEOUT + (round - 20) * 0.0005
+            loop.call_later(delay, release_slot, "test")
+            loop.call_later(delay, release_slot, "test")
+            await asyncio.gather(*waiters)
+            await asyncio.sleep(0.01)
+            assert limiter.semaphore._value == limiter.limit
+
+    asyncio.run(main())
+    assert_idle(limiter)
+
+
+def test_cancelled_waiters_give_back_a_granted_slot(limiter):
+    async def main():
+        await acquire_slot("test")
+        await acquire_slot("test")
+        waiter = asyncio.ensure_future(acquire_slot("test"))
+        await asyncio.sleep(0)
+        # The slot is handed to the waiter in the same step as the waiter is cancelled
+        release_slot("test")
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        release_slot("test")
+
+    asyncio.run(main())
+    assert_idle(limiter)
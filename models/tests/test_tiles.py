@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from tiles import TilePyramid, project
+
+MAX_ZOOM = 6
+BINS = 8
+
+
+def brute_force_bins(latitude, longitude, zoom):
+    # Counts of every (bin_x, bin_y) at a zoom level, binned point by point
+    x, y = project(latitude, longitude, zoom)
+    counts = {}
+    for bin_x, bin_y in zip((x * BINS).astype(int), (y * BINS).astype(int)):
+        counts[(bin_x, bin_y)] = counts.get((bin_x, bin_y), 0) + 1
+    return counts
+
+
+def brute_force_tile(counts, tile_x, tile_y):
+    intensity = np.zeros((BINS, BINS), dtype=np.int64)
+    for (bin_x, bin_y), count in counts.items():
+        if bin_x // BINS == tile_x and bin_y // BINS == tile_y:
+            intensity[bin_y % BINS, bin_x % BINS] = count
+    return intensity
+
+
+def brute_force_viewport(counts, zoom, south, west, north, east):
+    (left, right), (top, bottom) = project(np.array([north, south]), np.array([west, east]), zoom)
+    left, right, top, bottom = int(left * BINS), int(right * BINS), int(top * BINS), int(bottom * BINS)
+    return sorted(count for (bin_x, bin_y), count in counts.items() if left <= bin_x <= right and top <= bin_y <= bottom)
+
+
+def random_points(rng, size):
+    # Clustered around a city so that tiles hold several points per bin
+    return 12.97 + rng.normal(0, 0.5, size), 77.59 + rng.normal(0, 0.5, size)
+
+
+def assert_matches(pyramid, latitude, longitude):
+    for zoom in range(MAX_ZOOM + 1):
+        counts = brute_force_bins(latitude, longitude, zoom)
+        for tile_x, tile_y in {(bin_x // BINS, bin_y // BINS) for bin_x, bin_y in counts}:
+            np.testing.assert_array_equal(pyramid.tile(zoom, tile_x, tile_y), brute_force_tile(counts, tile_x, tile_y))
+        for box in [(12.5, 77.0, 13.5, 78.0), (12.9, 77.5, 13.0, 77.7), (-10.0, -10.0, 10.0, 10.0)]:
+            _, _, viewport_counts = pyramid.viewport(zoom, *box)
+            assert sorted(viewport_counts.tolist()) == brute_force_viewport(counts, zoom, *box)
+
+
+@pytest.mark.parametrize("seed", [1, 2])
+def test_tiles_and_viewports_match_brute_force_binning(seed):
+    rng = np.random.default_rng(seed)
+    latitude, longitude = random_points(rng, 2000)
+    pyramid = TilePyramid(latitude, longitude, max_zoom=MAX_ZOOM, bins=BINS)
+    assert_matches(pyramid, latitude, longitude)
+
+    added_latitude, added_longitude = random_points(rng, 300)
+    pyramid.add_points(added_latitude, added_longitude)
+    assert_matches(pyramid, np.concatenate([latitude, added_latitude]), np.concatenate([longitude, added_longitude]))
+
+
+def test_empty_tile_and_viewport():
+    pyramid = TilePyramid(np.array([12.97]), np.array([77.59]), max_zoom=MAX_ZOOM, bins=BINS)
+    assert pyramid.tile(MAX_ZOOM, 0, 0).sum() == 0
+    assert len(pyramid.viewport(MAX_ZOOM, -40.0, -40.0, -30.0, -30.0)[2]) == 0
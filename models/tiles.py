@@ -0,0 +1,226 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Deepest zoom level the pyramid is built for; deeper requests are served from it
+MAX_ZOOM = 16
+# Each tile is divided into TILE_BINS x TILE_BINS intensity bins
+TILE_BINS = 64
+# Web Mercator cannot represent the poles
+MAX_LATITUDE = 85.05112878
+# Number of filtered pyramids (per district / Crime_Type combination) kept in memory
+FILTERED_PYRAMIDS = 32
+
+
+def project(latitude, longitude, zoom):
+    """
+    Projects coordinates to Web Mercator tile units at a zoom level.
+
+    Args:
+        latitude, longitude: Arrays of coordinates in degrees.
+        zoom: The zoom level.
+
+    Returns:
+        Two float arrays (x, y); the integer part is the slippy-map tile number.
+    """
+    scale = 2.0 ** zoom
+    latitude = np.radians(np.clip(latitude, -MAX_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(longitude, dtype=np.float64) + 180.0) / 360.0 * scale
+    y = (1.0 - np.log(np.tan(latitude) + 1.0 / np.cos(latitude)) / np.pi) / 2.0 * scale
+    return np.clip(x, 0, scale - 1e-9), np.clip(y, 0, scale - 1e-9)
+
+
+def unproject(x, y, zoom):
+    """
+    Converts Web Mercator tile units at a zoom level back to latitude and longitude.
+    """
+    scale = 2.0 ** zoom
+    longitude = np.asarray(x, dtype=np.float64) / scale * 360.0 - 180.0
+    latitude = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * np.asarray(y, dtype=np.float64) / scale))))
+    return latitude, longitude
+
+
+class TilePyramid:
+    """
+    Point counts of the crime data binned on every zoom level of the slippy-map tile grid.
+
+    Each level is stored sparsely as sorted bin codes with their counts. Codes are ordered
+    by tile first, so the bins of a tile are one contiguous run found with a binary search.
+    The deepest level is histogrammed from the points; each shallower level is derived
+    from the one below by merging 2 x 2 blocks of bins.
+
+    Args:
+        latitude, longitude: Arrays of point coordinates in degrees.
+        max_zoom: Deepest zoom level to build.
+        bins: Bins per tile side.
+    """
+
+    def __init__(self, latitude, longitude, max_zoom=MAX_ZOOM, bins=TILE_BINS):
+        self.max_zoom = max_zoom
+        self.bins = bins
+        self.levels = {}
+        self._lock = threading.Lock()
+        self._build(*self._bin_points(latitude, longitude))
+
+    def _bin_points(self, latitude, longitude):
+        # Global bin coordinates of every point at the deepest zoom level
+        x, y = project(latitude, longitude, self.max_zoom)
+        return (x * self.bins).astype(np.int64), (y * self.bins).astype(np.int64)
+
+    def _encode(self, zoom, bin_x, bin_y):
+        bins = self.bins
+        tiles_per_side = 1 << zoom
+        tile = (bin_y // bins) * tiles_per_side + (bin_x // bins)
+        return tile * bins * bins + (bin_y % bins) * bins + (bin_x % bins)
+
+    def _decode(self, zoom, codes):
+        bins = self.bins
+        tiles_per_side = 1 << zoom
+        tile, local = np.divmod(codes, bins * bins)
+        tile_y, tile_x = np.divmod(tile, tiles_per_side)
+        local_y, local_x = np.divmod(local, bins)
+        return tile_x * bins + local_x, tile_y * bins + local_y
+
+    def _build(self, bin_x, bin_y, counts=None):
+        self.levels = self._levels(bin_x, bin_y, counts)
+
+    def _levels(self, bin_x, bin_y, counts=None):
+        # Sorted unique bin codes and their counts on every zoom level
+        levels = {}
+        codes = self._encode(self.max_zoom, bin_x, bin_y)
+        for zoom in range(self.max_zoom, -1, -1):
+            if zoom < self.max_zoom:
+                # Halve the bin coordinates of the level below to merge its 2 x 2 blocks
+                bin_x, bin_y = self._decode(zoom + 1, codes)
+                codes = self._encode(zoom, bin_x >> 1, bin_y >> 1)
+            codes, inverse = np.unique(codes, return_inverse=True)
+            weights = None if counts is None else counts
+            counts = np.bincount(inverse, weights=weights, minlength=len(codes)).astype(np.int64)
+            levels[zoom] = (codes, counts)
+        return levels
+
+    def add_points(self, latitude, longitude):
+        """
+        Adds newly ingested points to every level of the pyramid.
+
+        The new points are binned on their own and merged into each level's sorted codes.
+        Binning grows with the number of new points, but the merge copies every level's
+        arrays, so each call also costs time linear in the bins of the whole pyramid;
+        ingested rows are therefore added in batches rather than one at a time.
+        """
+        if len(latitude) == 0:
+            return
+        added = self._levels(*self._bin_points(latitude, longitude))
+        with self._lock:
+            levels = {}
+            for zoom, (codes, counts) in self.levels.items():
+                new_codes, new_counts = added[zoom]
+                at = np.searchsorted(codes, new_codes)
+                existing = at < len(codes)
+                existing[existing] = codes[at[existing]] == new_codes[existing]
+                counts = counts.copy()
+                counts[at[existing]] += new_counts[existing]
+                levels[zoom] = (
+                    np.insert(codes, at[~existing], new_codes[~existing]),
+                    np.insert(counts, at[~existing], new_counts[~existing]),
+                )
+            self.levels = levels
+
+    def tile(self, zoom, tile_x, tile_y):
+        """
+        Returns the intensity of every bin of a tile as a (bins x bins) array, rows north to south.
+        """
+        zoom = min(zoom, self.max_zoom)
+        codes, counts = self.levels[zoom]
+        size = self.bins * self.bins
+        first = ((tile_y << zoom) + tile_x) * size
+        start, stop = np.searchsorted(codes, [first, first + size])
+        intensity = np.zeros(size, dtype=np.int64)
+        intensity[codes[start:stop] - first] = counts[start:stop]
+        return intensity.reshape(self.bins, self.bins)
+
+    def viewport(self, zoom, south, west, north, east):
+        """
+        Returns the non-empty bins inside a bounding box at a zoom level.
+
+        Returns:
+            Three arrays: the latitude and longitude of each bin centre and its count.
+        """
+        zoom = max(0, min(zoom, self.max_zoom))
+        codes, counts = self.levels[zoom]
+        (left, right), (top, bottom) = project(np.array([north, south]), np.array([west, east]), zoom)
+        left, top = int(left * self.bins), int(top * self.bins)
+        right, bottom = int(right * self.bins), int(bottom * self.bins)
+
+        # The tiles of one tile row overlapping the box are a contiguous run of codes, so
+        # only those runs are decoded instead of every bin of the level
+        size = self.bins * self.bins
+        tile_rows = np.arange(top // self.bins, bottom // self.bins + 1, dtype=np.int64) << zoom
+        starts = np.searchsorted(codes, (tile_rows + left // self.bins) * size)
+        stops = np.searchsorted(codes, (tile_rows + right // self.bins + 1) * size)
+        lengths = stops - starts
+        ends = np.cumsum(lengths)
+        positions = np.arange(ends[-1] if len(ends) else 0, dtype=np.int64) + np.repeat(starts - (ends - lengths), lengths)
+
+        bin_x, bin_y = self._decode(zoom, codes[positions])
+        inside = (bin_x >= left) & (bin_x <= right) & (bin_y >= top) & (bin_y <= bottom)
+        latitude, longitude = unproject((bin_x[inside] + 0.5) / self.bins, (bin_y[inside] + 0.5) / self.bins, zoom)
+        return latitude, longitude, counts[positions[inside]]
+
+
+class PyramidCache:
+    """
+    The pyramid of all points plus a small LRU of pyramids built for filtered subsets.
+
+    Args:
+        frame: The cleaned crime DataFrame.
+        filter_columns: Columns the pyramids may be filtered on.
+        size: Number of filtered pyramids to keep.
+    """
+
+    def __init__(self, frame, filter_columns=("district_name", "Crime_Type"), size=FILTERED_PYRAMIDS):
+        self.frame = frame
+        self.filter_columns = [column for column in filter_columns if column in frame.columns]
+        self.size = size
+        self.full = TilePyramid(frame['latitude'].to_numpy(), frame['longitude'].to_numpy())
+        self._filtered = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, **filters):
+        """
+        Returns the pyramid of the rows matching every given column=value filter.
+        """
+        filters = tuple((column, value) for column, value in sorted(filters.items()) if value)
+        if not filters:
+            return self.full
+        with self._lock:
+            pyramid = self._filtered.get(filters)
+            if pyramid is not None:
+                self._filtered.move_to_end(filters)
+                return pyramid
+
+        mask = np.ones(len(self.frame), dtype=bool)
+        for column, value in filters:
+            mask &= (self.frame[column] == value).to_numpy(dtype=bool)
+        subset = self.frame.loc[mask]
+        pyramid = TilePyramid(subset['latitude'].to_numpy(), subset['longitude'].to_numpy())
+
+        with self._lock:
+            self._filtered[filters] = pyramid
+            while len(self._filtered) > self.size:
+                self._filtered.popitem(last=False)
+        return pyramid
+
+    def apply_rows(self, frame, combined):
+        """
+        Adds newly ingested rows to the full pyramid and drops the filtered ones.
+
+        Args:
+            frame: The new rows.
+            combined: The whole dataset including the new rows, used for later filtered builds.
+        """
+        self.full.add_points(frame['latitude'].to_numpy(), frame['longitude'].to_numpy())
+        with self._lock:
+            self.frame = combined
+            self._filtered.clear()